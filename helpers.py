@@ -21,13 +21,21 @@
 #*****************************************************************************
 
 import os
-import sys
 import re
+import glob
+import signal
 import subprocess
+import hashlib
+import pickle
+import json
+import mmap
+import struct
+from collections import namedtuple
 import gfapy
 from gfapy.sequence import rc
 from Bio import SeqIO
 from datetime import datetime
+from runner import popen_limited, wait_process, run_tool
 
 
 #----------------------------------------------------
@@ -210,38 +218,164 @@ class Scaffold(Gap):
     
 
 
+#----------------------------------------------------
+# GFA tables (parsed GFA, cached in a binary sidecar)
+#----------------------------------------------------
+class SegmentRecord(namedtuple("SegmentRecord", ["name", "slen", "UR", "line_str"])):
+    '''Segment ('S' line) of the GFA, with the attributes used by the class Scaffold'''
+    __slots__ = ()
+    def __str__(self):
+        return self.line_str
+
+class OrientedSegment(namedtuple("OrientedSegment", ["name", "orient", "line"])):
+    '''Oriented reference to a segment, as found in the 'sid1'/'sid2' fields of a 'G' line'''
+    __slots__ = ()
+    def __str__(self):
+        return str(self.name) + str(self.orient)
+
+class GapRecord(namedtuple("GapRecord", ["gid", "sid1", "sid2", "disp", "line_str"])):
+    '''Gap ('G' line) of the GFA, with the attributes used by the class Gap'''
+    __slots__ = ()
+    def __str__(self):
+        return self.line_str
+
+class GfaTables:
+    '''
+    Class defining the tables of a parsed GFA file:
+    - the header lines, the segments and the gaps of the GFA
+    - all its lines (as strings)
+    '''
+
+    #Constructor
+    def __init__(self, headers, segments, gaps, lines):
+        self.headers = headers
+        self.lines = lines
+        self.segments = [SegmentRecord(*s) for s in segments]
+        segment_by_name = {s.name: s for s in self.segments}
+        self.gaps = []
+        for (gid, name1, orient1, name2, orient2, disp, line_str) in gaps:
+            sid1 = OrientedSegment(name1, orient1, segment_by_name.get(name1))
+            sid2 = OrientedSegment(name2, orient2, segment_by_name.get(name2))
+            self.gaps.append(GapRecord(gid, sid1, sid2, disp, line_str))
+        self.gap_by_line = {g.line_str: g for g in self.gaps}
+
+    #Method "from_gfapy"
+    @classmethod
+    def from_gfapy(cls, gfa):
+        '''Method to build the tables from a 'gfapy.Gfa' object'''
+        headers = [str(h) for h in gfa.headers]
+        segments = [(s.name, s.slen, s.get("UR"), str(s)) for s in gfa.segments]
+        gaps = [(str(g.gid), g.sid1.name, g.sid1.orient, g.sid2.name, g.sid2.orient, g.disp, str(g)) for g in gfa.gaps]
+        lines = [str(l) for l in gfa.lines]
+        return cls(headers, segments, gaps, lines)
+
+    #Method "payload"
+    def payload(self):
+        '''Method to get the plain tuples saved in the sidecar file'''
+        segments = [tuple(s) for s in self.segments]
+        gaps = [(g.gid, g.sid1.name, g.sid1.orient, g.sid2.name, g.sid2.orient, g.disp, g.line_str) for g in self.gaps]
+        return (self.headers, segments, gaps, self.lines)
+
+
+#Sidecar file: header (magic, version, GFA size, GFA mtime, GFA inode, GFA hash, payload length) followed by the pickled tables
+GFA_CACHE_MAGIC = b"MTGLGFA\x00"
+GFA_CACHE_VERSION = 2
+GFA_CACHE_HEADER = struct.Struct("<8sIQQQ32sQ")
+
+#Function to get the hash of a file (blake2b, read by blocks)
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+#----------------------------------------------------
+# load_gfa_tables function
+#----------------------------------------------------
+'''
+To load the tables of a GFA file:
+    - it takes as input the GFA file, and optionally the path of the sidecar cache file (by default: '<gfa_file>.mtglink.cache')
+    - it reuses the sidecar file (memory-mapped) if the size, the mtime and the inode of the GFA file match the ones saved in it; if only its mtime or inode changed (e.g. GFA file touched or copied),
+      the GFA file is hashed, and the sidecar file is reused (and its header updated) if the hash matches
+    - otherwise, or if the sidecar file can't be loaded (e.g. written by another version of MTG-Link), it parses the GFA file with gfapy and (re)writes the sidecar file
+      (nothing is read nor written with 'use_cache=False')
+    - it outputs the 'GfaTables' object
+'''
+def load_gfa_tables(gfa_file, cache_file=None, use_cache=True):
+    if cache_file is None:
+        cache_file = str(gfa_file) + ".mtglink.cache"
+    stat = os.stat(gfa_file)
+    digest = None
+
+    #Reuse the sidecar file if it is still valid (the GFA file being hashed only if its mtime or inode changed)
+    if use_cache and os.path.exists(cache_file):
+        try:
+            with open(cache_file, "r+b") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as cache:
+                magic, version, size, mtime_ns, inode, cached_digest, payload_len = GFA_CACHE_HEADER.unpack_from(cache, 0)
+                if (magic, version, size) == (GFA_CACHE_MAGIC, GFA_CACHE_VERSION, stat.st_size) and GFA_CACHE_HEADER.size + payload_len <= len(cache):
+                    if (mtime_ns, inode) != (stat.st_mtime_ns, stat.st_ino):
+                        digest = file_digest(gfa_file)
+                    if digest is None or digest == cached_digest:
+                        with memoryview(cache) as view, view[GFA_CACHE_HEADER.size:(GFA_CACHE_HEADER.size + payload_len)] as payload:
+                            tables = GfaTables(*pickle.loads(payload))
+                        if digest is not None:
+                            f.write(GFA_CACHE_HEADER.pack(GFA_CACHE_MAGIC, GFA_CACHE_VERSION, stat.st_size, stat.st_mtime_ns, stat.st_ino, digest, payload_len))
+                        return tables
+        except Exception as e:
+            print("Warning: The GFA cache file {} is invalid ({}), the GFA file will be parsed again".format(cache_file, e))
+
+    #Parse the GFA file
+    tables = GfaTables.from_gfapy(gfapy.Gfa.from_file(gfa_file))
+
+    #Save the tables to the sidecar file (written to a temporary file, then renamed)
+    if use_cache:
+        payload = pickle.dumps(tables.payload(), protocol=pickle.HIGHEST_PROTOCOL)
+        header = GFA_CACHE_HEADER.pack(GFA_CACHE_MAGIC, GFA_CACHE_VERSION, stat.st_size, stat.st_mtime_ns, stat.st_ino, (digest if digest is not None else file_digest(gfa_file)), len(payload))
+        tmp_cache_file = cache_file + ".tmp." + str(os.getpid())
+        try:
+            with open(tmp_cache_file, "wb") as f:
+                f.write(header)
+                f.write(payload)
+            os.replace(tmp_cache_file, cache_file)
+        except OSError:
+            print("Warning: Unable to write the GFA cache file {}".format(cache_file))
+            if os.path.exists(tmp_cache_file):
+                os.remove(tmp_cache_file)
+
+    return tables
+
+
 #----------------------------------------------------
 # extract_barcodes function
 #----------------------------------------------------
 '''
 To extract the barcodes of reads mapping on chunks, with BamExtractor:
-    - it takes as input the BAM file, the gap label, the chunk region on which to extract the barcodes, and the dictionary 'barcodes_occ'
+    - it takes as input the BAM file, the gap label, the chunk region on which to extract the barcodes, the dictionary 'barcodes_occ' and the directory of the log file
     - it outputs the updated dictionary 'barcodes_occ' containing the occurences for each barcode extracted on the chunk region
 '''
-def extract_barcodes(bam, gap_label, region, barcodes_occ):
+def extract_barcodes(bam, gap_label, region, barcodes_occ, log_dir="."):
     command = ["BamExtractor", bam, region]
-    bamextractorLog = str(gap_label) + "_bamextractor.log"
-    tmp_barcodes_file = str(gap_label) + "_bam-extractor-stdout.txt"
-
-    #BamExtractor
-    with open(tmp_barcodes_file, "w+") as f, open(bamextractorLog, "a") as log:
-        subprocess.run(command, stdout=f, stderr=log)
-        f.seek(0)
-
-        #Save the barcodes and their occurences in the dict 'barcodes_occ'
-        for line in f.readlines():
-            #remove the '-1' at the end of the sequence
-            barcode_seq = line.split('-')[0]
-            #count occurences of each barcode and save them in the dict 'barcodes_occ'
-            if barcode_seq in barcodes_occ:
-                barcodes_occ[barcode_seq] += 1
-            else:
-                barcodes_occ[barcode_seq] = 1
+    bamextractorLog = os.path.join(log_dir, str(gap_label) + "_bamextractor.log")
+
+    #BamExtractor (its standard output is read in memory)
+    with open(bamextractorLog, "a") as log:
+        output = subprocess.run(command, stdout=subprocess.PIPE, stderr=log).stdout
+
+    #Save the barcodes and their occurences in the dict 'barcodes_occ'
+    for line in output.decode().splitlines(keepends=True):
+        #remove the '-1' at the end of the sequence
+        barcode_seq = line.split('-')[0]
+        #count occurences of each barcode and save them in the dict 'barcodes_occ'
+        if barcode_seq in barcodes_occ:
+            barcodes_occ[barcode_seq] += 1
+        else:
+            barcodes_occ[barcode_seq] = 1
 
     #remove the raw files obtained from BamExtractor
-    subprocess.run(["rm", tmp_barcodes_file])
     if os.path.getsize(bamextractorLog) <= 0:
-        subprocess.run(["rm", bamextractorLog])
+        os.remove(bamextractorLog)
 
     return barcodes_occ
 
@@ -251,12 +385,12 @@ def extract_barcodes(bam, gap_label, region, barcodes_occ):
 #----------------------------------------------------
 '''
 To extract the the reads associated to the barcodes:
-    - it takes as input the reads file, the barcodes index file, the gap label, the file containing the barcodes of the union, and the name of the output file containing the reads of the union
+    - it takes as input the reads file, the barcodes index file, the gap label, the file containing the barcodes of the union, the output file containing the reads of the union and the directory of the log file
     - it outputs the file containing the reads of the union
 '''
-def get_reads(reads, index, gap_label, barcodes, out_reads):
+def get_reads(reads, index, gap_label, barcodes, out_reads, log_dir="."):
     command = ["reads_bx_sqlite3.py", "--fastq", reads, "--idx", index, "--bdx", barcodes, "--mode", "shelve"]
-    getreadsLog = str(gap_label) + ".barcodes.txt"
+    getreadsLog = os.path.join(log_dir, str(gap_label) + ".barcodes.txt")
 
     #reads_bx_sqlite3.py
     with open(getreadsLog, "a") as log:
@@ -266,50 +400,254 @@ def get_reads(reads, index, gap_label, barcodes, out_reads):
 
 
 #----------------------------------------------------
-# mtg_fill function
+# count_kmers function
 #----------------------------------------------------
 '''
-To execute MindTheGap fill:
-    - it takes as input the gap label, the file containing the reads of the union, the bkpt file, the kmer value, the abudance threshold for solid kmers values, the maximum number of nodes in the contig graph,
-      the maximum length of gap-filling (bp), the number of cores and the max memory (in MBytes) for graph building, the verbosity level and the prefix of the output file on which to save the results
-    - it outputs the results obtained from MindTheGap
+To count a few k-mers in the reads of a union, in one streaming pass over the reads file:
+    - it takes as input the reads file (FASTQ format) and the list of the k-mers to count (of any sizes)
+    - it outputs a dictionary with each k-mer as key and its number of occurrences in the reads, on both strands (k-mer and reverse complement), as value
+'''
+def count_kmers(reads_file, kmers):
+    counts = dict((kmer, 0) for kmer in kmers)
+
+    #Sequences to search in the reads (k-mer and reverse complement, searched once even if several k-mers share them)
+    patterns = {}
+    for kmer in counts:
+        if len(kmer) == 0:
+            continue
+        for pattern in set([kmer.upper(), rc(kmer).upper()]):
+            patterns.setdefault(pattern, []).append(kmer)
+
+    with open(reads_file, "r") as reads:
+        for nb_line, line in enumerate(reads):
+            if nb_line % 4 != 1:
+                continue
+            sequence = line.rstrip("\n").upper()
+            for pattern, pattern_kmers in patterns.items():
+                start = sequence.find(pattern)
+                while start != -1:
+                    for kmer in pattern_kmers:
+                        counts[kmer] += 1
+                    start = sequence.find(pattern, start + 1)
+
+    return counts
+
+
+#----------------------------------------------------
+# kmer_spectrum function
+#----------------------------------------------------
+'''
+To estimate the k-mer spectrum of the reads of a union, for several k values, in one streaming pass over the reads file:
+    - it takes as input the reads file (FASTQ format) and the list of the k values
+    - it outputs a dictionary with each k as key and the summary of its spectrum as value: the number of distinct k-mers sampled ('Nb_kmers'), the fraction of them seen only once ('Singletons', mostly sequencing errors),
+      and the k-mer coverage ('Coverage': the abundance c >= 2 holding the most k-mer occurrences c * h(c), h being the histogram of the abundances, or 0 if no k-mer is seen twice)
+The k-mers are sampled on both strands as the ones starting with 'SPECTRUM_PREFIX' (about 1 k-mer out of 64, found at the speed of 'str.find'): the abundance of a sampled k-mer is its exact abundance in the union.
 '''
-def mtg_fill(gap_label, input_file, bkpt, k, a, max_nodes, max_length, nb_cores, max_memory, verbose, output_prefix):
+SPECTRUM_PREFIX = "ACA"
+
+def kmer_spectrum(reads_file, k_values):
+    abundances = dict((k, {}) for k in k_values)
+    with open(reads_file, "r") as reads:
+        for nb_line, line in enumerate(reads):
+            if nb_line % 4 != 1:
+                continue
+            sequence = line.rstrip("\n").upper()
+            for strand in (sequence, rc(sequence).upper()):
+                start = strand.find(SPECTRUM_PREFIX)
+                while start != -1:
+                    for k in k_values:
+                        if start + k <= len(strand):
+                            kmer = strand[start:(start + k)]
+                            if "N" not in kmer:
+                                abundances[k][kmer] = abundances[k].get(kmer, 0) + 1
+                    start = strand.find(SPECTRUM_PREFIX, start + 1)
+
+    spectrum = {}
+    for k in k_values:
+        histogram = {}
+        for abundance in abundances[k].values():
+            histogram[abundance] = histogram.get(abundance, 0) + 1
+        nb_kmers = len(abundances[k])
+        solid = [(abundance * count, abundance) for abundance, count in histogram.items() if abundance >= 2]
+        spectrum[k] = {"Nb_kmers": nb_kmers, "Singletons": (float(histogram.get(1, 0)) / nb_kmers if nb_kmers > 0 else 0.0), "Coverage": (max(solid)[1] if solid != [] else 0)}
+    return spectrum
+
+
+#----------------------------------------------------
+# select_kmer_abundance function
+#----------------------------------------------------
+'''
+To select the promising (k, a) combinations of a gap from the k-mer spectrum of its union:
+    - it takes as input the spectrum obtained with the function 'kmer_spectrum', and the lists of k values and abundance thresholds (in the order of the sweep)
+    - it outputs the list of the (k, a) combinations whose k-mer coverage is at least 'SPECTRUM_SOLID_RATIO' times 'a' (the k-mers of the gap can then be solid), in the order of the sweep,
+      the first one being the most promising (highest k and a); all the combinations if none of them is promising
+'''
+SPECTRUM_SOLID_RATIO = 2
+
+def select_kmer_abundance(spectrum, k_values, a_values):
+    combinations = [(k, a) for k in k_values for a in a_values if spectrum[k]["Coverage"] >= SPECTRUM_SOLID_RATIO * a]
+    if combinations == []:
+        combinations = [(k, a) for k in k_values for a in a_values]
+    return combinations
+
+
+#----------------------------------------------------
+# mtg_fill_command function
+#----------------------------------------------------
+#Function to get the command line of MindTheGap fill
+def mtg_fill_command(input_file, bkpt, k, a, max_nodes, max_length, nb_cores, max_memory, verbose, output_prefix):
     if max_memory == 0:
         command = ["MindTheGap", "fill", "-in", input_file, "-bkpt", bkpt, "-kmer-size", str(k), "-abundance-min", str(a), "-max-nodes", str(max_nodes), "-max-length", str(max_length), \
                     "-nb-cores", str(nb_cores), "-verbose", str(verbose), "-out", output_prefix]
     else:
         command = ["MindTheGap", "fill", "-in", input_file, "-bkpt", bkpt, "-kmer-size", str(k), "-abundance-min", str(a), "-max-nodes", str(max_nodes), "-max-length", str(max_length), \
                     "-nb-cores", str(nb_cores), "-max-memory", str(max_memory), "-verbose", str(verbose), "-out", output_prefix]
-    mtgfillLog = str(gap_label) + "_mtgfill.log"
+    return command
 
-    with open(mtgfillLog, "a") as log:
-        subprocess.run(command, stderr=log)
-        output = subprocess.check_output(command)
+
+#----------------------------------------------------
+# mtg_fill function
+#----------------------------------------------------
+'''
+To execute MindTheGap fill (run once, with its standard output and error streamed to the log file of the gap):
+    - it takes as input the gap label, the file containing the reads of the union, the bkpt file, the kmer value, the abudance threshold for solid kmers values, the maximum number of nodes in the contig graph,
+      the maximum length of gap-filling (bp), the number of cores and the max memory (in MBytes) for graph building, the verbosity level and the prefix of the output file on which to save the results,
+      and optionally the wall-clock and CPU time limits (s) of the MindTheGap process and its working directory (for its temporary files)
+    - the log file is saved in the directory of the output files
+    - it outputs the 'ProcessResult' of the MindTheGap process (exit status, peak RSS, CPU and wall-clock times, timeout)
+'''
+def mtg_fill(gap_label, input_file, bkpt, k, a, max_nodes, max_length, nb_cores, max_memory, verbose, output_prefix, timeout=None, cpu_limit=None, cwd=None):
+    command = mtg_fill_command(input_file, bkpt, k, a, max_nodes, max_length, nb_cores, max_memory, verbose, output_prefix)
+    mtgfillLog = os.path.join(os.path.dirname(output_prefix), str(gap_label) + "_mtgfill.log")
+
+    result = run_tool(command, mtgfillLog, cwd=cwd, timeout=timeout, cpu_limit=cpu_limit)
 
     #remove the raw files obtained from MindTheGap
     if os.path.getsize(mtgfillLog) <= 0:
-        subprocess.run(["rm", mtgfillLog])
+        os.remove(mtgfillLog)
 
-    return output
+    return result
 
 
 #----------------------------------------------------
-# stats_align function
+# MtgProcess class
 #----------------------------------------------------
-#Function to do statistics on the alignment between a reference sequence and query sequences
-def stats_align(gap_label, qry_file, ref_file, ext, prefix, out_dir):
-    scriptPath = sys.path[0]
-    stats_align_command = os.path.join(scriptPath, "stats_alignment.py")
-    command = [stats_align_command, "-qry", qry_file, "-ref", ref_file, "-ext", ext, "-p", prefix, "-out", out_dir]
-    statsLog = str(gap_label) + "_stats_align.log"
+class MtgProcess:
+    '''
+    Class defining a MindTheGap fill process started in the background (speculative run of a (k, a) combination):
+    - the command, the path prefix of its output files (the log file being saved in the same directory) and its working directory 'cwd' (for its temporary files)
+    - the 'subprocess.Popen' object (own process group, so that it can be killed with all its children), with its wall-clock and CPU time limits
+    - the resources taken for the run, and the function to give them back once the run is done or cancelled
+    '''
+
+    #Constructor
+    def __init__(self, gap_label, command, output_prefix, cwd, resources=None, release=None, timeout=None, cpu_limit=None):
+        self.output_prefix = output_prefix
+        self.cwd = cwd
+        self.resources = resources
+        self.release = release
+        self.log = open(os.path.join(os.path.dirname(output_prefix), str(gap_label) + "_mtgfill.log"), "a")
+        self.process = popen_limited(command, timeout=timeout, cpu_limit=cpu_limit, stdout=self.log, stderr=self.log, cwd=cwd)
+
+    #Method "_done"
+    def _done(self):
+        '''Method to close the log and give back the resources of the run'''
+        self.log.close()
+        if self.release is not None:
+            self.release(self.resources)
+            self.release = None
+
+    #Method "wait"
+    def wait(self):
+        '''Method to wait for the end of the run; it outputs the 'ProcessResult' of the run'''
+        result = wait_process(self.process)
+        self._done()
+        return result
+
+    #Method "cancel"
+    def cancel(self):
+        '''Method to kill the run (if still running) and remove its output files'''
+        if self.process.returncode is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            wait_process(self.process)
+        self._done()
+        remove_outputs(os.path.dirname(self.output_prefix), os.path.basename(self.output_prefix))
+
+#Function to remove the output files of a MindTheGap run ('<output_prefix>.*')
+def remove_outputs(directory, output_prefix):
+    for output_file in glob.glob(os.path.join(directory, glob.escape(output_prefix) + ".*")):
+        os.remove(output_file)
+
 
-    with open(statsLog, "a") as log:
-        subprocess.run(command, stderr=log)
+#----------------------------------------------------
+# MtgBatch class
+#----------------------------------------------------
+class MtgBatch:
+    '''
+    Class defining a group of gaps gap-filled together ('--batch'), with a single MindTheGap fill run per (k, a) combination on the union of the group:
+    - the name of the group and the directory of the output files of its runs ('<name>.k<k>.a<a>.bxu.*')
+    - the breakpoint files of the gaps of the group, for each k value
+    - the results ('ProcessResult') of the runs already done
+    '''
 
-    #remove the raw file obtained from statistics
-    if os.path.getsize(statsLog) <= 0:
-        subprocess.run(["rm", statsLog])
+    #Constructor
+    def __init__(self, name, out_dir):
+        self.name = name
+        self.out_dir = out_dir
+        self.bkpt_files = {}
+        self.results = {}
+
+    #Method "add_breakpoints"
+    def add_breakpoints(self, bkpt_files):
+        '''Method to add the breakpoint files of a gap of the group (dictionary with the k value as key)'''
+        for k, bkpt_file in bkpt_files.items():
+            self.bkpt_files.setdefault(k, []).append(bkpt_file)
+
+    #Method "output_prefix"
+    def output_prefix(self, k, a):
+        '''Method to get the path prefix of the output files of the run of the group for k and a'''
+        return os.path.join(self.out_dir, "{}.k{}.a{}.bxu".format(self.name, k, a))
+
+    #Method "run"
+    def run(self, k, a, fill):
+        '''Method to get the result of the run of the group for k and a, done with 'fill(bkpt_file, output_prefix)' if not done yet; it outputs the 'ProcessResult' of the run and whether it was done by this call'''
+        if (k, a) in self.results:
+            return self.results[(k, a)], False
+
+        #Breakpoint file of the group: the breakpoints of all its gaps
+        bkpt_file = os.path.join(self.out_dir, "{}.k{}.offset_rm.bkpt.fasta".format(self.name, k))
+        if not os.path.exists(bkpt_file):
+            with open(bkpt_file, "w") as bkpt:
+                for gap_bkpt_file in self.bkpt_files[k]:
+                    with open(gap_bkpt_file, "r") as gap_bkpt:
+                        bkpt.write(gap_bkpt.read().rstrip("\n") + "\n")
+
+        self.results[(k, a)] = fill(bkpt_file, self.output_prefix(k, a))
+
+        #The de Bruijn graph of the run is not needed by the gaps of the group (they only use its inserted sequences)
+        if os.path.exists(self.output_prefix(k, a) + ".h5"):
+            os.remove(self.output_prefix(k, a) + ".h5")
+        return self.results[(k, a)], True
+
+    #Method "split"
+    def split(self, k, a, gap_label, output_prefix):
+        '''Method to write the inserted sequences of a gap found by the run of the group for k and a (breakpoints 'bkptX_GapID.<gap_label>_Gaplen...') to the file 'output_prefix.insertions.fasta' of the gap'''
+        insertion_file = self.output_prefix(k, a) + ".insertions.fasta"
+        with open(output_prefix + ".insertions.fasta", "w") as gap_insertions:
+            if os.path.exists(insertion_file):
+                for record in SeqIO.parse(insertion_file, "fasta"):
+                    if record.id.split("_Gaplen.")[0].split("_GapID.", 1)[-1] == str(gap_label):
+                        SeqIO.write(record, gap_insertions, "fasta")
+
+    #Method "close"
+    def close(self):
+        '''Method to remove the output files of the runs of the group (except their '.info.txt' files) and its breakpoint files, once all its gaps are done'''
+        for output_file in glob.glob(os.path.join(self.out_dir, glob.escape(self.name) + ".*")):
+            if not output_file.endswith(".info.txt"):
+                os.remove(output_file)
 
 
 #----------------------------------------------------
@@ -382,10 +720,10 @@ def get_output_for_gfa(record, ext, k, s1, s2, left_scaffold, right_scaffold):
 
 
 #----------------------------------------------------
-# update_gfa_with_solution function
+# get_solution_lines function
 #----------------------------------------------------
-#Function to update the GFA when a solution is found for a gap
-def update_gfa_with_solution(outDir, gfa_name, output_for_gfa, gfa_output_file):
+#Function to get the lines to output when a solution is found for a gap: the FASTA record of the gap-filled seq, and the S and E lines of the GFA
+def get_solution_lines(outDir, gapfill_file, output_for_gfa):
 
     #Variables input
     sol_name = output_for_gfa[0]
@@ -398,38 +736,272 @@ def update_gfa_with_solution(outDir, gfa_name, output_for_gfa, gfa_output_file):
     s2 = (sol_name.split(':')[1]).split('_gf')[0]
     quality = output_for_gfa[6]
 
-    print("Updating the GFA file with the solution: " + sol_name)
+    #FASTA record of the found seq
+    fasta_record = ">{} _ len_{}_qual_{} ".format(sol_name, length_seq, quality) + "\n" + seq + "\n"
+
+    #Found seq (query seq) (S line) and the two corresponding E lines
+    gfa_lines = "S\t{}\t{}\t*\tUR:Z:{}\n".format(sol_name, length_seq, os.path.join(outDir, gapfill_file))
+    gfa_lines += "E\t*\t{}\t{}\t{}\t{}\t{}\t{}\t*\n".format(s1, solution, pos_1[0], pos_1[1], pos_1[2], pos_1[3])
+    gfa_lines += "E\t*\t{}\t{}\t{}\t{}\t{}\t{}\t*\n".format(solution, s2, pos_2[0], pos_2[1], pos_2[2], pos_2[3])
 
-    #Save the found seq to a file containing all gapfill seq
-    gapfill_file = gfa_name + ".gapfill_seq.fasta"
-    with open(gapfill_file, "a") as seq_fasta:
-        seq_fasta.write(">{} _ len_{}_qual_{} ".format(sol_name, length_seq, quality))
-        seq_fasta.write("\n" + seq + "\n")
+    return fasta_record, gfa_lines
 
-    with open(gfa_output_file, "a") as f:
-        '''
-        #Not used anymore, as I check in the gapfilling pipeline that the length of the solution found is > 2*ext to stop searching for a gapfilled seq
-        if length_seq < 2*ext:
-            print("Query length is too short (<2*ext): overlap of source and destination read")
-            print("Rewriting the gap line to the GFA output file...")
 
-            #Rewrite the current G line into GFA output
-            with open("tmp.gap", "r") as tmp_gap, open(gfa_output_file, "a") as f:
-                out_gfa = gfapy.Gfa.from_file(gfa_output_file)
-                for line in tmp_gap.readlines():
-                    out_gfa.add_line(line)
-                out_gfa.to_file(gfa_output_file)
+#----------------------------------------------------
+# GapOutputWriter class
+#----------------------------------------------------
+class GapOutputWriter:
+    '''
+    Class writing the results of each gap to the output files as soon as the gap is done:
+    - the '.union.sum' file, the output GFA file and the FASTA file of the gap-filled sequences (opened in append mode)
+    - the position (offset, length) of the block written for each gap in each file, used to reorder the files at the end of the run
+    '''
 
+    #Constructor
+    def __init__(self, outDir, union_sum_file, gfa_output_file, gapfill_file):
+        self.outDir = outDir
+        self.gapfill_file = gapfill_file
+        self.paths = [union_sum_file, gfa_output_file, gapfill_file]
+        self.files = [open(path, "ab") for path in self.paths]
+        self.blocks = {}
+        self.nb_solutions = 0
+
+    #Method "write_gap"
+    def write_gap(self, gap_key, union_summary, output_for_gfa):
+        '''Method to write the '.union.sum' row, and the GFA and FASTA lines of a gap, and flush them to disk'''
+        texts = ["\n" + '\t'.join(str(i) for i in union_summary), "", ""]
+
+        #solution found for the current gap
+        if len(output_for_gfa[0]) > 1:
+            for output in output_for_gfa:
+                print("Updating the GFA file with the solution: " + output[0])
+                fasta_record, gfa_lines = get_solution_lines(self.outDir, self.gapfill_file, output)
+                texts[2] += fasta_record
+                texts[1] += gfa_lines
+                self.nb_solutions += 1
+        #no solution found for the current gap
         else:
-        '''
-        #Add the found seq (query seq) to GFA output (S line)
-        out_gfa = gfapy.Gfa.from_file(gfa_output_file)
-        out_gfa.add_line("S\t{}\t{}\t*\tUR:Z:{}".format(sol_name, length_seq, os.path.join(outDir, gapfill_file)))
+            texts[1] = str(output_for_gfa[0][0]) + "\n"
+
+        blocks = []
+        for f, text in zip(self.files, texts):
+            data = text.encode()
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            blocks.append((offset, len(data)))
+        self.blocks.setdefault(gap_key, []).append(blocks)
+
+    #Method "close"
+    def close(self):
+        '''Method to close the output files'''
+        for f in self.files:
+            f.close()
+
+    #Method "reorder"
+    def reorder(self, gap_keys):
+        '''Method to rewrite the output files with the blocks of the gaps in the order of the list of gaps (deterministic output, independent of the completion order)'''
+        ordered_blocks = []
+        for gap_key in gap_keys:
+            ordered_blocks.extend(self.blocks.get(gap_key, []))
+
+        for n, path in enumerate(self.paths):
+            starts = [blocks[n][0] for blocks in ordered_blocks]
+            prefix_len = min(starts) if starts else os.path.getsize(path)
+            tmp_path = path + ".tmp"
+            with open(path, "rb") as original, open(tmp_path, "wb") as reordered:
+                reordered.write(original.read(prefix_len))
+                for blocks in ordered_blocks:
+                    offset, length = blocks[n]
+                    original.seek(offset)
+                    reordered.write(original.read(length))
+            os.replace(tmp_path, path)
+
 
-        #Write the two corresponding E lines into GFA output
-        out_gfa.add_line("E\t*\t{}\t{}\t{}\t{}\t{}\t{}\t*".format(s1, solution, pos_1[0], pos_1[1], pos_1[2], pos_1[3]))
-        out_gfa.add_line("E\t*\t{}\t{}\t{}\t{}\t{}\t{}\t*".format(solution, s2, pos_2[0], pos_2[1], pos_2[2], pos_2[3]))
+#----------------------------------------------------
+# GapJournal class
+#----------------------------------------------------
+class GapJournal:
+    '''
+    Class defining the checkpoint journal of a run (append-only file, one JSON line per finished gap):
+    - the path of the journal file
+    - for each finished gap: its name ('left_right'), its 'union_summary' and its 'output_for_gfa' results
+    '''
 
-        out_gfa.to_file(gfa_output_file)
+    #Constructor
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+
+    #Method "load"
+    def load(self):
+        '''Method to read the finished gaps of the journal (a last line truncated by a crash is dropped from the journal)'''
+        finished = {}
+        if not os.path.exists(self.journal_file):
+            return finished
+
+        good_offset = 0
+        with open(self.journal_file, "rb") as journal:
+            for line in journal:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line.decode())
+                    finished[entry["Gap"]] = (entry["union_summary"], entry["output_for_gfa"])
+                except (ValueError, KeyError, UnicodeDecodeError):
+                    break
+                good_offset += len(line)
+
+        if good_offset < os.path.getsize(self.journal_file):
+            print("Warning: The end of the journal file {} is incomplete, it is ignored".format(self.journal_file))
+            with open(self.journal_file, "r+b") as journal:
+                journal.truncate(good_offset)
+
+        return finished
+
+    #Method "reset"
+    def reset(self):
+        '''Method to start a new (empty) journal'''
+        with open(self.journal_file, "w"):
+            pass
+
+    #Method "record"
+    def record(self, gap_key, union_summary, output_for_gfa):
+        '''Method to append a finished gap to the journal, and sync it to disk'''
+        entry = {"Gap": gap_key, "union_summary": union_summary, "output_for_gfa": output_for_gfa}
+        with open(self.journal_file, "a") as journal:
+            journal.write(json.dumps(entry) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+
+#----------------------------------------------------
+# Shard manifests
+#----------------------------------------------------
+#Function to get the prefix of the output files of a shard ('<gfa_name>.shard<i>of<N>')
+def shard_name(gfa_name, shard, nb_shards):
+    return "{}.shard{}of{}".format(gfa_name, shard, nb_shards)
 
-        return gapfill_file
\ No newline at end of file
+'''
+To write the manifest of a shard at the end of its run (JSON file, written atomically):
+    - it takes as input the manifest file, the input GFA file, the index of the shard and the number of shards, the list of the gaps of the shard ('left_right') 
+      and the dictionary of its output files (journal, '.union.sum', GFA and gapfill FASTA files, relative to the output directory)
+'''
+def write_shard_manifest(manifest_file, gfa_file, shard, nb_shards, gap_keys, outputs):
+    manifest = {"GFA": gfa_file, "GFA_digest": file_digest(gfa_file).hex(), "Shard": shard, "Nb_shards": nb_shards, "Gaps": gap_keys, "Outputs": outputs}
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, manifest_file)
+
+'''
+To read the manifests of all the shards of a GFA file:
+    - it takes as input the input GFA file, its name and the directory containing the outputs of the shards
+    - it checks that the manifests of all the shards are present, and that they were obtained with the same GFA file and the same number of shards
+    - it outputs the list of the manifests, sorted by shard index
+'''
+def load_shard_manifests(gfa_file, gfa_name, directory):
+    manifest_files = glob.glob(os.path.join(directory, glob.escape(gfa_name) + ".shard*of*.manifest.json"))
+    if len(manifest_files) == 0:
+        raise ValueError("No manifest of shard found for {} in {}".format(gfa_name, directory))
+
+    manifests = {}
+    digest = file_digest(gfa_file).hex()
+    for manifest_file in manifest_files:
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+        if manifest["GFA_digest"] != digest:
+            raise ValueError("The shard {}/{} was run on a different GFA file ({})".format(manifest["Shard"], manifest["Nb_shards"], manifest["GFA"]))
+        manifests[(manifest["Shard"], manifest["Nb_shards"])] = manifest
+
+    nb_shards = set(nb for (_, nb) in manifests)
+    if len(nb_shards) > 1:
+        raise ValueError("The manifests of shard found in {} come from runs with different numbers of shards: {}".format(directory, sorted(nb_shards)))
+    nb_shards = nb_shards.pop()
+    missing = [str(i) for i in range(1, nb_shards+1) if (i, nb_shards) not in manifests]
+    if len(missing) > 0:
+        raise ValueError("Missing shard(s) {} (out of {})".format(", ".join(missing), nb_shards))
+
+    return [manifests[(i, nb_shards)] for i in range(1, nb_shards+1)]
+
+'''
+To get the results of all the gaps of a GFA file from the journals of its shards:
+    - it takes as input the manifests of the shards (sorted by shard index) and the list of the gaps of the GFA file ('left_right'), in the order of the input GFA file
+    - it checks that each shard has recorded all its gaps, and that each gap of the GFA file is in a shard
+    - it outputs the list of the ('union_summary', 'output_for_gfa') results of the gaps, in the order of the input GFA file
+'''
+def load_shard_results(manifests, gap_keys):
+    finished_gaps = {}
+    for manifest in manifests:
+        shard_results = GapJournal(manifest["Outputs"]["Journal"]).load()
+        missing_gaps = [gap_key for gap_key in manifest["Gaps"] if gap_key not in shard_results]
+        if len(missing_gaps) > 0:
+            raise ValueError("The shard {}/{} is incomplete ({} gap(s) missing), resume it with '--resume'".format(manifest["Shard"], manifest["Nb_shards"], len(missing_gaps)))
+        finished_gaps.update(shard_results)
+
+    missing_gaps = [gap_key for gap_key in gap_keys if gap_key not in finished_gaps]
+    if len(missing_gaps) > 0:
+        raise ValueError("{} gap(s) of the input GFA file are in none of the shards (e.g. {})".format(len(missing_gaps), missing_gaps[0]))
+
+    return [finished_gaps[gap_key] for gap_key in gap_keys]
+
+
+#----------------------------------------------------
+# get_gapfill_summary function
+#----------------------------------------------------
+'''
+To summarize the gap-filling results of a run, from the results of the function 'gapfilling' (no re-parsing of the output files):
+    - it takes as input the list of the results ('union_summary', 'output_for_gfa') obtained for each gap
+    - it outputs a list containing, for each gap, a dictionary with the gap's name, its flanking sequences, its size, its status ('gapfilled' or 'not_gapfilled'),
+      the k-mer size for which a solution was found and the list of the gap-filled sequences (name, orientation, length and quality)
+'''
+def get_gapfill_summary(results):
+    summary = []
+    seen_gaps = set()
+    for union_summary, output_for_gfa in results:
+        gap_name = str(union_summary[1]) +"_"+ str(union_summary[2])
+        if gap_name in seen_gaps:
+            continue
+        seen_gaps.add(gap_name)
+        gap_summary = {"Gap": gap_name, "Gap_ID": str(union_summary[0]), "Left_scaffold": str(union_summary[1]), "Right_scaffold": str(union_summary[2]), \
+                        "Gap_size": union_summary[3], "Status": "not_gapfilled", "k": None, "Solutions": []}
+
+        #solution found for the current gap
+        if len(output_for_gfa) > 0 and len(output_for_gfa[0]) > 1:
+            gap_summary["Status"] = "gapfilled"
+            gap_summary["k"] = int(str(output_for_gfa[0][0]).split('.k')[-1].split('_')[0])
+            for output in output_for_gfa:
+                sol_name = str(output[0])
+                gap_summary["Solutions"].append({"Solution": sol_name, "Orientation": sol_name.split('_')[-1], "Length": int(output[1]), "Quality": str(output[6])})
+
+        summary.append(gap_summary)
+
+    return summary
+
+
+#----------------------------------------------------
+# write_gapfill_summary function
+#----------------------------------------------------
+'''
+To write the summary of the gap-filling results in a machine-readable format:
+    - it takes as input the summary obtained with the function 'get_gapfill_summary' and the prefix of the output files
+    - it outputs a TSV file ('prefix.gapfill.summary.tsv', one row per gap-filled sequence, or one row per gap if no solution) and a JSON file ('prefix.gapfill.summary.json')
+'''
+def write_gapfill_summary(summary, prefix):
+    tsv_file = prefix + ".gapfill.summary.tsv"
+    json_file = prefix + ".gapfill.summary.json"
+
+    legend = ["Gap", "Gap_ID", "Left_scaffold", "Right_scaffold", "Gap_size", "Status", "k", "Solution", "Orientation", "Length", "Quality"]
+    rows = ['\t'.join(legend)]
+    for gap_summary in summary:
+        gap_fields = [gap_summary[key] for key in legend[:5]] + [gap_summary["Status"], "NA" if gap_summary["k"] is None else gap_summary["k"]]
+        if gap_summary["Solutions"] == []:
+            rows.append('\t'.join(str(i) for i in gap_fields + ["NA", "NA", "NA", "NA"]))
+        for sol in gap_summary["Solutions"]:
+            rows.append('\t'.join(str(i) for i in gap_fields + [sol["Solution"], sol["Orientation"], sol["Length"], sol["Quality"]]))
+    with open(tsv_file, "w") as tsv:
+        tsv.write('\n'.join(rows) + '\n')
+
+    with open(json_file, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    return tsv_file, json_file
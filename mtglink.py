@@ -24,55 +24,141 @@ from __future__ import print_function
 import os
 import sys
 import argparse
-import csv
+import glob
+import shutil
 import re
-import subprocess
 from pathos.multiprocessing import ProcessingPool as Pool
 #from multiprocessing import Pool
-import gfapy
 from gfapy.sequence import rc
 from Bio import SeqIO, Align
-from helpers import Gap, Scaffold, extract_barcodes, get_reads, mtg_fill, stats_align, get_position_for_edges, get_output_for_gfa, update_gfa_with_solution
+from helpers import (
+    Gap, Scaffold, load_gfa_tables, extract_barcodes, get_reads, count_kmers, kmer_spectrum,
+    select_kmer_abundance, SPECTRUM_SOLID_RATIO, mtg_fill, mtg_fill_command, MtgProcess, MtgBatch,
+    remove_outputs, get_position_for_edges, get_output_for_gfa, GapOutputWriter, GapJournal,
+    shard_name, write_shard_manifest, load_shard_manifests, load_shard_results,
+    get_gapfill_summary, write_gapfill_summary
+)
+from runner import ResourceUsage
+from orchestrator import UnionPrefetcher, extract_union_async
+from stats_alignment import stats_alignment, index_stats_rows, AlignmentCache
+from scheduler import (
+    read_union_sizes, prescreen_union, group_gaps_by_barcodes, minhash_sketch, order_by_similarity,
+    BarcodeReuse, fit_runtime_model, estimate_mtg_runtime, plan_schedule, order_gaps_by_cost,
+    shard_gaps, timed_call, RunTelemetry, CoreBudget, set_core_budget, get_core_budget,
+    mtg_cores_for_union, MemoryBudget, set_memory_budget, mtg_resources, acquire_mtg_resources,
+    release_mtg_resources, SpeculativeSweep, GapTimeBudget, estimate_graph_memory,
+    fit_memory_model, init_mtg_telemetry, record_mtg_telemetry
+)
 
 
 #----------------------------------------------------
 # Arg parser
 #----------------------------------------------------
-parser = argparse.ArgumentParser(prog="mtglink.py", usage="%(prog)s -gfa <input.gfa> -c <chunk_size> -bam <mapped.bam> -fastq <reads.fastq> -index <barcoded.shelve> [options]", \
+parser = argparse.ArgumentParser(prog="mtglink.py", usage="%(prog)s -gfa <input.gfa> -c <chunk_size> -bam <mapped.bam> -fastq <reads.fastq> -index <barcoded.shelve> [options] | %(prog)s -gfa <input.gfa> -out <output_directory> --merge", \
                                 description=("Gapfilling with linked read data, using MindTheGap in 'breakpoint' mode"))
 
 parserMain = parser.add_argument_group("[Main options]")
 parserMtg = parser.add_argument_group("[MindTheGap option]")
 
 parserMain.add_argument('-gfa', dest="input_gfa", action="store", help="Input GFA file (GFA 2.0) (format: xxx.gfa)", required=True)
-parserMain.add_argument('-c', dest="chunk", action="store", type=int, help="Chunk size (bp)", required=True)
-parserMain.add_argument('-bam', dest="bam", action="store", help="BAM file: linked reads mapped on current genome assembly (format: xxx.bam)", required=True)
-parserMain.add_argument('-fastq', dest="reads", action="store", help="File of indexed reads (format: xxx.fastq | xxx.fq)", required=True)
-parserMain.add_argument('-index', dest="index", action="store", help="Prefix of barcodes index file (format: xxx.shelve)", required=True)
+parserMain.add_argument('-c', dest="chunk", action="store", type=int, help="Chunk size (bp)")
+parserMain.add_argument('-bam', dest="bam", action="store", help="BAM file: linked reads mapped on current genome assembly (format: xxx.bam)")
+parserMain.add_argument('-fastq', dest="reads", action="store", help="File of indexed reads (format: xxx.fastq | xxx.fq)")
+parserMain.add_argument('-index', dest="index", action="store", help="Prefix of barcodes index file (format: xxx.shelve)")
 parserMain.add_argument('-f', dest="freq", action="store", type=int, default=2, help="Minimal frequence of barcodes extracted in the chunk of size '-c' [default: 2]")
 parserMain.add_argument('-out', dest="outDir", action="store", default="./mtglink_results", help="Output directory [default './mtglink_results']")
 parserMain.add_argument('-refDir', dest="refDir", action="store", help="Directory containing the reference sequences if any")
+parserMain.add_argument("--native-align", dest="native_align", action="store_true", help="To align the flanking contigs' regions against the inserted sequences in-process, with the pairwise aligner of Biopython, instead of NUCmer (regions up to 2000 bp and inserted sequences up to 10000 bp, NUCmer being used otherwise)")
 parserMain.add_argument('-line', dest="line", action="store", type=int, help="Line of GFA file input from which to start analysis (if not provided, start analysis from first line of GFA file input) [optional]")
 parserMain.add_argument('-rbxu', dest="rbxu", action="store", help="File containing the reads of the union (if already extracted) [optional]")
+parserMain.add_argument('--threads', dest="threads", action="store", type=int, help="Total number of threads of the run, shared between the gaps processed in parallel and the MindTheGap runs (if not provided, one process per CPU and '-nb-cores' cores for each MindTheGap run) [optional]")
+parserMain.add_argument('--memory', dest="memory", action="store", type=int, help="Memory budget of the node (in MBytes), shared between the MindTheGap runs of the gaps processed in parallel [optional]")
+parserMain.add_argument("--prefetch", dest="prefetch", action="store", type=int, help="Number of gaps whose union (barcodes and reads) is extracted ahead of the gaps being gap-filled by the workers, by an asyncio orchestrator in the main process, the extraction processes of many gaps running at the same time [optional]")
+parserMain.add_argument("--extract-jobs", dest="extract_jobs", action="store", type=int, default=4, help="With '--prefetch', maximum number of processes of each extraction tool (BamExtractor, reads_bx_sqlite3.py) running at the same time [default: 4]")
+parserMain.add_argument("--resume", action="store_true", help="To resume an interrupted run in the same output directory: the gaps recorded in the journal file ('<input.gfa>.journal.jsonl') are replayed into the output files, and only the missing gaps are processed")
+parserMain.add_argument("--stable-order", dest="stable_order", action="store_true", help="To reorder the output files (GFA, gapfill FASTA and '.union.sum') in the order of the gaps in the input GFA file at the end of the run (by default, the results are written in the order in which the gaps are done)")
+parserMain.add_argument("--shard", dest="shard", action="store", help="Shard 'i/N' of the gaps to process on this node (1 <= i <= N): the gaps are partitioned deterministically into N shards balanced by gap length, the output files are prefixed by '<input.gfa>.shard<i>of<N>' and a manifest is written at the end of the run [optional]")
+parserMain.add_argument("--merge", action="store_true", help="To merge the outputs of all the shards of the input GFA file (found in the output directory) into the output files of a single-node run, in the order of the gaps in the input GFA file")
+parserMain.add_argument("--min-barcodes", dest="min_barcodes", action="store", type=int, default=0, help="Minimal number of barcodes of the union to launch MindTheGap on a gap (otherwise the gap is skipped and returned as a G line) [default: 0]")
+parserMain.add_argument("--min-reads", dest="min_reads", action="store", type=int, default=0, help="Minimal number of reads of the union to launch MindTheGap on a gap (otherwise the gap is skipped and returned as a G line) [default: 0]")
+parserMain.add_argument("--min-coverage", dest="min_coverage", action="store", type=float, default=0.0, help="Minimal estimated coverage of the union (number of bases of the union per bp of the gap and its two chunks) to launch MindTheGap on a gap (otherwise the gap is skipped and returned as a G line) [default: 0]")
+parserMain.add_argument("--batch", dest="batch", action="store", type=float, help="Minimal Jaccard similarity between the barcodes of the unions of gaps to gap-fill them together: the gaps of a group are gap-filled with a single MindTheGap run per (k, a) combination, on the union of the group [optional]")
+parserMain.add_argument("--batch-size", dest="batch_size", action="store", type=int, default=4, help="With '--batch', maximal number of gaps per group [default: 4]")
+parserMain.add_argument("--similarity-order", dest="similarity_order", action="store_true", help="To dispatch the gaps (or groups of gaps with '--batch') ordered by similarity of the barcodes of their unions (MinHash sketches), so that the gaps sharing reads are processed one after the other")
+parserMain.add_argument("--plan", action="store_true", help="To estimate the cost of the run without gap-filling: the unions of the gaps are extracted and sized (no MindTheGap), and the wall-clock time and peak memory of each gap and of the run (schedule for '--threads' cores and the '--memory' budget) are estimated with a cost model fitted on the telemetry file of the previous runs; the plan is written to '<input.gfa>.plan.tsv'")
+parserMain.add_argument("--no-cache", dest="no_cache", action="store_true", help="To not use the binary sidecar cache of the parsed GFA file ('<input.gfa>.mtglink.cache')")
 
 parserMtg.add_argument('-k', dest="kmer", action="store", default=[51, 41, 31, 21],  nargs='*', type=int, help="k-mer size(s) used for gap-filling [default: [51, 41, 31, 21]]")
 parserMtg.add_argument("--force", action="store_true", help="To force search on all '-k' values provided")
 parserMtg.add_argument('-a', dest="abundance_threshold", action="store", default=[3, 2], nargs='*', type=int, help="Minimal abundance threshold for solid k-mers [default: [3, 2]]")
+parserMtg.add_argument("--speculative", dest="speculative", action="store", type=int, default=1, help="Number of (k, a) combinations of a gap run at the same time by MindTheGap: the next combinations are started in advance when resources are available, and cancelled as soon as a higher-priority combination succeeds [default: 1 (sequential)]")
+parserMtg.add_argument("--adaptive-ka", dest="adaptive_ka", action="store_true", help="To select the k values and abundance thresholds of each gap from the k-mer spectrum of its union: the (k, a) combinations whose estimated k-mer coverage is below twice 'a' are pruned from the sweep")
+parserMtg.add_argument("--seed-check", dest="seed_check", action="store_true", help="To count the left and right k-mers of the breakpoints (seed k-mers) in the union before launching MindTheGap: the (k, a) combinations with a seed k-mer whose abundance is below 'a' are skipped")
+parserMtg.add_argument("--mtg-timeout", dest="mtg_timeout", action="store", type=float, help="Wall-clock time limit of each MindTheGap run (s) [optional]")
+parserMtg.add_argument("--mtg-cpu-limit", dest="mtg_cpu_limit", action="store", type=float, help="CPU time limit of each MindTheGap run (s) [optional]")
+parserMtg.add_argument("--gap-timeout", dest="gap_timeout", action="store", type=float, help="Wall-clock time limit of all the MindTheGap runs of a gap (s); when reached, the remaining k/a values are skipped and the gap is written back as a G line [optional]")
+parserMtg.add_argument("--gap-cpu-limit", dest="gap_cpu_limit", action="store", type=float, help="CPU time limit of all the MindTheGap runs of a gap (s); when reached, the remaining k/a values are skipped and the gap is written back as a G line [optional]")
 parserMtg.add_argument('-ext', dest="extension", action="store", type=int, default=500, help="Extension size of the gap on both sides (bp); determine start/end of gapfilling [default: '500']")
 parserMtg.add_argument('-max-nodes', dest="max_nodes", action="store", type=int, default=1000, help="Maximum number of nodes in contig graph [default: 1000]")
 parserMtg.add_argument('-max-length', dest="max_length", action="store", type=int, default=10000, help="Maximum length of gapfilling (bp) [default: 10000]")
-parserMtg.add_argument('-nb-cores', dest="nb_cores", action="store", type=int, default=1, help="Number of cores [default: 1]")
+parserMtg.add_argument('-nb-cores', dest="nb_cores", action="store", type=int, help="Number of cores (maximum number of cores for a MindTheGap run if '--threads' is provided) [default: 1, or the '--threads' value if '--threads' is provided]")
 parserMtg.add_argument('-max-memory', dest="max_memory", action="store", type=int, default=0, help="Max memory for graph building (in MBytes) [default: 0]")
 parserMtg.add_argument('-verbose', dest="verbosity", action="store", type=int, default=0, help="Verbosity level [default: 0]")
 
 args = parser.parse_args()
 
+#The '-c', '-bam', '-fastq' and '-index' arguments are required to perform the gap-filling (not to merge the outputs of the shards)
+if not args.merge:
+    missing_args = [flag for flag, dest in [('-c', "chunk"), ('-bam', "bam"), ('-fastq', "reads"), ('-index', "index")] if getattr(args, dest) is None]
+    if len(missing_args) > 0:
+        parser.error("the following arguments are required: " + ", ".join(missing_args))
+
 if re.match('^.*.gfa$', args.input_gfa) is None:
     parser.error("Warning: The suffix of the GFA file should be: '.gfa'")
 
-if re.match('^.*.bam$', args.bam) is None:
+if not args.merge and re.match('^.*.bam$', args.bam) is None:
     parser.error("Warning: The suffix of the BAM file should be: '.bam'")
 
+if args.resume and args.line is not None:
+    parser.error("Warning: The '--resume' and '-line' options can't be used together")
+
+shard_index, nb_shards = None, None
+if args.shard is not None:
+    shard_match = re.match(r'^(\d+)/(\d+)$', args.shard)
+    if shard_match is None or not (1 <= int(shard_match.group(1)) <= int(shard_match.group(2))):
+        parser.error("Warning: The shard '--shard' should be given as 'i/N', with 1 <= i <= N")
+    shard_index, nb_shards = int(shard_match.group(1)), int(shard_match.group(2))
+
+if args.plan and (args.merge or args.resume):
+    parser.error("Warning: The '--plan' option can't be used with '--merge' or '--resume'")
+
+if args.shard is not None and (args.line is not None or args.merge):
+    parser.error("Warning: The '--shard' option can't be used with '-line' or '--merge'")
+
+if (args.prefetch is not None and args.prefetch < 1) or args.extract_jobs < 1:
+    parser.error("Warning: The '--prefetch' and '--extract-jobs' values should be at least 1")
+
+if args.min_barcodes < 0 or args.min_reads < 0 or args.min_coverage < 0:
+    parser.error("Warning: The '--min-barcodes', '--min-reads' and '--min-coverage' values should be positive")
+
+if args.batch is not None and (not (0 < args.batch <= 1) or args.batch_size < 1):
+    parser.error("Warning: The '--batch' value should be in ]0, 1] and the '--batch-size' value should be at least 1")
+
+if args.batch is not None and (args.prefetch is not None or args.speculative > 1 or args.plan):
+    parser.error("Warning: The '--batch' option can't be used with '--prefetch', '--speculative' or '--plan'")
+
+if args.similarity_order and (args.prefetch is not None or args.plan):
+    parser.error("Warning: The '--similarity-order' option can't be used with '--prefetch' or '--plan'")
+
+if args.speculative < 1:
+    parser.error("Warning: The number of (k, a) combinations run at the same time '--speculative' should be at least 1")
+
+if args.threads is not None and args.threads < 1:
+    parser.error("Warning: The number of threads '--threads' should be at least 1")
+
+if args.nb_cores is None:
+    args.nb_cores = args.threads if args.threads is not None else 1
+
 #----------------------------------------------------
 # Input files and arguments
 #----------------------------------------------------
@@ -83,21 +169,22 @@ if not os.path.exists(gfa_file):
 gfa_name = gfa_file.split('/')[-1]
 print("\nInput GFA file: " + gfa_file)
 
-#BAM file: linked reads mapped on current genome assembly
-bam_file = os.path.abspath(args.bam)
-if not os.path.exists(bam_file): 
-    parser.error("Warning: The path of the BAM file doesn't exist")
-print("BAM file: " + bam_file)
+if not args.merge:
+    #BAM file: linked reads mapped on current genome assembly
+    bam_file = os.path.abspath(args.bam)
+    if not os.path.exists(bam_file): 
+        parser.error("Warning: The path of the BAM file doesn't exist")
+    print("BAM file: " + bam_file)
 
-#Reads file: file of indexed reads
-reads_file = os.path.abspath(args.reads)
-if not os.path.exists(reads_file):
-    parser.error("Warning: The path of the file of indexed reads doesn't exist")
-print("File of indexed reads: " + reads_file)
+    #Reads file: file of indexed reads
+    reads_file = os.path.abspath(args.reads)
+    if not os.path.exists(reads_file):
+        parser.error("Warning: The path of the file of indexed reads doesn't exist")
+    print("File of indexed reads: " + reads_file)
 
-#Prefix of barcodes index file
-index_file = os.path.abspath(args.index)
-print("Barcodes index file (prefix): " + index_file)
+    #Prefix of barcodes index file
+    index_file = os.path.abspath(args.index)
+    print("Barcodes index file (prefix): " + index_file)
 
 #Directory containing the reference sequences if any
 if args.refDir is not None:
@@ -128,46 +215,58 @@ print("\nThe results are saved in " + outDir + "\n")
 
 #unionDir
 unionDir = outDir + "/union"
-os.mkdir(unionDir)
+if not os.path.exists(unionDir):
+    os.mkdir(unionDir)
 
 #mtgDir
 mtgDir = outDir + "/mtg_results"
-os.mkdir(mtgDir)
+if not os.path.exists(mtgDir):
+    os.mkdir(mtgDir)
 
 #contigDir
 contigDir = outDir + "/contigs"
-os.mkdir(contigDir)
+if not os.path.exists(contigDir):
+    os.mkdir(contigDir)
 
 #statsDir
 statsDir = outDir + "/alignments_stats"
 
+#scratchDir: one working directory per gap being processed (temporary files of the gap), removed at the end of the gap
+scratchDir = outDir + "/scratch"
+if not os.path.exists(scratchDir):
+    os.mkdir(scratchDir)
+
+#Function to remove the scratch directory at the end of the run
+def remove_scratch_dir():
+    shutil.rmtree(scratchDir, ignore_errors=True)
+
+#Prefix of the output files (one prefix per shard with '--shard') and output GFA file
+if args.shard is not None:
+    output_name = shard_name(gfa_name, shard_index, nb_shards)
+    out_gfa_file = str(gfa_name).split('.gfa')[0] + ".shard{}of{}_mtglink.gfa".format(shard_index, nb_shards)
+else:
+    output_name = gfa_name
+    out_gfa_file = str(gfa_name).split('.gfa')[0] + "_mtglink.gfa"
+
+#Telemetry file of the MindTheGap runs (used to calibrate the memory model)
+telemetry_file = outDir +"/"+ output_name + ".mtg.telemetry.tsv"
+
+#Columns of the '.union.sum' file
+union_sum_legend = ["Gap_ID", "Left_scaffold", "Right_scaffold", "Gap_size", "Chunk_size", "Nb_barcodes", "Nb_reads", "Timeout", "MTG_runs", "MTG_wall_time", "MTG_CPU_time", "MTG_peak_RSS", "Prescreen", "Kmer_coverage", "Sweep", "Skipped", "Batch"]
+
 
 #----------------------------------------------------
-# gapfilling function - Pipeline
+# get_union_job function
 #----------------------------------------------------
 '''
-To perform the gap-filling on a specific gap:
-    - it takes as input the current gap on which we want to perform the gap-filling
-    - it outputs the list 'union_summary' containing the gap ID, the names of the left and right flanking sequences, the gap size, the chunk size, and the number of barcodes and reads extracted on the chunks to perform the gap-filling
-    - it outputs as well the list 'output_for_gfa' containing the gap-filled sequence's name, as well as its length, its sequence, the number of solution found, the beginning and ending positions of the overlap and the quality of the sequence
+To get the regions and files of the union of a gap:
+    - it takes as input the gap ('G' line of the tables of the input GFA file)
+    - it outputs a dictionary with the gap label, the chunk regions of the left and right scaffolds on which to extract the barcodes, and the names of the barcodes and reads files of the union
+      (the reads file being None if the reads of the union are already extracted ('-rbxu'))
 '''
-def gapfilling(current_gap):
-
-    os.chdir(outDir)
-
-    #Open the input GFA file to get the corresponding Gap line ('G' line)
-    gfa = gfapy.Gfa.from_file(gfa_file)
-    for _gap_ in gfa.gaps:
-        if str(_gap_) == current_gap:
-            current_gap = _gap_
-            #Create the object 'gap' from the class 'Gap'
-            gap = Gap(current_gap)
-
-    #Get some information on the current gap we are working on
-    gap.info()
+def get_union_job(current_gap):
+    gap = Gap(current_gap)
     gap_label = gap.label()
-
-    #Create two objects ('left_scaffold' and 'right_scaffold') from the class 'Scaffold'
     left_scaffold = Scaffold(current_gap, gap.left, gfa_file)
     right_scaffold = Scaffold(current_gap, gap.right, gfa_file)
 
@@ -185,72 +284,114 @@ def gapfilling(current_gap):
     else:
         chunk_R = args.chunk
 
-    #----------------------------------------------------
-    # BamExtractor
-    #----------------------------------------------------
-    #Union output directory
-    os.chdir(unionDir)
-    
+    union_barcodes_file = "{}.{}.g{}.c{}.bxu".format(gfa_name, str(gap_label), gap.length, args.chunk)
+    if args.rbxu is not None:
+        union_reads_file = None
+    else:
+        union_reads_file = "{}.{}.g{}.c{}.rbxu.fastq".format(gfa_name, str(gap_label), gap.length, args.chunk)
+
+    return {"gap_label": str(gap_label), "left_region": left_scaffold.chunk(chunk_L), "right_region": right_scaffold.chunk(chunk_R), \
+            "union_barcodes_file": union_barcodes_file, "union_reads_file": union_reads_file}
+
+
+#----------------------------------------------------
+# get_union_barcodes function
+#----------------------------------------------------
+'''
+To get the barcodes of the union of a gap:
+    - it takes as input the gap ('G' line of the tables of the input GFA file) and its label
+    - it outputs the union job of the gap (see 'get_union_job') and the list of the barcodes extracted on the chunks of both flanking scaffolds (at least '-f' occurrences)
+'''
+def get_union_barcodes(current_gap, gap_label):
+    union_job = get_union_job(current_gap)
+
     #Initiate a dictionary to count the occurences of each barcode
     barcodes_occ = {}
-    
+
     #Obtain the left barcodes that are extracted on the left region and store the barcodes and their occurences in the dict 'barcodes_occ'
-    left_region = left_scaffold.chunk(chunk_L)
-    extract_barcodes(bam_file, gap_label, left_region, barcodes_occ)
+    extract_barcodes(bam_file, gap_label, union_job["left_region"], barcodes_occ, log_dir=unionDir)
 
     #Obtain the right barcodes that are extracted on the right region and store the barcodes and their occurences in the dict 'barcodes_occ'
-    right_region = right_scaffold.chunk(chunk_R)
-    extract_barcodes(bam_file, gap_label, right_region, barcodes_occ)
+    extract_barcodes(bam_file, gap_label, union_job["right_region"], barcodes_occ, log_dir=unionDir)
 
-    #Do the union of the barcodes on both left and right regions
-    union_barcodes_file = "{}.{}.g{}.c{}.bxu".format(gfa_name, str(gap_label), gap.length, args.chunk)
-    with open(union_barcodes_file, "w") as union_barcodes:
-        #Filter barcodes by freq
-        for (barcode, occurences) in barcodes_occ.items():
-            if occurences >= args.freq:
-                union_barcodes.write(barcode + "\n")
+    #Filter barcodes by freq
+    barcodes = [barcode for (barcode, occurences) in barcodes_occ.items() if occurences >= args.freq]
 
-    #----------------------------------------------------
-    # GetReads
-    #----------------------------------------------------
-    #If the reads of the union are already extracted, use the corresponding file
-    if args.rbxu is not None:
-        union_reads_file = os.path.abspath(args.rbxu)
+    return union_job, barcodes
 
-    #Union: extract the reads associated with the barcodes
-    else:
-        union_reads_file = "{}.{}.g{}.c{}.rbxu.fastq".format(gfa_name, str(gap_label), gap.length, args.chunk)
-        with open(union_reads_file, "w") as union_reads:
-            get_reads(reads_file, index_file, gap_label, union_barcodes_file, union_reads)
+
+#----------------------------------------------------
+# get_union function
+#----------------------------------------------------
+'''
+To get the union of a gap (barcodes extracted on the chunks of both flanking scaffolds, and reads associated with these barcodes):
+    - it takes as input the gap ('G' line of the tables of the input GFA file), its label, its scratch directory, and optionally its union if already extracted by the asyncio orchestrator ('--prefetch')
+    - it outputs the reads file of the union, the number of barcodes of the union, and the number of reads and bases of the union
+'''
+def get_union(current_gap, gap_label, gap_scratch, union=None):
 
     #----------------------------------------------------
-    # Summary of union (barcodes and reads)
+    # BamExtractor
     #----------------------------------------------------
-    bxu = sum(1 for line in open(union_barcodes_file, "r"))
-    rbxu = sum(1 for line in open(union_reads_file, "r"))/4
-    union_summary = [str(gap.identity), str(gap.left), str(gap.right), gap.length, args.chunk, bxu, rbxu]
-
-    #Remove the barcodes files
-    subprocess.run(["rm", union_barcodes_file])
+    #Union already extracted by the asyncio orchestrator of the main process ('--prefetch'); if its extraction failed, it is extracted again
+    if union is not None and "error" in union:
+        print("Warning for {}: The extraction of the union failed ({}), it is done again by the worker".format(str(gap_label), union["error"]))
+        union = None
+    if union is not None:
+        union_reads_file = os.path.join(unionDir, union["union_reads_file"]) if union["union_reads_file"] is not None else os.path.abspath(args.rbxu)
+        bxu = union["nb_barcodes"]
 
-    #----------------------------------------------------
-    # MindTheGap pipeline
-    #----------------------------------------------------        
-    #Get flanking contigs sequences
-    seq_L = str(left_scaffold.sequence())
-    seq_R = str(right_scaffold.sequence())
+    else:
+        union_job, barcodes = get_union_barcodes(current_gap, gap_label)
 
-    #Execute MindTheGap fill module on the union, in breakpoint mode
-    #Iterate over the kmer values, starting with the highest
-    for k in args.kmer:
+        #Do the union of the barcodes on both left and right regions
+        union_barcodes_file = os.path.join(gap_scratch, union_job["union_barcodes_file"])
+        with open(union_barcodes_file, "w") as union_barcodes:
+            for barcode in barcodes:
+                union_barcodes.write(barcode + "\n")
 
-        #MindTheGap output directory
-        os.chdir(mtgDir)
-    
         #----------------------------------------------------
-        # Breakpoint file, with offset of size k removed
+        # GetReads
         #----------------------------------------------------
-        bkpt_file = "{}.{}.g{}.c{}.k{}.offset_rm.bkpt.fasta".format(gfa_name, str(gap_label), gap.length, args.chunk, k)
+        #If the reads of the union are already extracted, use the corresponding file
+        if args.rbxu is not None:
+            union_reads_file = os.path.abspath(args.rbxu)
+
+        #Union: extract the reads associated with the barcodes
+        else:
+            union_reads_file = os.path.join(unionDir, union_job["union_reads_file"])
+            with open(union_reads_file, "w") as union_reads:
+                get_reads(reads_file, index_file, gap_label, union_barcodes_file, union_reads, log_dir=unionDir)
+
+        #Count the barcodes of the union, and remove the barcodes files
+        bxu = sum(1 for line in open(union_barcodes_file, "r"))
+        os.remove(union_barcodes_file)
+
+    #Count the reads and bases of the union
+    nb_lines = 0
+    union_bases = 0
+    with open(union_reads_file, "r") as union_reads:
+        for line in union_reads:
+            if nb_lines % 4 == 1:
+                union_bases += len(line.rstrip("\n"))
+            nb_lines += 1
+    rbxu = nb_lines/4
+
+    return union_reads_file, bxu, rbxu, union_bases
+
+
+#----------------------------------------------------
+# write_bkpt_files function
+#----------------------------------------------------
+'''
+To write the breakpoint files of a gap (one per k value), with offset of size k removed:
+    - it takes as input the gap, its label, its left and right scaffolds and their sequences
+    - it outputs a dictionary with the k value as key and the breakpoint file as value
+'''
+def write_bkpt_files(gap, gap_label, left_scaffold, right_scaffold, seq_L, seq_R):
+    bkpt_files = {}
+    for k in args.kmer:
+        bkpt_file = os.path.join(mtgDir, "{}.{}.g{}.c{}.k{}.offset_rm.bkpt.fasta".format(gfa_name, str(gap_label), gap.length, args.chunk, k))
         with open(bkpt_file, "w") as bkpt:
 
             #Left kmer and Reverse Right kmer (dependent on orientation left scaffold)
@@ -266,6 +407,148 @@ def gapfilling(current_gap):
             line6 = str(rc(seq_R)[(right_scaffold.slen - ext - k):(right_scaffold.slen - ext)])
 
             bkpt.writelines([line1, line2, line3, line4, line5, line6, line7, line8])
+        bkpt_files[k] = bkpt_file
+
+    return bkpt_files
+
+
+#----------------------------------------------------
+# gapfilling function - Pipeline
+#----------------------------------------------------
+'''
+To perform the gap-filling on a specific gap:
+    - it takes as input the current gap on which we want to perform the gap-filling, optionally its union (if already extracted) and its group of gaps ('--batch')
+    - it outputs the list 'union_summary' containing the gap ID, the names of the left and right flanking sequences, the gap size, the chunk size, the number of barcodes and reads extracted on the chunks to perform the gap-filling, and the other columns of the '.union.sum' file
+    - it outputs as well the list 'output_for_gfa' containing the gap-filled sequence's name, as well as its length, its sequence, the number of solution found, the beginning and ending positions of the overlap and the quality of the sequence
+'''
+def gapfilling(current_gap, union=None, batch=None):
+
+    #Get the corresponding Gap line ('G' line) from the tables of the input GFA file
+    current_gap = gfa_tables.gap_by_line[current_gap]
+    #Create the object 'gap' from the class 'Gap'
+    gap = Gap(current_gap)
+
+    #Get some information on the current gap we are working on
+    gap.info()
+    gap_label = gap.label()
+
+    #Create two objects ('left_scaffold' and 'right_scaffold') from the class 'Scaffold'
+    left_scaffold = Scaffold(current_gap, gap.left, gfa_file)
+    right_scaffold = Scaffold(current_gap, gap.right, gfa_file)
+
+    #Scratch directory of the gap (all the files are addressed by absolute paths, the working directory of the process is never changed)
+    gap_scratch = os.path.join(scratchDir, "{}.{}.g{}.c{}".format(gfa_name, str(gap_label), gap.length, args.chunk))
+    os.makedirs(gap_scratch, exist_ok=True)
+
+    #----------------------------------------------------
+    # Union (barcodes and reads)
+    #----------------------------------------------------
+    union_reads_file, bxu, rbxu, union_bases = get_union(current_gap, gap_label, gap_scratch, union)
+    union_summary = [str(gap.identity), str(gap.left), str(gap.right), gap.length, args.chunk, bxu, rbxu]
+
+    #----------------------------------------------------
+    # Pre-screen of the union
+    #----------------------------------------------------
+    #If the union is too small to gap-fill the gap, MindTheGap is not launched and the gap is returned as a G line (case gap, no solution)
+    prescreen_flag = prescreen_union(bxu, rbxu, union_bases, gap.length + 2*args.chunk, args.min_barcodes, args.min_reads, args.min_coverage)
+    if prescreen_flag is not None:
+        print("Warning for {}: The union doesn't pass the pre-screen ({}), MindTheGap is not launched".format(str(gap_label), prescreen_flag))
+        union_summary.append("NA")
+        union_summary.extend(ResourceUsage().summary())
+        union_summary.extend([prescreen_flag, "NA", "NA", "NA", (batch.name if batch is not None else "NA")])
+        shutil.rmtree(gap_scratch, ignore_errors=True)
+        return union_summary, [[str(current_gap)]]
+
+    #----------------------------------------------------
+    # MindTheGap pipeline
+    #----------------------------------------------------        
+    #Get flanking contigs sequences
+    seq_L = str(left_scaffold.sequence())
+    seq_R = str(right_scaffold.sequence())
+
+    #----------------------------------------------------
+    # Breakpoint files, with offset of size k removed
+    #----------------------------------------------------
+    bkpt_files = write_bkpt_files(gap, gap_label, left_scaffold, right_scaffold, seq_L, seq_R)
+
+    #----------------------------------------------------
+    # Arguments for MindTheGap
+    #----------------------------------------------------
+    max_nodes = args.max_nodes
+    max_length = args.max_length
+    if max_length == 10000 and gap.length >= 10000:
+        max_length = gap.length + 1000
+    #Number of cores for MindTheGap: adjusted to the union size if a global budget of threads is provided
+    if args.threads is not None:
+        nb_cores = mtg_cores_for_union(rbxu, min(args.nb_cores, args.threads))
+    else:
+        nb_cores = args.nb_cores
+    max_memory = args.max_memory
+    verbose = args.verbosity
+
+    #Speculative sweep ('--speculative'): the next (k, a) combinations are started in the background while resources are available,
+    #each in its own output prefix, and the lower-priority ones are killed as soon as a higher-priority combination succeeds
+    def start_mtg_fill(combination, blocking):
+        k_, a_ = combination
+        memory_estimate_ = estimate_graph_memory(union_bases, k_, bytes_per_base=memory_model, max_memory=max_memory)
+        resources = acquire_mtg_resources(nb_cores, memory_estimate_, blocking)
+        if resources is None:
+            return None
+        output_ = "{}.{}.g{}.c{}.k{}.a{}.bxu".format(gfa_name, str(gap_label), gap.length, args.chunk, k_, a_)
+        command = mtg_fill_command(union_reads_file, bkpt_files[k_], k_, a_, max_nodes, max_length, nb_cores, max_memory, verbose, os.path.join(mtgDir, output_))
+        timeout_, cpu_limit_ = time_budget.limits()
+        return MtgProcess(gap_label, command, os.path.join(mtgDir, output_), gap_scratch, resources, release_mtg_resources, timeout=timeout_, cpu_limit=cpu_limit_)
+
+    #Wall-clock and CPU time budgets of the MindTheGap runs of the gap
+    time_budget = GapTimeBudget(args.mtg_timeout, args.mtg_cpu_limit, args.gap_timeout, args.gap_cpu_limit)
+    #Resources used by the MindTheGap runs of the gap
+    mtg_usage = ResourceUsage()
+    timeout_flag = "NA"
+
+    #----------------------------------------------------
+    # Abundance of the seed k-mers
+    #----------------------------------------------------
+    #MindTheGap can only fill the gap for k and a if the left and right k-mers of the breakpoints (seeds) are solid (abundance >= a) in the union:
+    #with '--seed-check', the seeds of all the k values are counted (both strands) in one pass over the union, and the (k, a) combinations with a seed below 'a' are skipped
+    skipped = {}
+    if args.seed_check:
+        seed_kmers = dict((k, [seq_L[(left_scaffold.slen - ext - k):(left_scaffold.slen - ext)], seq_R[ext:(ext + k)]]) for k in args.kmer)
+        seed_counts = count_kmers(union_reads_file, [seed for k in args.kmer for seed in seed_kmers[k]])
+        for k in args.kmer:
+            for a in args.abundance_threshold:
+                if min(seed_counts[seed] for seed in seed_kmers[k]) < a:
+                    skipped[(k, a)] = ("seeds:" + "/".join(str(seed_counts[seed]) for seed in seed_kmers[k]), \
+                                        "the abundances of the seed k-mers in the union ({}) are below a".format("/".join(str(seed_counts[seed]) for seed in seed_kmers[k])))
+
+    #----------------------------------------------------
+    # Adaptive k and abundance thresholds
+    #----------------------------------------------------
+    #With '--adaptive-ka', the k-mer spectrum of the union is estimated, and the (k, a) combinations for which the k-mers of the gap can't be solid are pruned
+    spectrum_flag = "NA"
+    if args.adaptive_ka:
+        spectrum = kmer_spectrum(union_reads_file, args.kmer)
+        spectrum_flag = ",".join("k{}:{}".format(k, spectrum[k]["Coverage"]) for k in args.kmer)
+        print("{}: k-mer spectrum of the union: {}".format(str(gap_label), ", ".join("k={} coverage {} ({} k-mers sampled, {:.0f}% seen once)".format(k, spectrum[k]["Coverage"], spectrum[k]["Nb_kmers"], 100*spectrum[k]["Singletons"]) for k in args.kmer)))
+        selected = select_kmer_abundance(spectrum, args.kmer, args.abundance_threshold)
+        for (k, a) in [(k, a) for k in args.kmer for a in args.abundance_threshold]:
+            if (k, a) not in selected and (k, a) not in skipped:
+                skipped[(k, a)] = ("coverage:{}".format(spectrum[k]["Coverage"]), "the k-mer coverage of the union ({}) is below {}*a".format(spectrum[k]["Coverage"], SPECTRUM_SOLID_RATIO))
+    combinations = [(k, a) for k in args.kmer for a in args.abundance_threshold if (k, a) not in skipped]
+    sweep_flag = ",".join("k{}.a{}".format(k, a) for (k, a) in combinations) if combinations != [] else "NA"
+    print("{}: (k, a) combinations of the sweep: {}".format(str(gap_label), sweep_flag))
+    skipped_flag = ",".join("k{}.a{}:{}".format(k, a, skipped[(k, a)][0]) for k in args.kmer for a in args.abundance_threshold if (k, a) in skipped) if skipped != {} else "NA"
+
+    sweep = SpeculativeSweep(combinations, start_mtg_fill, args.speculative)
+    #Alignments of the inserted sequences of the gap, shared by all its (k, a) combinations (the sequences found for several k/a values are aligned once)
+    alignment_cache = AlignmentCache()
+    output_for_gfa = []
+    solution = False
+
+    #Execute MindTheGap fill module on the union, in breakpoint mode
+    #Iterate over the kmer values, starting with the highest
+    for k in args.kmer:
+
+        bkpt_file = bkpt_files[k]
 
         #----------------------------------------------------
         # Gapfilling
@@ -273,21 +556,64 @@ def gapfilling(current_gap):
         #Iterate over the abundance threshold values, starting with the highest
         for a in args.abundance_threshold:
 
+            #If a seed k-mer is not solid for k and a (with '--seed-check'), or if the k-mer coverage of the union is too low (with '--adaptive-ka'), skip this combination
+            if (k, a) in skipped:
+                print("\nGapfilling of {} for k={} and a={} skipped: {}".format(str(gap_label), k, a, skipped[(k, a)][1]))
+                solution = False
+                continue
+
             print("\nGapfilling of {} for k={} and a={} (union)".format(str(gap_label), k, a))
             
             #Input arguments for MindTheGap
-            input_file = os.path.join(unionDir, union_reads_file)
+            input_file = union_reads_file
             output = "{}.{}.g{}.c{}.k{}.a{}.bxu".format(gfa_name, str(gap_label), gap.length, args.chunk, k, a)
-            max_nodes = args.max_nodes
-            max_length = args.max_length
-            if max_length == 10000 and gap.length >= 10000:
-                max_length = gap.length + 1000
-            nb_cores = args.nb_cores
-            max_memory = args.max_memory
-            verbose = args.verbosity
+
+            #Estimate the memory needed to build the graph of the union
+            memory_estimate = estimate_graph_memory(union_bases, k, bytes_per_base=memory_model, max_memory=max_memory)
+
+            #If the time budget of the gap is used up, skip the remaining (k, a) combinations
+            budget_used_up = time_budget.exhausted()
+            if budget_used_up is not None:
+                timeout_flag = "k{}.a{}:{}".format(k, a, budget_used_up)
+                print("Warning for {}: The time budget of the gap is used up ({}), the remaining k/a values are skipped".format(str(gap_label), budget_used_up))
+                break
 
             #Perform the gap-filling with MindTheGap
-            mtg_fill(gap_label, input_file, bkpt_file, k, a, max_nodes, max_length, nb_cores, max_memory, verbose, output)
+            #(started only once 'nb_cores' tokens of the budget of threads and 'memory_estimate' MBytes of the memory budget are available)
+            new_run = True
+            if args.speculative > 1:
+                result = sweep.run((k, a))
+            #With '--batch', MindTheGap is run once for k and a on the union of the group (with the breakpoints of all its gaps), and the inserted sequences of the gap are split from its outputs
+            elif batch is not None:
+                timeout, cpu_limit = time_budget.limits()
+                def batch_fill(batch_bkpt_file, batch_output_prefix):
+                    with mtg_resources(nb_cores, memory_estimate):
+                        return mtg_fill(batch.name, input_file, batch_bkpt_file, k, a, max_nodes, max_length, nb_cores, max_memory, verbose, batch_output_prefix, timeout=timeout, cpu_limit=cpu_limit, cwd=gap_scratch)
+                result, new_run = batch.run(k, a, batch_fill)
+                batch.split(k, a, gap_label, os.path.join(mtgDir, output))
+            else:
+                timeout, cpu_limit = time_budget.limits()
+                with mtg_resources(nb_cores, memory_estimate):
+                    result = mtg_fill(gap_label, input_file, bkpt_file, k, a, max_nodes, max_length, nb_cores, max_memory, verbose, os.path.join(mtgDir, output), timeout=timeout, cpu_limit=cpu_limit, cwd=gap_scratch)
+
+            #Remove the de Bruijn graph of the run once it is done (a graph only holds the solid k-mers of its own abundance threshold, so it can't be reused by the other runs)
+            graph_file = os.path.join(mtgDir, output + ".h5")
+            if os.path.exists(graph_file):
+                os.remove(graph_file)
+
+            #Record the peak RSS of the MindTheGap run, to calibrate the memory model (a run of a group of gaps is recorded once)
+            if new_run:
+                record_mtg_telemetry(telemetry_file, [gap_label if batch is None else batch.name, k, a, union_bases, "{:.1f}".format(memory_estimate), "{:.1f}".format(result.peak_rss), "{:.1f}".format(result.wall_time)])
+                mtg_usage.add(result)
+
+            #If the MindTheGap run reached a time limit, remove its outputs and skip the remaining (k, a) combinations
+            #(a run of a group of gaps is charged once to the time budget, to the gap that started it, as in 'mtg_usage')
+            limit_reached = time_budget.add(result, charge=new_run)
+            if limit_reached is not None:
+                timeout_flag = "k{}.a{}:{}".format(k, a, limit_reached)
+                print("Warning for {}: MindTheGap reached its time limit ({}) for k={} and a={}, the remaining k/a values are skipped".format(str(gap_label), limit_reached, k, a))
+                remove_outputs(mtgDir, output)
+                break
 
             #If at least one solution is found, perform qualitative evaluation of the gap-filled sequence(s)
             if os.path.getsize(mtgDir +"/"+ output + ".insertions.fasta") > 0:
@@ -295,6 +621,7 @@ def gapfilling(current_gap):
 
                 #Modify the 'insertion_file' and save it to a new file ('input_file') so that the 'solution x/y' part appears in record.id (and not just in record.description)
                 input_file = os.path.abspath(mtgDir +"/"+ output + "..insertions.fasta")
+                qry_records = []
                 with open(insertion_file, "r") as original, open(input_file, "w") as corrected:
                     records = SeqIO.parse(original, "fasta")
                     for record in records:
@@ -303,6 +630,7 @@ def gapfilling(current_gap):
                         else:
                             record.id = record.id + "_sol_1/1"
                         SeqIO.write(record, corrected, "fasta")
+                        qry_records.append(record)
 
                 #----------------------------------------------------
                 # Stats of the alignments query_seq vs reference_seq
@@ -342,41 +670,28 @@ def gapfilling(current_gap):
 
                 if not os.path.isfile(ref_file):
                     print("Warning: Something wrong with the specified reference file. Exception-", sys.exc_info())
+                    stats = False
 
-                #Do statistics on the alignments of query_seq (found gapfill seq) vs reference
+                #Do statistics on the alignments of query_seq (found gapfill seq) vs reference (in-process, the stats files are also saved in 'statsDir')
                 else:
-                    prefix = "{}.k{}.a{}".format(str(gap_label), k, a) 
-                    stats_align(gap_label, input_file, ref_file, str(ext), prefix, statsDir)
+                    prefix = "{}.k{}.a{}".format(str(gap_label), k, a)
+                    try:
+                        ref_records = list(SeqIO.parse(ref_file, "fasta"))
+                        flanking_contigs = re.match('^.*.contigs.fasta$', ref_file) is not None
+                        ref_qry_stats, qry_qry_stats = stats_alignment(qry_records, ref_records, ext, prefix, statsDir, str(gap_label), gap.length, args.chunk, k, a, flanking_contigs, work_dir=gap_scratch, native=args.native_align, cache=alignment_cache)
+                        stats = True
+                    except Exception as e:
+                        print("Warning for {}: The statistics of the alignments failed for k={} and a={}. Exception-".format(str(gap_label), k, a), e)
+                        stats = False
 
                 #----------------------------------------------------
                 # Estimate quality of gapfilled sequence
                 #----------------------------------------------------
-                #Reader for alignment stats' files
-                ref_qry_file = statsDir + "/" + prefix + ".ref_qry.alignment.stats"
-                qry_qry_file = statsDir + "/" + prefix + ".qry_qry.alignment.stats"
+                if stats:
+                    #Index the quality scores of the stats rows by strand, solution (and reference), to score each gapfilled seq with lookups
+                    ref_qry_index, qry_qry_index = index_stats_rows(ref_qry_stats, qry_qry_stats)
+                    ref_names = set(row.ref for row in ref_qry_stats)
 
-                if not os.path.exists(ref_qry_file):
-                    print("Warning: The '{}' file doesn't exits".format(ref_qry_file))
-                    stats = False
-                elif not os.path.exists(qry_qry_file):
-                    print("Warning: The '{}' file doesn't exits".format(qry_qry_file))
-                    stats = False
-
-                else:
-                    stats = True
-                    ref_qry_output = open(ref_qry_file)
-                    qry_qry_output = open(qry_qry_file)
-
-                    reader_ref_stats = csv.DictReader(ref_qry_output, \
-                                                    fieldnames=("Gap", "Len_gap", "Chunk", "k", "a", "Strand", "Solution", "Len_Q", "Ref", "Len_R", \
-                                                                "Start_ref", "End_ref", "Start_qry", "End_qry", "Len_alignR", "Len_alignQ", "%_Id", "%_CovR", "%_CovQ", "Frame_R", "Frame_Q", "Quality"), \
-                                                    delimiter='\t')
-
-                    reader_revcomp_stats = csv.DictReader(qry_qry_output, \
-                                                        fieldnames=("Gap", "Len_gap", "Chunk", "k", "a", "Solution1", "Len_Q1", "Solution2", "Len_Q2", \
-                                                                    "Start_Q1", "End_Q1", "Start_Q2", "End_Q2", "Len_align_Q1", "Len_align_Q2", "%_Id", "%_Cov_Q1", "%_Cov_Q2", "Frame_Q1", "Frame_Q2", "Quality"), \
-                                                        delimiter='\t')
-                    
                     #Obtain a quality score for each gapfilled seq
                     solutions = []
                     output_for_gfa = []
@@ -386,6 +701,8 @@ def gapfilling(current_gap):
 
                             seq = record.seq
                             strand = str(record.id).split('_')[0][-1]
+                            record_strand = "fwd" if "bkpt1" in record.id else ("rev" if "bkpt2" in record.id else None)
+                            record_solution = record.id.split('_sol_')[-1]
 
                             #----------------------------------------------------
                             #Ref = reference sequence of simulated gap
@@ -393,24 +710,16 @@ def gapfilling(current_gap):
                             if args.refDir is not None:
                                 #quality score for stats about the ref
                                 quality_ref = []
-                                for row in reader_ref_stats:
-                                    if (row["Solution"] in record.id) and (("bkpt1" in record.id and row["Strand"] == "fwd") or ("bkpt2" in record.id and row["Strand"] == "rev")):
-                                        quality_ref.append(row["Quality"])
+                                for ref in ref_names:
+                                    quality_ref.extend(ref_qry_index.get((record_strand, record_solution, ref), []))
                                 
                                 if quality_ref == []:
                                     quality_ref.append('D')
 
-                                ref_qry_output.seek(0)
-
                                 #quality score for stats about the reverse complement strand
-                                quality_revcomp = []
-                                for row in reader_revcomp_stats:
-                                    if ((record.id.split('_')[-1] in row["Solution1"]) and (("bkpt1" in record.id and "fwd" in row["Solution1"]) or ("bkpt2" in record.id and "rev" in row["Solution1"]))) \
-                                        or ((record.id.split('_')[-1] in row["Solution2"]) and (("bkpt1" in record.id and "fwd" in row["Solution2"]) or ("bkpt2" in record.id and "rev" in row["Solution2"]))):
-                                        quality_revcomp.append(row["Quality"])
+                                quality_revcomp = list(qry_qry_index.get((record_strand, record_solution), []))
                                 if quality_revcomp == []:
                                     quality_revcomp.append('D')
-                                qry_qry_output.seek(0)
 
                                 #global quality score
                                 quality_gapfilled_seq = min(quality_ref) + min(quality_revcomp)
@@ -433,29 +742,17 @@ def gapfilling(current_gap):
                             #----------------------------------------------------
                             else:
                                 #quality score for stats about the extension
-                                quality_ext_left = []
-                                quality_ext_right = []
-                                for row in reader_ref_stats:
-                                    if (row["Solution"] in record.id) and (("bkpt1" in record.id and row["Strand"] == "fwd") or ("bkpt2" in record.id and row["Strand"] == "rev")) and (row["Ref"] == left_scaffold.name):
-                                        quality_ext_left.append(row["Quality"])
-                                    elif (row["Solution"] in record.id) and (("bkpt1" in record.id and row["Strand"] == "fwd") or ("bkpt2" in record.id and row["Strand"] == "rev")) and (row["Ref"] == right_scaffold.name):
-                                        quality_ext_right.append(row["Quality"])
+                                quality_ext_left = list(ref_qry_index.get((record_strand, record_solution, left_scaffold.name), []))
+                                quality_ext_right = list(ref_qry_index.get((record_strand, record_solution, right_scaffold.name), [])) if right_scaffold.name != left_scaffold.name else []
                                 if quality_ext_left == []:
                                     quality_ext_left.append('D')
                                 if quality_ext_right == []:
                                     quality_ext_right.append('D')
 
-                                ref_qry_output.seek(0)
-
                                 #quality score for stats about the reverse complement strand
-                                quality_revcomp = []
-                                for row in reader_revcomp_stats:
-                                    if ((record.id.split('_')[-1] in row["Solution1"]) and (("bkpt1" in record.id and "fwd" in row["Solution1"]) or ("bkpt2" in record.id and "rev" in row["Solution1"]))) \
-                                        or ((record.id.split('_')[-1] in row["Solution2"]) and (("bkpt1" in record.id and "fwd" in row["Solution2"]) or ("bkpt2" in record.id and "rev" in row["Solution2"]))):
-                                        quality_revcomp.append(row["Quality"])
+                                quality_revcomp = list(qry_qry_index.get((record_strand, record_solution), []))
                                 if quality_revcomp == []:
                                     quality_revcomp.append('D')
-                                qry_qry_output.seek(0)
 
                                 #global quality score
                                 quality_gapfilled_seq = min(quality_ext_left) + min(quality_ext_right) + min(quality_revcomp)
@@ -477,11 +774,10 @@ def gapfilling(current_gap):
                         qualified.seek(0)
 
                     #remove the 'input_file' once done with it
-                    subprocess.run(["rm", input_file])
+                    os.remove(input_file)
 
                     #remplace the 'insertion_file' by the 'insertion_quality_file' (which is then renamed 'insertion_file')
-                    subprocess.run(["rm", insertion_file])
-                    subprocess.run(['mv', insertion_quality_file, insertion_file])
+                    os.replace(insertion_quality_file, insertion_file)
 
 
                 #If at least one good solution for both fwd and rev strands amongst all solution found, stop searching
@@ -491,7 +787,6 @@ def gapfilling(current_gap):
 
                 else:
                     solution = False
-                    os.chdir(mtgDir)
             
 
             #If no solution found, remove the 'xxx.insertions.fasta' and 'xxx.insertions.vcf' file, and set 'solution' to False
@@ -499,11 +794,15 @@ def gapfilling(current_gap):
                 output_for_gfa = []
                 insertion_fasta = os.path.abspath(mtgDir +"/"+ output + ".insertions.fasta")
                 insertion_vcf = os.path.abspath(mtgDir +"/"+ output + ".insertions.vcf")
-                subprocess.run(["rm", insertion_fasta])
-                subprocess.run(["rm", insertion_vcf])
+                for insertion_output in [insertion_fasta, insertion_vcf]:
+                    if os.path.exists(insertion_output):
+                        os.remove(insertion_output)
                 solution = False
 
 
+        if timeout_flag != "NA":
+            break
+
         if solution == True and not args.force:
             break
 
@@ -516,36 +815,308 @@ def gapfilling(current_gap):
             if len(output_for_gfa) == 0:
                 output_for_gfa.append([str(current_gap)])
 
+    #----------------------------------------------------
+    # GFA output: case gap, time limit reached
+    #----------------------------------------------------
+    if timeout_flag != "NA" and len(output_for_gfa) == 0:
+        output_for_gfa.append([str(current_gap)])
+    union_summary.append(timeout_flag)
+    union_summary.extend(mtg_usage.summary())
+    union_summary.extend(["NA", spectrum_flag, sweep_flag, skipped_flag, (batch.name if batch is not None else "NA")])
+    print("{}: MindTheGap {}".format(str(gap_label), mtg_usage))
+    if alignment_cache.nb_reused > 0:
+        print("{}: {} inserted sequence(s) aligned, {} found for several k/a values and aligned once".format(str(gap_label), alignment_cache.nb_aligned, alignment_cache.nb_reused))
+
+    #Kill the speculative MindTheGap runs not needed anymore, and remove their outputs
+    sweep.cancel()
+    if sweep.nb_cancelled > 0:
+        print("{}: {} speculative MindTheGap run(s) cancelled".format(str(gap_label), sweep.nb_cancelled))
+
+    #Remove the de Bruijn graphs left by the gap (graphs of the speculative runs not consumed), once all its runs are joined or cancelled
+    for graph_file in glob.glob(os.path.join(mtgDir, glob.escape("{}.{}.g{}.c{}.".format(gfa_name, str(gap_label), gap.length, args.chunk)) + "*.h5")):
+        os.remove(graph_file)
 
     
 
-    #TODO: remove the flanking_contig.fasta files
+    #Remove the scratch directory of the gap
+    shutil.rmtree(gap_scratch, ignore_errors=True)
 
-    os.chdir(outDir)
+    #TODO: remove the flanking_contig.fasta files
 
 
     return union_summary, output_for_gfa
 
 
+#----------------------------------------------------
+# gapfilling_task function
+#----------------------------------------------------
+'''
+To run the gap-filling of a gap in a worker, within the budget of threads of the run (one token held during the whole gap):
+    - it takes as input the current gap on which we want to perform the gap-filling, and its union if already extracted (or None)
+    - it outputs the PID of the worker, the start and end times of the gap-filling, and the list of the results of the function 'gapfilling' (one gap)
+'''
+def gapfilling_task(item):
+    current_gap, union = item
+    with get_core_budget().cores(1):
+        return timed_call(lambda current_gap: [gapfilling(current_gap, union)], current_gap)
+
+
+#----------------------------------------------------
+# union_barcodes_task function
+#----------------------------------------------------
+'''
+To get the barcodes of the union of a gap in a worker ('--batch'):
+    - it takes as input the gap
+    - it outputs the gap and the set of the barcodes of its union
+'''
+def union_barcodes_task(current_gap):
+    with get_core_budget().cores(1):
+        gap_line = gfa_tables.gap_by_line[current_gap]
+        union_job, barcodes = get_union_barcodes(gap_line, Gap(gap_line).label())
+    return current_gap, set(barcodes)
+
+
+#----------------------------------------------------
+# gapfilling_batch function
+#----------------------------------------------------
+'''
+To perform the gap-filling on a group of gaps ('--batch'), with a single MindTheGap run per (k, a) combination on the union of the group:
+    - it takes as input the group (list of gaps) and the barcodes of the union of the group
+    - it outputs the list of the results of the function 'gapfilling' for each gap of the group (a group of one gap being gap-filled on its own)
+'''
+def gapfilling_batch(group, barcodes):
+    first_gap = gfa_tables.gap_by_line[group[0]]
+    batch = MtgBatch("{}.batch.{}.n{}.c{}".format(gfa_name, str(Gap(first_gap).label()), len(group), args.chunk), mtgDir) if len(group) > 1 else None
+
+    #Union of the group: the reads associated with the barcodes of all its gaps
+    if args.rbxu is not None:
+        union_reads_file = None
+    else:
+        union_reads_file = (batch.name + ".rbxu.fastq") if batch is not None else get_union_job(first_gap)["union_reads_file"]
+        union_barcodes_file = os.path.join(scratchDir, union_reads_file + ".bxu")
+        with open(union_barcodes_file, "w") as union_barcodes:
+            for barcode in barcodes:
+                union_barcodes.write(barcode + "\n")
+        with open(os.path.join(unionDir, union_reads_file), "w") as union_reads:
+            get_reads(reads_file, index_file, (batch.name if batch is not None else str(Gap(first_gap).label())), union_barcodes_file, union_reads, log_dir=unionDir)
+        os.remove(union_barcodes_file)
+    union = {"union_reads_file": union_reads_file, "nb_barcodes": len(barcodes)}
+
+    #Breakpoints of all the gaps of the group (needed by the first MindTheGap run of the group)
+    if batch is not None:
+        for current_gap in group:
+            gap_line = gfa_tables.gap_by_line[current_gap]
+            gap = Gap(gap_line)
+            left_scaffold = Scaffold(gap_line, gap.left, gfa_file)
+            right_scaffold = Scaffold(gap_line, gap.right, gfa_file)
+            batch.add_breakpoints(write_bkpt_files(gap, gap.label(), left_scaffold, right_scaffold, str(left_scaffold.sequence()), str(right_scaffold.sequence())))
+
+    results = [gapfilling(current_gap, union, batch) for current_gap in group]
+    if batch is not None:
+        batch.close()
+    return results
+
+
+#----------------------------------------------------
+# gapfilling_batch_task function
+#----------------------------------------------------
+'''
+To run the gap-filling of a group of gaps in a worker ('--batch'), within the budget of threads of the run (one token held during the whole group):
+    - it takes as input the group (list of gaps) and the barcodes of the union of the group
+    - it outputs the PID of the worker, the start and end times of the gap-filling, and the list of the results of the function 'gapfilling' for each gap of the group
+'''
+def gapfilling_batch_task(item):
+    group, barcodes = item
+    with get_core_budget().cores(1):
+        return timed_call(lambda group: gapfilling_batch(group, barcodes), group)
+
+
+#----------------------------------------------------
+# union_sizing_task function
+#----------------------------------------------------
+'''
+To size the union of a gap in a worker, without gap-filling it ('--plan'):
+    - it takes as input the item of the gap (the gap, and its union if already extracted by the asyncio orchestrator ('--prefetch'))
+    - it outputs a dictionary with the gap's name ('left_right'), its label and size, and the number of barcodes, reads and bases of its union
+'''
+def union_sizing_task(item):
+    current_gap, union = item
+    with get_core_budget().cores(1):
+        current_gap = gfa_tables.gap_by_line[current_gap]
+        gap = Gap(current_gap)
+        gap_label = gap.label()
+        gap_scratch = os.path.join(scratchDir, "{}.{}.g{}.c{}".format(gfa_name, str(gap_label), gap.length, args.chunk))
+        os.makedirs(gap_scratch, exist_ok=True)
+        union_reads_file, bxu, rbxu, union_bases = get_union(current_gap, gap_label, gap_scratch, union)
+        shutil.rmtree(gap_scratch, ignore_errors=True)
+
+    return {"Gap": str(gap.left) +"_"+ str(gap.right), "Gap_ID": str(gap_label), "Gap_size": gap.length, "Nb_barcodes": bxu, "Nb_reads": int(rbxu), "Nb_bases": union_bases}
+
+
+#----------------------------------------------------
+# Merge the outputs of the shards
+#----------------------------------------------------
+#The journals of the shards contain the results of all their gaps: they are replayed, in the order of the gaps in the input GFA file,
+#into the output files of a single-node run ('.union.sum', output GFA and gapfill FASTA files)
+if args.merge:
+    try:
+        gfa_tables = load_gfa_tables(gfa_file, use_cache=(not args.no_cache))
+        manifests = load_shard_manifests(gfa_file, gfa_name, outDir)
+        print("Merging the outputs of {} shard(s)".format(len(manifests)))
+
+        gap_keys = [str(_gap_.sid1) +"_"+ str(_gap_.sid2) for _gap_ in gfa_tables.gaps]
+        shard_results = load_shard_results(manifests, gap_keys)
+
+        #GFA output: H and S lines (or all the lines if no gap), then the results of each gap
+        with open(out_gfa_file, "w") as f:
+            if len(gfa_tables.gaps) == 0:
+                for line in gfa_tables.lines:
+                    f.write(line + "\n")
+            else:
+                f.write("H\tVN:Z:2.0\n")
+                for line in gfa_tables.segments:
+                    f.write(str(line) + "\n")
+        with open("{}.union.sum".format(gfa_name), "w") as union_sum:
+            union_sum.write('\t'.join(j for j in union_sum_legend))
+        open(gfa_name + ".gapfill_seq.fasta", "w").close()
+
+        writer = GapOutputWriter(outDir, "{}.union.sum".format(gfa_name), out_gfa_file, gfa_name + ".gapfill_seq.fasta")
+        results = []
+        for gap_key, (union_summary, output_for_gfa) in zip(gap_keys, shard_results):
+            writer.write_gap(gap_key, union_summary, output_for_gfa)
+            results.append((union_summary, output_for_gfa))
+        writer.close()
+
+        summary = get_gapfill_summary(results)
+        summary_tsv, summary_json = write_gapfill_summary(summary, outDir +"/"+ gfa_name)
+
+        #Remove the raw files obtained from MindTheGap
+        for raw_file in glob.glob(os.path.join(mtgDir, "*.h5")) + glob.glob(os.path.join(mtgDir, "*.vcf")):
+            os.remove(raw_file)
+        remove_scratch_dir()
+
+    except Exception as e:
+        print("\nException-")
+        print(e)
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        print(exc_type, fname, exc_tb.tb_lineno)
+        sys.exit(1)
+
+    print("\nSummary of the union: " +gfa_name+".union.sum")
+    print("GFA output file: " + out_gfa_file)
+    print("{} out of {} gaps were successfully gap-filled".format(sum(1 for gap_summary in summary if gap_summary["Status"] == "gapfilled"), len(summary)))
+    print("Machine-readable summary: " + summary_tsv + " and " + summary_json + "\n")
+    sys.exit(0)
+
+
+#----------------------------------------------------
+# Plan of the run
+#----------------------------------------------------
+#The unions of the gaps are extracted and sized (no MindTheGap), then the wall-clock time and peak memory of each gap are estimated with the cost model
+#fitted on the telemetry file of the previous runs, and the run is scheduled on '--threads' cores (or all the CPUs) within the '--memory' budget
+if args.plan:
+    try:
+        gfa_tables = load_gfa_tables(gfa_file, use_cache=(not args.no_cache))
+        if args.line is not None:
+            gap_records = gfa_tables.gaps[(args.line - (len(gfa_tables.segments)+2)):]
+        else:
+            gap_records = gfa_tables.gaps
+        if args.shard is not None:
+            gap_records = shard_gaps(gap_records, nb_shards)[shard_index - 1]
+        gaps = [str(_gap_) for _gap_ in gap_records]
+
+        #Size the union of each gap
+        if args.threads is not None:
+            set_core_budget(CoreBudget(args.threads))
+            p = Pool(nodes=args.threads)
+        else:
+            p = Pool()
+        if args.prefetch is not None:
+            prefetcher = UnionPrefetcher(lambda job, tool_semaphores: extract_union_async(job, bam_file, reads_file, index_file, args.freq, unionDir, tool_semaphores), \
+                                        args.prefetch, {"BamExtractor": args.extract_jobs, "reads_bx_sqlite3.py": args.extract_jobs}, nb_workers=p.ncpus)
+            items = prefetcher.run([(_gap_, get_union_job(gfa_tables.gap_by_line[_gap_])) for _gap_ in gaps])
+        else:
+            items = [(_gap_, None) for _gap_ in gaps]
+        union_sizes = {}
+        for union_size in p.uimap(union_sizing_task, items):
+            union_sizes[union_size["Gap"]] = union_size
+            if args.prefetch is not None:
+                prefetcher.done()
+        p.close()
+
+        #Cost model calibrated on the MindTheGap runs of the previous runs
+        memory_model = fit_memory_model(telemetry_file)
+        runtime_model = fit_runtime_model(telemetry_file)
+        print("\nCost model fitted on {} MindTheGap run(s): {:.1f} s + {:.3g} s/base, {:.3g} bytes/base".format(runtime_model[2], runtime_model[0], runtime_model[1], memory_model))
+
+        #Estimate the cost of each gap, in the order in which the gaps would be dispatched
+        #(whole k/a sweep, i.e. an upper bound as the sweep stops at the first good solution, within the time limits of MindTheGap)
+        plan = []
+        gap_records = order_gaps_by_cost(gap_records, {gap_key: union_size["Nb_reads"] for gap_key, union_size in union_sizes.items()})
+        for _gap_ in gap_records:
+            union_size = dict(union_sizes[str(_gap_.sid1) +"_"+ str(_gap_.sid2)])
+            union_size["Prescreen"] = prescreen_union(union_size["Nb_barcodes"], union_size["Nb_reads"], union_size["Nb_bases"], union_size["Gap_size"] + 2*args.chunk, args.min_barcodes, args.min_reads, args.min_coverage)
+            if union_size["Prescreen"] is not None:
+                union_size["Cores"], union_size["Runtime_s"], union_size["Peak_memory_MB"] = 1, 0.0, 0.0
+            else:
+                union_size["Cores"] = mtg_cores_for_union(union_size["Nb_reads"], min(args.nb_cores, args.threads)) if args.threads is not None else args.nb_cores
+                mtg_runtime = estimate_mtg_runtime(union_size["Nb_bases"], runtime_model)
+                if args.mtg_timeout is not None:
+                    mtg_runtime = min(mtg_runtime, args.mtg_timeout)
+                union_size["Runtime_s"] = mtg_runtime * len(args.kmer) * len(args.abundance_threshold)
+                if args.gap_timeout is not None:
+                    union_size["Runtime_s"] = min(union_size["Runtime_s"], args.gap_timeout)
+                union_size["Peak_memory_MB"] = max(estimate_graph_memory(union_size["Nb_bases"], k, bytes_per_base=memory_model, max_memory=args.max_memory) for k in args.kmer)
+            plan.append(union_size)
+
+        #Schedule of the run on the node
+        nb_node_cores = args.threads if args.threads is not None else os.cpu_count()
+        makespan, peak_memory = plan_schedule(plan, nb_node_cores, args.memory)
+
+        plan_legend = ["Gap", "Gap_ID", "Gap_size", "Nb_barcodes", "Nb_reads", "Nb_bases", "Prescreen", "Cores", "Runtime_s", "Peak_memory_MB", "Start_s", "End_s"]
+        plan_file = output_name + ".plan.tsv"
+        with open(plan_file, "w") as f:
+            f.write('\t'.join(plan_legend) + '\n')
+            for gap_plan in plan:
+                gap_plan["Prescreen"] = gap_plan["Prescreen"] if gap_plan["Prescreen"] is not None else "NA"
+                f.write('\t'.join(str(gap_plan[column]) if not isinstance(gap_plan[column], float) else "{:.1f}".format(gap_plan[column]) for column in plan_legend) + '\n')
+
+        print("\nPlan of the run ({} gap(s)):".format(len(plan)))
+        for gap_plan in plan:
+            print("\t{}: {} reads, {} bases, {} core(s), {:.1f} s, {:.1f} MB, start at {:.1f} s".format(gap_plan["Gap"], gap_plan["Nb_reads"], gap_plan["Nb_bases"], gap_plan["Cores"], gap_plan["Runtime_s"], gap_plan["Peak_memory_MB"], gap_plan["Start_s"]))
+        print("\nEstimated MindTheGap time of all the gaps: {:.1f} s".format(sum(gap_plan["Runtime_s"] for gap_plan in plan)))
+        print("Estimated makespan on {} core(s){}: {:.1f} s".format(nb_node_cores, " and {} MB".format(args.memory) if args.memory is not None else "", makespan))
+        print("Estimated peak memory: {:.1f} MB (largest gap: {:.1f} MB)".format(peak_memory, max([gap_plan["Peak_memory_MB"] for gap_plan in plan] + [0.0])))
+        print("Plan file: " + plan_file + "\n")
+        remove_scratch_dir()
+
+    except Exception as e:
+        print("\nException-")
+        print(e)
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        print(exc_type, fname, exc_tb.tb_lineno)
+        sys.exit(1)
+
+    sys.exit(0)
+
+
 #----------------------------------------------------
 # Gapfilling with MindTheGap
 #----------------------------------------------------
 try:
-    #Open the input GFA file
-    gfa = gfapy.Gfa.from_file(gfa_file)
-    #Create the output GFA file
-    out_gfa_file = str(gfa_name).split('.gfa')[0] + "_mtglink.gfa"
+    #Load the tables of the input GFA file (parsed GFA, or binary sidecar cache of the parsed GFA)
+    gfa_tables = load_gfa_tables(gfa_file, use_cache=(not args.no_cache))
 
     #----------------------------------------------------
     # GFA output: case no gap
     #----------------------------------------------------
     #If no gap, rewrite all the lines into GFA output
-    if len(gfa.gaps) == 0:
+    if len(gfa_tables.gaps) == 0:
         with open(out_gfa_file, "w") as f:
-            out_gfa = gfapy.Gfa()
-            for line in gfa.lines:
-                out_gfa.add_line(str(line))
-            out_gfa.to_file(out_gfa_file)
+            for line in gfa_tables.lines:
+                f.write(line + "\n")
 
     #----------------------------------------------------   
     # Fill the gaps
@@ -553,54 +1124,150 @@ try:
     #If gap, rewrite the H and S lines into GFA output
     if args.line is None:
         with open(out_gfa_file, "w") as f:
-            out_gfa = gfapy.Gfa()
-            out_gfa.add_line("H\tVN:Z:2.0")
-            for line in gfa.segments:
-                out_gfa.add_line(str(line))
-            out_gfa.to_file(out_gfa_file)
+            f.write("H\tVN:Z:2.0\n")
+            for line in gfa_tables.segments:
+                f.write(str(line) + "\n")
         
-    gaps = []
-    gaps_label = []
     #If '-line' argument provided, start analysis from this line in GFA file input
     if args.line is not None:
-        for _gap_ in gfa.gaps[(args.line - (len(gfa.segments)+2)):]:
-            _gap_ = str(_gap_)
-            gaps.append(_gap_)
+        gap_records = gfa_tables.gaps[(args.line - (len(gfa_tables.segments)+2)):]
     else:
-        #Convert Gfapy gap line to a string to be able to use it with multiprocessing
-        for _gap_ in gfa.gaps:
-            _gap_ = str(_gap_)
-            gaps.append(_gap_)
-
-    p = Pool()
-
-    with open("{}.union.sum".format(gfa_name), "w") as union_sum:
-        legend = ["Gap_ID", "Left_scaffold", "Right_scaffold", "Gap_size", "Chunk_size", "Nb_barcodes", "Nb_reads"]
-        union_sum.write('\t'.join(j for j in legend))
-
-        for union_summary, output_for_gfa in p.map(gapfilling, gaps):
-            #Write all union_summary (obtained for each gap) from 'gapfilling' into the 'union_sum' file
-            union_sum.write("\n" + '\t'.join(str(i) for i in union_summary))
-
-            #Output the 'output_for_gfa' results (obtained for each gap) from 'gapfilling' in the output GFA file
-            print("\nCreating the output GFA file...")
-            if len(output_for_gfa[0]) > 1:          #solution found for the current gap
-                for output in output_for_gfa:
-                    gapfill_file = update_gfa_with_solution(outDir, gfa_name, output, out_gfa_file)
-                    success = True
-            else:                                   #no solution found for the current gap
-                out_gfa = gfapy.Gfa.from_file(out_gfa_file)
-                out_gfa.add_line(output_for_gfa[0][0])
-                out_gfa.to_file(out_gfa_file)
-                success = False
+        gap_records = gfa_tables.gaps
+
+    #If '--shard' argument provided, keep only the gaps of this shard
+    if args.shard is not None:
+        gap_records = shard_gaps(gap_records, nb_shards)[shard_index - 1]
+        shard_gap_keys = [str(_gap_.sid1) +"_"+ str(_gap_.sid2) for _gap_ in gap_records]
+        print("Shard {}/{}: {} gap(s) out of {}".format(shard_index, nb_shards, len(gap_records), len(gfa_tables.gaps)))
+
+    #Memory model calibrated on the MindTheGap runs of the previous runs, and node-wide memory budget
+    memory_model = fit_memory_model(telemetry_file)
+    init_mtg_telemetry(telemetry_file)
+    if args.memory is not None:
+        set_memory_budget(MemoryBudget(args.memory))
+
+    #Checkpoint journal of the finished gaps: read it to resume a run, or start a new one
+    journal = GapJournal("{}.journal.jsonl".format(output_name))
+    if args.resume:
+        finished_gaps = journal.load()
+        print("Resuming the run: {} gap(s) already done".format(len(finished_gaps)))
+    else:
+        finished_gaps = {}
+        journal.reset()
+    gap_records = [_gap_ for _gap_ in gap_records if (str(_gap_.sid1) +"_"+ str(_gap_.sid2)) not in finished_gaps]
 
+    #Order the gaps longest-expected-first (gap length, and union size if known from a previous run)
+    union_sizes = read_union_sizes("{}.union.sum".format(output_name))
+    gap_records = order_gaps_by_cost(gap_records, union_sizes)
 
-        p.close()
+    #Convert gap line to a string to be able to use it with multiprocessing
+    gaps = [str(_gap_) for _gap_ in gap_records]
+
+    #Global budget of threads: as many workers as threads, each gap holding one token, and 'nb_cores' tokens during a MindTheGap run
+    if args.threads is not None:
+        set_core_budget(CoreBudget(args.threads))
+        p = Pool(nodes=args.threads)
+    else:
+        p = Pool()
+    telemetry = RunTelemetry(p.ncpus)
+    results = []
+    gapfill_file = None
+    run_stats_file = output_name + ".run.stats"
+
+    with open("{}.union.sum".format(output_name), "w") as union_sum:
+        union_sum.write('\t'.join(j for j in union_sum_legend))
+
+    #Stream the results of each gap to the output files ('.union.sum', output GFA and gapfill FASTA) as soon as the gap is done
+    if args.line is None:
+        open(output_name + ".gapfill_seq.fasta", "w").close()
+    writer = GapOutputWriter(outDir, "{}.union.sum".format(output_name), out_gfa_file, output_name + ".gapfill_seq.fasta")
+
+    #Replay the gaps of the journal into the output files
+    for gap_key, (union_summary, output_for_gfa) in finished_gaps.items():
+        writer.write_gap(gap_key, union_summary, output_for_gfa)
+        results.append((union_summary, output_for_gfa))
+
+    #With '--prefetch', the unions of the gaps are extracted ahead of the workers by an asyncio orchestrator in the main process (in the longest-expected-first order of the gaps),
+    #and each gap is dispatched as soon as its union is extracted; the union of a gap is extracted only when less than 'workers + --prefetch' gaps are extracted and not yet done
+    task = gapfilling_task
+    if args.prefetch is not None:
+        prefetcher = UnionPrefetcher(lambda job, tool_semaphores: extract_union_async(job, bam_file, reads_file, index_file, args.freq, unionDir, tool_semaphores), \
+                                    args.prefetch, {"BamExtractor": args.extract_jobs, "reads_bx_sqlite3.py": args.extract_jobs}, nb_workers=p.ncpus)
+        items = prefetcher.run([(_gap_, get_union_job(gfa_tables.gap_by_line[_gap_])) for _gap_ in gaps])
+
+    #With '--batch' or '--similarity-order', the barcodes of the unions of all the gaps are extracted first (and the reads of each union are then extracted from these barcodes)
+    elif args.batch is not None or args.similarity_order:
+        gap_barcodes = dict(p.uimap(union_barcodes_task, gaps))
+
+        #With '--batch', the gaps whose unions overlap strongly are grouped, each group being gap-filled by a worker with a single MindTheGap run per (k, a) combination
+        if args.batch is not None:
+            groups = group_gaps_by_barcodes(gaps, gap_barcodes, args.batch, args.batch_size)
+            print("Batching: {} gap(s) in {} group(s) ({} group(s) of several gaps)".format(len(gaps), len(groups), sum(1 for group in groups if len(group) > 1)))
+        else:
+            groups = [[_gap_] for _gap_ in gaps]
+        items = [(group, sorted(set().union(*[gap_barcodes[_gap_] for _gap_ in group]))) for group in groups]
+        task = gapfilling_batch_task
+
+        #With '--similarity-order', the gaps (or groups) are reordered so that the ones sharing barcodes are dispatched one after the other
+        if args.similarity_order:
+            order, similarity_before, similarity_after = order_by_similarity([minhash_sketch(barcodes) for group, barcodes in items])
+            items = [items[i] for i in order]
+            print("Similarity order: mean Jaccard similarity between consecutive unions {:.3f} (instead of {:.3f})".format(similarity_after, similarity_before))
+
+        #Barcodes of each task, by name of its first gap, to estimate the cache hit rate of the run
+        item_barcodes = {}
+        for group, barcodes in items:
+            first_gap = gfa_tables.gap_by_line[group[0]]
+            item_barcodes[str(first_gap.sid1) +"_"+ str(first_gap.sid2)] = set(barcodes)
+
+    else:
+        items = [(_gap_, None) for _gap_ in gaps]
+
+    #Dispatch the gaps (or groups of gaps) one at a time, and get the results as soon as they are done
+    reuse = BarcodeReuse()
+    for pid, start, end, gap_results in p.uimap(task, items):
+        telemetry.add(pid, start, end)
+        if args.prefetch is not None:
+            prefetcher.done()
+        if task is gapfilling_batch_task:
+            reuse.add(pid, item_barcodes[str(gap_results[0][0][1]) +"_"+ str(gap_results[0][0][2])])
+
+        for union_summary, output_for_gfa in gap_results:
+            #Record the finished gap in the journal (synced to disk) before writing its results to the output files
+            journal.record(str(union_summary[1]) +"_"+ str(union_summary[2]), union_summary, output_for_gfa)
+
+            #Output the 'union_summary' and 'output_for_gfa' results (obtained for each gap) from 'gapfilling' in the output files
+            print("\nUpdating the output files with the results of the gap {}_{}...".format(union_summary[1], union_summary[2]))
+            writer.write_gap(str(union_summary[1]) +"_"+ str(union_summary[2]), union_summary, output_for_gfa)
+
+            #Keep only what the final summary needs (the sequences are already written to the output files)
+            results.append((union_summary, [output[:2] + [None] + output[3:] if len(output) > 1 else output for output in output_for_gfa]))
+
+    p.close()
+
+    #Write the makespan, the utilisation of each worker and the estimated cache hit rate of the run to the file of the statistics of the run
+    with open(run_stats_file, "w") as run_stats:
+        telemetry.report(run_stats)
+        reuse.report(run_stats)
+    writer.close()
+    if writer.nb_solutions > 0:
+        gapfill_file = writer.gapfill_file
+
+    #Reorder the output files in the order of the gaps in the input GFA file
+    if args.stable_order:
+        writer.reorder([str(_gap_.sid1) +"_"+ str(_gap_.sid2) for _gap_ in gfa_tables.gaps])
+
+    #Write the manifest of the shard, listing its gaps and output files (used by '--merge')
+    if args.shard is not None:
+        write_shard_manifest(output_name + ".manifest.json", gfa_file, shard_index, nb_shards, shard_gap_keys, \
+                            {"Journal": journal.journal_file, "Union_sum": "{}.union.sum".format(output_name), "GFA": out_gfa_file, "Gapfill_FASTA": output_name + ".gapfill_seq.fasta"})
 
     #Remove the raw files obtained from MindTheGap
-    os.chdir(mtgDir)
-    subprocess.run("rm -f *.h5", shell=True)
-    subprocess.run("rm -f *.vcf", shell=True)
+    #(with '--shard', the other shards may still be running in the same output directory: the raw files are removed by '--merge')
+    if args.shard is None:
+        for raw_file in glob.glob(os.path.join(mtgDir, "*.h5")) + glob.glob(os.path.join(mtgDir, "*.vcf")):
+            os.remove(raw_file)
+        remove_scratch_dir()
 
 
 except Exception as e:
@@ -615,56 +1282,40 @@ except Exception as e:
 print("\nThe results from MTG-Link are saved in " + outDir)
 print("The results from MindTheGap are saved in " + mtgDir)
 print("The statistics from MTG-Link are saved in " + statsDir)
-print("Summary of the union: " +gfa_name+".union.sum")
+print("Summary of the union: " +output_name+".union.sum")
+print("Statistics of the run (makespan, utilisation of the workers): " + run_stats_file)
 print("GFA output file: " + out_gfa_file)
-if success == True:
+if gapfill_file is not None:
     print("Corresponding file containing all gapfill sequences: " + gapfill_file + "\n")
 
 #----------------------------------------------------
 #Summary output
 #----------------------------------------------------
-gfa_output = gfapy.Gfa.from_file(outDir +"/"+ str(out_gfa_file))
+#Summary computed from the results obtained for each gap (no re-parsing of the output files)
+summary = get_gapfill_summary(results)
+summary_tsv, summary_json = write_gapfill_summary(summary, outDir +"/"+ output_name)
 
 #Total initials gaps
-total_gaps = []
-for g_line in gfa.gaps:
-    gap_start = str(g_line.sid1) +"_"+ str(g_line.sid2) 
-    total_gaps.append(gap_start)
-nb_total_gaps = len(total_gaps)
+nb_total_gaps = len(summary)
 print("------------------------------------------------------------------------------------------------------------------------\n")
 print("Attempt to gap-fill {} gaps \n".format(nb_total_gaps))
 
 #Gap(s) not gap-filled
-no_gapfill = []
-for g_line in gfa_output.gaps:
-    gap_end = str(g_line.sid1) +"_"+ str(g_line.sid2) 
-    no_gapfill.append(gap_end)
-    print("The gap {} was not successfully gap-filled".format(gap_end))
+for gap_summary in summary:
+    if gap_summary["Status"] != "gapfilled":
+        print("The gap {} was not successfully gap-filled".format(gap_summary["Gap"]))
 
-nb_gapfill = len(total_gaps) - len(no_gapfill)
+nb_gapfill = sum(1 for gap_summary in summary if gap_summary["Status"] == "gapfilled")
 print("\nIn total, {} gaps were successfully gap-filled:\n".format(str(nb_gapfill)))
 
-
 #Gaps gap-filled
-out_fasta_file = outDir +"/"+ gapfill_file
-gap_names = []
-if (out_fasta_file) is not None:
-    with open(out_fasta_file, "r") as gapfilled:
-        for record in SeqIO.parse(gapfilled, "fasta"):
-            gap_name = str(record.id).split('_')[0]
-
-            #For a new gap
-            if gap_name not in gap_names:
-                gap_names.append(gap_name)
-                k = str(record.id).split('.k')[-1].split('_')[0]
-                print("\t* " + gap_name + "\tk" + k)
-
-            #For all gaps
-            orientation = str(record.id).split('_')[-1]
-            length = str(record.description).split('_ len_')[1].split('_qual_')[0]
-            quality = str(record.description).split('_qual_')[1]
-            print("\t\t* " + orientation + "\t" + length + " bp\t" + quality)
-           
+for gap_summary in summary:
+    if gap_summary["Status"] == "gapfilled":
+        print("\t* " + gap_summary["Left_scaffold"] +":"+ gap_summary["Right_scaffold"] + "\tk" + str(gap_summary["k"]))
+        for sol in gap_summary["Solutions"]:
+            print("\t\t* " + sol["Orientation"] + "\t" + str(sol["Length"]) + " bp\t" + sol["Quality"])
+
+print("\nMachine-readable summary: " + summary_tsv + " and " + summary_json)
 print("\n")
 
-#TODO: two modules, one when reference sequence provided (args.refDir), one when no reference sequence is provided (args.scaff)
\ No newline at end of file
+#TODO: two modules, one when reference sequence provided (args.refDir), one when no reference sequence is provided (args.scaff)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+#*****************************************************************************
+#  Name: MTG-Link
+#  Description: gap-filling tool for draft genome assemblies, dedicated to
+#  linked read data generated by 10XGenomics Chromium technology.
+#  Copyright (C) 2020 INRAE
+#  Author: Anne Guichard
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#*****************************************************************************
+
+import os
+import queue
+import asyncio
+import threading
+
+
+#----------------------------------------------------
+# run_tool_async function
+#----------------------------------------------------
+'''
+To run an external tool from the asyncio event loop, without blocking it:
+    - it takes as input the command, the log file to which its standard error is appended, the semaphore of the tool (maximum number of processes of the tool at the same time),
+      and the standard output of the process (a file, or 'asyncio.subprocess.PIPE' to get it in memory)
+    - it outputs the exit status of the process and its standard output (if 'stdout' is 'asyncio.subprocess.PIPE', None otherwise)
+'''
+async def run_tool_async(command, log_file, semaphore, stdout=asyncio.subprocess.PIPE):
+    async with semaphore:
+        with open(log_file, "a") as log:
+            process = await asyncio.create_subprocess_exec(*command, stdout=stdout, stderr=log)
+            output, _ = await process.communicate()
+    return process.returncode, output
+
+
+#----------------------------------------------------
+# extract_barcodes_async function
+#----------------------------------------------------
+'''
+To extract the barcodes of reads mapping on a chunk, with BamExtractor (same as the function 'extract_barcodes' of helpers.py, from the asyncio event loop):
+    - it takes as input the BAM file, the gap label, the chunk region on which to extract the barcodes, the directory of the log file and the semaphores of the tools
+    - it outputs a dictionary containing the occurences of each barcode extracted on the chunk region
+'''
+async def extract_barcodes_async(bam, gap_label, region, log_dir, tool_semaphores):
+    bamextractorLog = os.path.join(log_dir, str(gap_label) + "_bamextractor.log")
+    _, output = await run_tool_async(["BamExtractor", bam, region], bamextractorLog, tool_semaphores["BamExtractor"])
+
+    barcodes_occ = {}
+    for line in output.decode().splitlines(keepends=True):
+        #remove the '-1' at the end of the sequence
+        barcode_seq = line.split('-')[0]
+        barcodes_occ[barcode_seq] = barcodes_occ.get(barcode_seq, 0) + 1
+
+    if os.path.exists(bamextractorLog) and os.path.getsize(bamextractorLog) <= 0:
+        os.remove(bamextractorLog)
+
+    return barcodes_occ
+
+
+#----------------------------------------------------
+# extract_union_async function
+#----------------------------------------------------
+'''
+To extract the union of a gap (stage chain BamExtractor on both chunks -> union of the barcodes -> reads_bx_sqlite3.py):
+    - it takes as input the union job of the gap (dictionary with the gap label, the left and right chunk regions, and the names of the barcodes and reads files of the union, 
+      the reads file being None if the reads of the union are already extracted), the BAM file, the reads file, the barcodes index file, the minimal frequence of the barcodes, 
+      the union directory and the semaphores of the tools
+    - it outputs a dictionary with the name of the reads file of the union and the number of barcodes of the union
+'''
+async def extract_union_async(job, bam, reads, index, freq, union_dir, tool_semaphores):
+    #BamExtractor on the left and right chunks at the same time
+    left_occ, right_occ = await asyncio.gather(extract_barcodes_async(bam, job["gap_label"], job["left_region"], union_dir, tool_semaphores), \
+                                               extract_barcodes_async(bam, job["gap_label"], job["right_region"], union_dir, tool_semaphores))
+    barcodes_occ = left_occ
+    for barcode, occurences in right_occ.items():
+        barcodes_occ[barcode] = barcodes_occ.get(barcode, 0) + occurences
+
+    #Do the union of the barcodes on both left and right regions, filtered by freq
+    union_barcodes_file = os.path.join(union_dir, job["union_barcodes_file"])
+    nb_barcodes = 0
+    with open(union_barcodes_file, "w") as union_barcodes:
+        for (barcode, occurences) in barcodes_occ.items():
+            if occurences >= freq:
+                union_barcodes.write(barcode + "\n")
+                nb_barcodes += 1
+
+    #Union: extract the reads associated with the barcodes
+    if job["union_reads_file"] is not None:
+        command = ["reads_bx_sqlite3.py", "--fastq", reads, "--idx", index, "--bdx", union_barcodes_file, "--mode", "shelve"]
+        getreadsLog = os.path.join(union_dir, str(job["gap_label"]) + ".barcodes.txt")
+        with open(os.path.join(union_dir, job["union_reads_file"]), "w") as union_reads:
+            await run_tool_async(command, getreadsLog, tool_semaphores["reads_bx_sqlite3.py"], stdout=union_reads)
+
+    os.remove(union_barcodes_file)
+
+    return {"union_reads_file": job["union_reads_file"], "nb_barcodes": nb_barcodes}
+
+
+#----------------------------------------------------
+# UnionPrefetcher class
+#----------------------------------------------------
+class UnionPrefetcher:
+    '''
+    Class extracting the unions of the gaps ahead of the gap-filling, with an asyncio event loop running in a thread of the main process:
+    - the coroutine function extracting the union of a gap (called with the union job of the gap and the semaphores of the tools)
+    - the maximal number of gaps whose union is being extracted, or extracted but not yet done by a worker, beyond the gaps being gap-filled by the workers
+    - the number of workers of the pool, and the maximal number of processes of each external tool at the same time
+    '''
+
+    #Constructor
+    def __init__(self, extract, nb_prefetch, tool_limits, nb_workers=1):
+        self.extract = extract
+        self.nb_prefetch = nb_prefetch
+        self.nb_workers = nb_workers
+        self.tool_limits = tool_limits
+        self.results = queue.Queue()
+        self.loop = None
+        self.slots = None
+        self.started = threading.Event()
+
+    #Method "_extract_one"
+    async def _extract_one(self, key, job, tool_semaphores):
+        '''Method to extract the union of a gap (a dictionary with the error if the extraction failed: the failure is reported by the worker, which extracts the union again)'''
+        try:
+            union = await self.extract(job, tool_semaphores)
+        except Exception as e:
+            union = {"error": str(e)}
+        self.results.put((key, union))
+
+    #Method "_extract_all"
+    async def _extract_all(self, items):
+        '''Method to start the extraction of the unions in the order of the list, with at most 'nb_workers + nb_prefetch' gaps extracted and not yet done'''
+        self.loop = asyncio.get_running_loop()
+        self.slots = asyncio.Semaphore(self.nb_workers + self.nb_prefetch)
+        self.started.set()
+        tool_semaphores = {tool: asyncio.Semaphore(limit) for tool, limit in self.tool_limits.items()}
+        tasks = []
+        for key, job in items:
+            await self.slots.acquire()
+            tasks.append(asyncio.ensure_future(self._extract_one(key, job, tool_semaphores)))
+        await asyncio.gather(*tasks)
+
+    #Method "run"
+    def run(self, items):
+        '''Method (generator) to get the unions of the list of (key, union job) items, as soon as they are extracted: it yields (key, union) pairs'''
+        thread = threading.Thread(target=asyncio.run, args=(self._extract_all(items),), daemon=True)
+        thread.start()
+        for _ in range(len(items)):
+            yield self.results.get()
+        thread.join()
+
+    #Method "done"
+    def done(self):
+        '''Method to record that a gap is done by a worker, so that the union of the next gap can be extracted
+        (the pool takes the items of 'run' as soon as they are yielded: the look-ahead is bounded by the gaps done, not by the gaps taken by the pool)'''
+        self.started.wait()
+        try:
+            self.loop.call_soon_threadsafe(self.slots.release)
+        #all the unions are already extracted (the event loop is closed)
+        except RuntimeError:
+            pass
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#*****************************************************************************
+#  Name: MTG-Link
+#  Description: gap-filling tool for draft genome assemblies, dedicated to
+#  linked read data generated by 10XGenomics Chromium technology.
+#  Copyright (C) 2020 INRAE
+#  Author: Anne Guichard
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#*****************************************************************************
+
+import os
+import math
+import time
+import signal
+import resource
+import threading
+import subprocess
+from collections import namedtuple
+
+
+#----------------------------------------------------
+# popen_limited function
+#----------------------------------------------------
+'''
+To start a child process in its own process group, with time limits:
+    - it takes as input the command, the wall-clock time limit (s) after which the whole process group is killed, the CPU time limit (s) enforced by the kernel (RLIMIT_CPU),
+      and the other arguments of 'subprocess.Popen'
+    - it outputs the 'subprocess.Popen' object (to be waited for with the function 'wait_process')
+'''
+def popen_limited(command, timeout=None, cpu_limit=None, **kwargs):
+    preexec_fn = None
+    if cpu_limit is not None:
+        cpu_limit = max(1, int(math.ceil(cpu_limit)))
+        preexec_fn = lambda: resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 5))
+
+    process = subprocess.Popen(command, start_new_session=True, preexec_fn=preexec_fn, **kwargs)
+    process.start_time = time.time()
+    process.cpu_limit = cpu_limit
+    process.killed_on_timeout = threading.Event()
+    process.timer = None
+    if timeout is not None:
+        process.timer = threading.Timer(max(0.0, timeout), kill_process_group, [process])
+        process.timer.daemon = True
+        process.timer.start()
+    return process
+
+#Function to kill the process group of a child process started with 'popen_limited' (when its wall-clock time limit is reached)
+def kill_process_group(process):
+    process.killed_on_timeout.set()
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+#----------------------------------------------------
+# wait_process function
+#----------------------------------------------------
+'''
+To wait for a child process with 'os.wait4', in order to get its resource usage:
+    - it takes as input the 'subprocess.Popen' object
+    - it outputs a 'ProcessResult': the exit status of the process, its peak RSS (in MBytes), its CPU time (user + system, in s), its wall-clock time (s),
+      and whether it was killed because it reached its wall-clock or CPU time limit
+'''
+ProcessResult = namedtuple("ProcessResult", ["returncode", "peak_rss", "cpu_time", "wall_time", "timed_out"])
+
+def wait_process(process):
+    _, status, rusage = os.wait4(process.pid, 0)
+    if getattr(process, "timer", None) is not None:
+        process.timer.cancel()
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    #'ru_maxrss' is in KBytes on Linux
+    peak_rss = rusage.ru_maxrss / 1024.0
+    cpu_time = rusage.ru_utime + rusage.ru_stime
+    wall_time = time.time() - getattr(process, "start_time", time.time())
+
+    #killed by the timer (wall-clock time limit), or by the kernel (CPU time limit: SIGXCPU, then SIGKILL at the hard limit)
+    timed_out = hasattr(process, "killed_on_timeout") and process.killed_on_timeout.is_set()
+    if getattr(process, "cpu_limit", None) is not None and process.returncode in (-signal.SIGXCPU, -signal.SIGKILL) and cpu_time >= process.cpu_limit:
+        timed_out = True
+
+    return ProcessResult(process.returncode, peak_rss, cpu_time, wall_time, timed_out)
+
+
+#----------------------------------------------------
+# run_tool function
+#----------------------------------------------------
+'''
+To run an external tool exactly once:
+    - it takes as input the command, the log file to which its standard output and error are streamed (appended), the working directory, 
+      and optionally the wall-clock and CPU time limits (s) of the process
+    - it outputs the 'ProcessResult' of the process (exit status, peak RSS, CPU and wall-clock times, timeout)
+'''
+def run_tool(command, log_file, cwd=None, timeout=None, cpu_limit=None):
+    with open(log_file, "a") as log:
+        process = popen_limited(command, timeout=timeout, cpu_limit=cpu_limit, stdout=log, stderr=subprocess.STDOUT, cwd=cwd)
+        return wait_process(process)
+
+
+#----------------------------------------------------
+# ResourceUsage class
+#----------------------------------------------------
+class ResourceUsage:
+    '''
+    Class defining the resources used by all the runs of an external tool for a gap:
+    - the number of runs, and the number of runs that failed (non-zero exit status) or reached a time limit
+    - the total wall-clock and CPU times (s), and the maximal peak RSS (MBytes)
+    '''
+
+    #Constructor
+    def __init__(self):
+        self.nb_runs = 0
+        self.nb_failed = 0
+        self.nb_timed_out = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_rss = 0.0
+
+    #Method "add"
+    def add(self, result):
+        '''Method to add the 'ProcessResult' of a run'''
+        self.nb_runs += 1
+        if result.timed_out:
+            self.nb_timed_out += 1
+        elif result.returncode != 0:
+            self.nb_failed += 1
+        self.wall_time += result.wall_time
+        self.cpu_time += result.cpu_time
+        self.peak_rss = max(self.peak_rss, result.peak_rss)
+
+    #Method "summary"
+    def summary(self):
+        '''Method to get the number of runs, the total wall-clock and CPU times (s) and the maximal peak RSS (MBytes), as strings for the output files'''
+        return [str(self.nb_runs), "{:.1f}".format(self.wall_time), "{:.1f}".format(self.cpu_time), "{:.1f}".format(self.peak_rss)]
+
+    def __str__(self):
+        return "{} run(s) ({} failed, {} timed out), wall-clock time {:.1f} s, CPU time {:.1f} s, peak RSS {:.1f} MB".format(self.nb_runs, self.nb_failed, self.nb_timed_out, self.wall_time, self.cpu_time, self.peak_rss)
@@ -0,0 +1,765 @@
+#!/usr/bin/env python3
+#*****************************************************************************
+#  Name: MTG-Link
+#  Description: gap-filling tool for draft genome assemblies, dedicated to
+#  linked read data generated by 10XGenomics Chromium technology.
+#  Copyright (C) 2020 INRAE
+#  Author: Anne Guichard
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#*****************************************************************************
+
+import os
+import csv
+import time
+import math
+import heapq
+import hashlib
+import multiprocessing
+from contextlib import contextmanager
+
+
+#----------------------------------------------------
+# read_union_sizes function
+#----------------------------------------------------
+'''
+To get the union sizes (number of reads) of the gaps from a previous run:
+    - it takes as input the '.union.sum' file of a previous run (if any)
+    - it outputs a dictionary with the gap's name ('left_right') as key and the number of reads of the union as value
+'''
+def read_union_sizes(union_sum_file):
+    union_sizes = {}
+    if not os.path.exists(union_sum_file):
+        return union_sizes
+
+    with open(union_sum_file, "r") as union_sum:
+        reader = csv.DictReader(union_sum, delimiter='\t')
+        for row in reader:
+            try:
+                union_sizes[str(row["Left_scaffold"]) +"_"+ str(row["Right_scaffold"])] = float(row["Nb_reads"])
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    return union_sizes
+
+
+#----------------------------------------------------
+# expected_gap_cost function
+#----------------------------------------------------
+'''
+To estimate the relative cost of a gap:
+    - it takes as input the gap length (bp) and the number of reads of its union (or None if unknown)
+    - it outputs a cost: the size of the union drives the graph building, and the gap length drives the length of the search (MindTheGap '-max-length')
+'''
+def expected_gap_cost(gap_length, union_reads):
+    if union_reads is None:
+        union_reads = 1
+    return max(float(union_reads), 1.0) * (1.0 + max(int(gap_length), 0) / 1000.0)
+
+
+#----------------------------------------------------
+# order_gaps_by_cost function
+#----------------------------------------------------
+'''
+To order the gaps longest-expected-first:
+    - it takes as input the list of gaps (objects with 'sid1', 'sid2' and 'disp' attributes) and the dictionary of union sizes obtained with 'read_union_sizes'
+    - when the union size of a gap is unknown, the median union size of the other gaps is used (or 1 if no union size is known)
+    - it outputs the list of gaps sorted by decreasing expected cost (the input order is kept for gaps with the same cost)
+'''
+def order_gaps_by_cost(gaps, union_sizes):
+    known_sizes = sorted(union_sizes.values())
+    default_size = known_sizes[len(known_sizes) // 2] if known_sizes else 1
+
+    costs = []
+    for gap in gaps:
+        union_reads = union_sizes.get(str(gap.sid1) +"_"+ str(gap.sid2), default_size)
+        costs.append(expected_gap_cost(gap.disp, union_reads))
+
+    order = sorted(range(len(gaps)), key=lambda i: -costs[i])
+    return [gaps[i] for i in order]
+
+
+#----------------------------------------------------
+# shard_gaps function
+#----------------------------------------------------
+'''
+To partition the gaps of a GFA file into shards (one shard per node), balanced by gap length:
+    - it takes as input the list of all the gaps of the GFA file (objects with 'sid1', 'sid2' and 'disp' attributes) and the number of shards
+    - the gaps are given longest-first to the shard with the smallest total gap length so far (lowest shard index in case of tie), 
+      so the partition only depends on the input GFA file and the number of shards
+    - it outputs the list of the shards, each shard being the list of its gaps in the order of the input GFA file
+'''
+def shard_gaps(gaps, nb_shards):
+    loads = [0] * nb_shards
+    shard_of_gap = [0] * len(gaps)
+    for i in sorted(range(len(gaps)), key=lambda i: (-max(int(gaps[i].disp), 0), i)):
+        shard = min(range(nb_shards), key=lambda n: (loads[n], n))
+        shard_of_gap[i] = shard
+        loads[shard] += max(int(gaps[i].disp), 0)
+
+    return [[gap for gap, shard in zip(gaps, shard_of_gap) if shard == n] for n in range(nb_shards)]
+
+
+#----------------------------------------------------
+# group_gaps_by_barcodes function
+#----------------------------------------------------
+'''
+To group the gaps whose unions of barcodes overlap strongly, to gap-fill them with a single MindTheGap run per (k, a) combination:
+    - it takes as input the list of the gaps' names (in dispatch order), a dictionary with the gap's name as key and the set of the barcodes of its union as value,
+      the minimal Jaccard similarity between the barcodes of a gap and the barcodes of a group to add the gap to the group, and the maximal number of gaps per group
+    - it outputs the list of the groups (lists of gaps' names, in dispatch order of their first gap), each gap being added to the most similar group not full yet (or to a new group)
+'''
+def group_gaps_by_barcodes(gap_names, barcodes, min_jaccard, max_size):
+    groups = []
+    group_barcodes = []
+    for gap_name in gap_names:
+        best_group, best_jaccard = None, min_jaccard
+        for i, group in enumerate(groups):
+            if len(group) >= max_size:
+                continue
+            union_size = len(barcodes[gap_name] | group_barcodes[i])
+            jaccard = float(len(barcodes[gap_name] & group_barcodes[i])) / union_size if union_size > 0 else 0.0
+            if jaccard >= best_jaccard:
+                best_group, best_jaccard = i, jaccard
+        if best_group is None:
+            groups.append([gap_name])
+            group_barcodes.append(set(barcodes[gap_name]))
+        else:
+            groups[best_group].append(gap_name)
+            group_barcodes[best_group] |= barcodes[gap_name]
+    return groups
+
+
+#----------------------------------------------------
+# minhash_sketch function
+#----------------------------------------------------
+#Number of hash values kept in the MinHash sketch of a set of barcodes
+MINHASH_SIZE = 128
+
+'''
+To get the MinHash sketch of a set of barcodes (bottom-k sketch):
+    - it takes as input the set of barcodes and the number of hash values to keep
+    - the barcodes are hashed with a deterministic hash function (same sketch in any process), and only the smallest hash values are kept
+    - it outputs the sorted list of the smallest hash values of the barcodes
+'''
+def minhash_sketch(barcodes, size=MINHASH_SIZE):
+    hashes = (int.from_bytes(hashlib.blake2b(barcode.encode(), digest_size=8).digest(), "big") for barcode in barcodes)
+    return heapq.nsmallest(size, set(hashes))
+
+
+#----------------------------------------------------
+# sketch_jaccard function
+#----------------------------------------------------
+'''
+To estimate the Jaccard similarity between two sets of barcodes from their MinHash sketches:
+    - it takes as input the two sketches (obtained with 'minhash_sketch') and the number of hash values kept in the sketches
+    - it outputs the fraction of the smallest hash values of the union of the two sketches found in both sketches (0 if both sets are empty)
+'''
+def sketch_jaccard(sketch1, sketch2, size=MINHASH_SIZE):
+    union = heapq.nsmallest(size, set(sketch1) | set(sketch2))
+    if len(union) == 0:
+        return 0.0
+    shared = set(sketch1) & set(sketch2)
+    return float(sum(1 for value in union if value in shared)) / len(union)
+
+
+#----------------------------------------------------
+# order_by_similarity function
+#----------------------------------------------------
+'''
+To order the gaps so that the gaps whose unions share barcodes are dispatched one after the other (and the reads and index pages they share stay in the caches):
+    - it takes as input the list of the MinHash sketches of the unions of the gaps (in dispatch order)
+    - starting from the first gap, the next gap is the most similar to the previous one among the gaps not ordered yet (the first one in dispatch order in case of tie)
+    - it outputs the list of the indices of the gaps in the new order, and the mean estimated Jaccard similarity between consecutive gaps before and after reordering
+'''
+def order_by_similarity(sketches):
+    if len(sketches) == 0:
+        return [], 0.0, 0.0
+    order = [0]
+    remaining = list(range(1, len(sketches)))
+    total_similarity = 0.0
+    while remaining:
+        previous = sketches[order[-1]]
+        best, best_similarity = remaining[0], -1.0
+        for i in remaining:
+            similarity = sketch_jaccard(previous, sketches[i])
+            if similarity > best_similarity:
+                best, best_similarity = i, similarity
+        order.append(best)
+        remaining.remove(best)
+        total_similarity += best_similarity
+
+    nb_pairs = len(sketches) - 1
+    if nb_pairs == 0:
+        return order, 0.0, 0.0
+    before = sum(sketch_jaccard(sketches[i], sketches[i+1]) for i in range(nb_pairs)) / nb_pairs
+    return order, before, total_similarity / nb_pairs
+
+
+#----------------------------------------------------
+# BarcodeReuse class
+#----------------------------------------------------
+class BarcodeReuse:
+    '''
+    Class measuring how much the gaps processed one after the other reuse the barcodes (and thus the reads and index pages) of the previous gaps, as an estimate of the cache hit rate of the run:
+    - the barcodes of the last gap processed by each worker (PID), and of the last gap processed by the node
+    - the number of barcodes of all the gaps, and the number of these barcodes already in the union of the previous gap of the same worker, or of the node
+    '''
+
+    #Constructor
+    def __init__(self):
+        self.last_worker = {}
+        self.last_node = set()
+        self.nb_barcodes = 0
+        self.worker_hits = 0
+        self.node_hits = 0
+
+    #Method "add"
+    def add(self, pid, barcodes):
+        '''Method to record the barcodes of the union of a gap processed by a worker (PID)'''
+        self.nb_barcodes += len(barcodes)
+        self.worker_hits += len(barcodes & self.last_worker.get(pid, set()))
+        self.node_hits += len(barcodes & self.last_node)
+        self.last_worker[pid] = barcodes
+        self.last_node = barcodes
+
+    #Method "report"
+    def report(self, out):
+        '''Method to write the estimated cache hit rates (percentage of the barcodes of the unions already in the union of the previous gap, of the same worker or of the node) to the file object 'out' '''
+        if self.nb_barcodes == 0:
+            return
+        out.write("Estimated cache hit rate (barcodes of the union already in the union of the previous gap): {:.1f}% per worker, {:.1f}% on the node\n".format(100.0 * self.worker_hits / self.nb_barcodes, 100.0 * self.node_hits / self.nb_barcodes))
+
+
+#----------------------------------------------------
+# timed_call function
+#----------------------------------------------------
+'''
+To run a function on one item in a worker, and time it:
+    - it takes as input the function and the item
+    - it outputs the PID of the worker, the start and end times (epoch, in seconds) and the result of the function
+'''
+def timed_call(function, item):
+    start = time.time()
+    result = function(item)
+    end = time.time()
+    return os.getpid(), start, end, result
+
+
+#----------------------------------------------------
+# RunTelemetry class
+#----------------------------------------------------
+class RunTelemetry:
+    '''
+    Class collecting the timing of the tasks of a run:
+    - the start time of the run
+    - the busy time of each worker
+    '''
+
+    #Constructor
+    def __init__(self, nb_workers):
+        self.nb_workers = nb_workers
+        self.start = time.time()
+        self.end = self.start
+        self.busy = {}
+        self.nb_tasks = {}
+
+    #Method "add"
+    def add(self, pid, start, end):
+        '''Method to record a task done by a worker (PID), between its start and end times'''
+        self.busy[pid] = self.busy.get(pid, 0.0) + (end - start)
+        self.nb_tasks[pid] = self.nb_tasks.get(pid, 0) + 1
+        self.end = max(self.end, end, time.time())
+
+    #Method "makespan"
+    def makespan(self):
+        '''Method to get the wall-clock time of the run (s)'''
+        return self.end - self.start
+
+    #Method "report"
+    def report(self, out):
+        '''Method to write the makespan and the utilisation of each worker to the file object 'out' '''
+        makespan = self.makespan()
+        out.write("Makespan of the run: {:.1f} s ({} workers)\n".format(makespan, self.nb_workers))
+        for pid in sorted(self.busy):
+            utilisation = 100.0 * self.busy[pid] / makespan if makespan > 0 else 0.0
+            out.write("\tWorker {}: {} gap(s), busy {:.1f} s ({:.1f}%)\n".format(pid, self.nb_tasks[pid], self.busy[pid], utilisation))
+        idle_workers = self.nb_workers - len(self.busy)
+        if idle_workers > 0:
+            out.write("\t{} worker(s) never received a gap\n".format(idle_workers))
+        total_busy = sum(self.busy.values())
+        if makespan > 0 and self.nb_workers > 0:
+            out.write("\tMean utilisation: {:.1f}%\n".format(100.0 * total_busy / (makespan * self.nb_workers)))
+
+
+#----------------------------------------------------
+# CoreBudget class
+#----------------------------------------------------
+class CoreBudget:
+    '''
+    Class defining a global budget of cores (tokens), shared between the worker processes (inherited through fork):
+    - the number of threads of the budget (None if no budget)
+    - the semaphore of tokens, and the lock making the acquisition of several tokens atomic (no deadlock between two processes holding part of their tokens)
+    '''
+
+    #Constructor
+    def __init__(self, nb_threads=None):
+        self.nb_threads = nb_threads
+        if nb_threads is not None:
+            self._tokens = multiprocessing.BoundedSemaphore(nb_threads)
+            self._lock = multiprocessing.Lock()
+
+    #Method "acquire"
+    def acquire(self, n):
+        '''Method to take 'n' tokens (at most the size of the budget), blocking until they are all available'''
+        if self.nb_threads is None:
+            return n
+        n = max(0, min(n, self.nb_threads))
+        with self._lock:
+            for _ in range(n):
+                self._tokens.acquire()
+        return n
+
+    #Method "try_acquire"
+    def try_acquire(self, n):
+        '''Method to take 'n' tokens only if they are all available right now (returns None otherwise)'''
+        if self.nb_threads is None:
+            return n
+        n = max(0, min(n, self.nb_threads))
+        if not self._lock.acquire(block=False):
+            return None
+        try:
+            taken = 0
+            while taken < n and self._tokens.acquire(block=False):
+                taken += 1
+            if taken < n:
+                self.release(taken)
+                return None
+            return n
+        finally:
+            self._lock.release()
+
+    #Method "release"
+    def release(self, n):
+        '''Method to give back 'n' tokens'''
+        if self.nb_threads is None:
+            return
+        for _ in range(n):
+            self._tokens.release()
+
+    #Method "cores"
+    @contextmanager
+    def cores(self, n, held=0):
+        '''Method to run a block with 'n' tokens, the 'held' tokens already taken by the caller being given back during the block'''
+        if self.nb_threads is None or n == held:
+            yield n
+            return
+        self.release(held)
+        n = self.acquire(n)
+        try:
+            yield n
+        finally:
+            self.release(n)
+            self.acquire(held)
+
+
+#Budget of cores of the run (set in the main process before the creation of the pool of workers)
+core_budget = CoreBudget()
+
+#Function to set the budget of cores of the run
+def set_core_budget(budget):
+    global core_budget
+    core_budget = budget
+
+#Function to get the budget of cores of the run
+def get_core_budget():
+    return core_budget
+
+
+#----------------------------------------------------
+# mtg_cores_for_union function
+#----------------------------------------------------
+'''
+To get the number of cores to give to MindTheGap for a gap:
+    - it takes as input the number of reads of the union and the maximum number of cores for a MindTheGap run
+    - it outputs one core per 'READS_PER_MTG_CORE' reads of the union (at least 1, at most 'max_cores')
+'''
+READS_PER_MTG_CORE = 200000
+
+def mtg_cores_for_union(union_reads, max_cores):
+    return max(1, min(int(max_cores), int(math.ceil(float(union_reads) / READS_PER_MTG_CORE))))
+
+
+#----------------------------------------------------
+# prescreen_union function
+#----------------------------------------------------
+'''
+To pre-screen a gap before launching MindTheGap, from the size of its union:
+    - it takes as input the number of barcodes, reads and bases of the union, the length of the region covered by the union (bp), and the minimal number of barcodes, minimal number of reads and minimal estimated coverage of the union
+    - it outputs the reason(s) why the gap can't be gap-filled (e.g. 'reads:12<50', the estimated coverage being the number of bases of the union per bp of the region), or None if the union passes the pre-screen
+'''
+def prescreen_union(nb_barcodes, nb_reads, nb_bases, region_length, min_barcodes=0, min_reads=0, min_coverage=0.0):
+    reasons = []
+    if nb_barcodes < min_barcodes:
+        reasons.append("barcodes:{}<{}".format(int(nb_barcodes), min_barcodes))
+    if nb_reads < min_reads:
+        reasons.append("reads:{}<{}".format(int(nb_reads), min_reads))
+    coverage = float(nb_bases) / max(int(region_length), 1)
+    if coverage < min_coverage:
+        reasons.append("coverage:{:.1f}<{}".format(coverage, min_coverage))
+    if reasons == []:
+        return None
+    return ",".join(reasons)
+
+
+#----------------------------------------------------
+# MemoryBudget class
+#----------------------------------------------------
+class MemoryBudget:
+    '''
+    Class defining a node-wide memory budget (in MBytes), shared between the worker processes (inherited through fork):
+    - the total memory of the budget (None if no budget)
+    - the memory currently reserved by the running MindTheGap processes
+    '''
+
+    #Constructor
+    def __init__(self, total_mb=None):
+        self.total_mb = total_mb
+        if total_mb is not None:
+            self._used = multiprocessing.Value('d', 0.0, lock=False)
+            self._cond = multiprocessing.Condition()
+
+    #Method "acquire"
+    def acquire(self, mb, blocking=True):
+        '''Method to reserve 'mb' MBytes once they fit in the budget (an estimate larger than the budget is admitted alone); returns None if not blocking and they don't fit'''
+        if self.total_mb is None:
+            return mb
+        mb = max(0.0, min(float(mb), float(self.total_mb)))
+        with self._cond:
+            while self._used.value + mb > self.total_mb:
+                if not blocking:
+                    return None
+                self._cond.wait()
+            self._used.value += mb
+        return mb
+
+    #Method "release"
+    def release(self, mb):
+        '''Method to give back 'mb' MBytes'''
+        if self.total_mb is None:
+            return
+        with self._cond:
+            self._used.value -= mb
+            self._cond.notify_all()
+
+    #Method "reserve"
+    @contextmanager
+    def reserve(self, mb):
+        '''Method to run a block once 'mb' MBytes fit in the budget'''
+        mb = self.acquire(mb)
+        try:
+            yield mb
+        finally:
+            self.release(mb)
+
+
+#Memory budget of the run (set in the main process before the creation of the pool of workers)
+memory_budget = MemoryBudget()
+
+#Function to set the memory budget of the run
+def set_memory_budget(budget):
+    global memory_budget
+    memory_budget = budget
+
+#Function to get the memory budget of the run
+def get_memory_budget():
+    return memory_budget
+
+
+#----------------------------------------------------
+# mtg_resources function
+#----------------------------------------------------
+'''
+To run a block (a MindTheGap run) with 'nb_cores' tokens of the budget of threads and 'memory_mb' MBytes of the memory budget:
+    - the token held by the gap is given back while waiting for the memory, so that no process waits for memory while holding threads (no deadlock between both budgets)
+'''
+@contextmanager
+def mtg_resources(nb_cores, memory_mb):
+    resources = acquire_mtg_resources(nb_cores, memory_mb)
+    try:
+        yield
+    finally:
+        release_mtg_resources(resources)
+
+'''
+To take the resources of a MindTheGap run, and give them back (same rules as 'mtg_resources'):
+    - if 'blocking' is False, the resources are taken only if they are available right now (the token held by the gap is kept), otherwise None is returned
+    - it outputs the resources taken (number of tokens, MBytes, and number of tokens of the gap given back during the run)
+'''
+def acquire_mtg_resources(nb_cores, memory_mb, blocking=True):
+    if not blocking:
+        memory_mb = get_memory_budget().acquire(memory_mb, blocking=False)
+        if memory_mb is None:
+            return None
+        nb_cores = get_core_budget().try_acquire(nb_cores)
+        if nb_cores is None:
+            get_memory_budget().release(memory_mb)
+            return None
+        return (nb_cores, memory_mb, 0)
+
+    get_core_budget().release(1)
+    memory_mb = get_memory_budget().acquire(memory_mb)
+    nb_cores = get_core_budget().acquire(nb_cores)
+    return (nb_cores, memory_mb, 1)
+
+def release_mtg_resources(resources):
+    nb_cores, memory_mb, held = resources
+    get_core_budget().release(nb_cores)
+    get_memory_budget().release(memory_mb)
+    get_core_budget().acquire(held)
+
+
+#----------------------------------------------------
+# Memory model of MindTheGap (graph building)
+#----------------------------------------------------
+'''
+The memory used to build the de Bruijn graph is estimated from the number of bases of the union and the k-mer size:
+    memory (MB) = MEMORY_MODEL_BASE_MB + bytes_per_base * nb_bases * kmer_bytes(k) / 1e6
+The 'bytes_per_base' coefficient is calibrated on the peak RSS recorded in the telemetry file of the previous runs ('.mtg.telemetry.tsv').
+'''
+MEMORY_MODEL_BASE_MB = 100.0
+MEMORY_MODEL_BYTES_PER_BASE = 1.5
+MTG_TELEMETRY_LEGEND = ["Gap", "k", "a", "Nb_bases", "Estimated_memory_MB", "Peak_RSS_MB", "Wall_time_s"]
+
+#Function to get the number of bytes used to encode a k-mer (2 bits per nucleotide, in 64-bit words)
+def kmer_bytes(k):
+    return 8 * ((2 * int(k) + 63) // 64)
+
+#Function to estimate the memory (MB) used by MindTheGap to build the graph of a union
+def estimate_graph_memory(nb_bases, k, bytes_per_base=MEMORY_MODEL_BYTES_PER_BASE, max_memory=0):
+    estimate = MEMORY_MODEL_BASE_MB + bytes_per_base * float(nb_bases) * kmer_bytes(k) / 1e6
+    if max_memory > 0:
+        estimate = min(estimate, float(max_memory))
+    return estimate
+
+#Function to calibrate the 'bytes_per_base' coefficient on the peak RSS of the previous runs (conservative: the largest observed coefficient)
+def fit_memory_model(telemetry_file):
+    coefficients = []
+    if os.path.exists(telemetry_file):
+        with open(telemetry_file, "r") as telemetry:
+            for row in csv.DictReader(telemetry, delimiter='\t'):
+                try:
+                    nb_bases = float(row["Nb_bases"])
+                    peak_rss = float(row["Peak_RSS_MB"])
+                    k = int(row["k"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if nb_bases > 0 and peak_rss > MEMORY_MODEL_BASE_MB:
+                    coefficients.append((peak_rss - MEMORY_MODEL_BASE_MB) * 1e6 / (nb_bases * kmer_bytes(k)))
+    if coefficients == []:
+        return MEMORY_MODEL_BYTES_PER_BASE
+    return max(coefficients)
+
+#Function to create the telemetry file of the MindTheGap runs (if it doesn't exist)
+def init_mtg_telemetry(telemetry_file):
+    if not os.path.exists(telemetry_file):
+        with open(telemetry_file, "w") as telemetry:
+            telemetry.write('\t'.join(MTG_TELEMETRY_LEGEND) + '\n')
+
+#Function to append the telemetry of a MindTheGap run (one line, written at once)
+def record_mtg_telemetry(telemetry_file, row):
+    with open(telemetry_file, "a") as telemetry:
+        telemetry.write('\t'.join(str(i) for i in row) + '\n')
+
+
+#----------------------------------------------------
+# Runtime model of MindTheGap
+#----------------------------------------------------
+'''
+The wall-clock time of a MindTheGap run is estimated from the number of bases of the union:
+    wall-clock time (s) = intercept + seconds_per_base * nb_bases
+The coefficients are fitted by least squares on the wall-clock times recorded in the telemetry file of the previous runs ('.mtg.telemetry.tsv').
+'''
+RUNTIME_MODEL_BASE_S = 10.0
+RUNTIME_MODEL_SECONDS_PER_BASE = 2e-6
+
+#Function to fit the runtime model on the previous runs (default coefficients if less than two different union sizes were recorded)
+def fit_runtime_model(telemetry_file):
+    points = []
+    if os.path.exists(telemetry_file):
+        with open(telemetry_file, "r") as telemetry:
+            for row in csv.DictReader(telemetry, delimiter='\t'):
+                try:
+                    points.append((float(row["Nb_bases"]), float(row["Wall_time_s"])))
+                except (KeyError, TypeError, ValueError):
+                    continue
+    if len(set(nb_bases for nb_bases, _ in points)) < 2:
+        return RUNTIME_MODEL_BASE_S, RUNTIME_MODEL_SECONDS_PER_BASE, len(points)
+    mean_bases = sum(nb_bases for nb_bases, _ in points) / len(points)
+    mean_time = sum(wall_time for _, wall_time in points) / len(points)
+    variance = sum((nb_bases - mean_bases) ** 2 for nb_bases, _ in points)
+    covariance = sum((nb_bases - mean_bases) * (wall_time - mean_time) for nb_bases, wall_time in points)
+    seconds_per_base = max(covariance / variance, 0.0)
+    intercept = max(mean_time - seconds_per_base * mean_bases, 0.0)
+    return intercept, seconds_per_base, len(points)
+
+#Function to estimate the wall-clock time (s) of a MindTheGap run on a union
+def estimate_mtg_runtime(nb_bases, runtime_model):
+    intercept, seconds_per_base = runtime_model[0], runtime_model[1]
+    return intercept + seconds_per_base * float(nb_bases)
+
+
+#----------------------------------------------------
+# plan_schedule function
+#----------------------------------------------------
+'''
+To simulate the schedule of a run on a node:
+    - it takes as input the list of the gaps in dispatch order (dictionaries with the number of cores ('Cores'), the estimated wall-clock time ('Runtime_s') and the estimated peak memory ('Peak_memory_MB') of each gap),
+      the number of cores of the node and its memory budget (MBytes, or None if no budget)
+    - it outputs the makespan (s) and the peak memory (MBytes) of the run, and adds the start and end times of each gap to its dictionary ('Start_s' and 'End_s')
+Each gap is started, in dispatch order, as soon as its cores and its memory are available (a gap needing more than the node is run alone).
+'''
+def plan_schedule(gaps, nb_cores, memory_mb=None):
+    running = []
+    now = 0.0
+    free_cores = nb_cores
+    used_memory = 0.0
+    peak_memory = 0.0
+    makespan = 0.0
+    for gap in gaps:
+        cores = min(gap["Cores"], nb_cores)
+        memory = gap["Peak_memory_MB"] if memory_mb is None else min(gap["Peak_memory_MB"], float(memory_mb))
+        #Wait for the end of the running gaps until the cores and the memory of the gap are available
+        while running != [] and (free_cores < cores or (memory_mb is not None and used_memory + memory > memory_mb)):
+            end, cores_, memory_ = heapq.heappop(running)
+            now = max(now, end)
+            free_cores += cores_
+            used_memory -= memory_
+        gap["Start_s"] = now
+        gap["End_s"] = now + gap["Runtime_s"]
+        heapq.heappush(running, (gap["End_s"], cores, memory))
+        free_cores -= cores
+        used_memory += memory
+        peak_memory = max(peak_memory, used_memory)
+        makespan = max(makespan, gap["End_s"])
+    return makespan, peak_memory
+
+
+#----------------------------------------------------
+# SpeculativeSweep class
+#----------------------------------------------------
+class SpeculativeSweep:
+    '''
+    Class running the (k, a) combinations of a gap in their priority order, with up to 'window' combinations running at the same time:
+    - the combinations, sorted by decreasing priority (the order of the sequential sweep)
+    - the function starting a combination ('start(combination, blocking)'), returning a run object (with the methods 'wait()' and 'cancel()'), or None if not blocking and the resources are not available
+    - the runs started and not consumed yet
+    The combinations are started strictly in their priority order, and consumed in this order: the result of the sweep is the one of the sequential sweep.
+    '''
+
+    #Constructor
+    def __init__(self, combinations, start, window=1):
+        self.combinations = list(combinations)
+        self.start = start
+        self.window = max(1, int(window))
+        self.next_index = 0
+        self.runs = {}
+        self.nb_cancelled = 0
+
+    #Method "run"
+    def run(self, combination):
+        '''Method to get the result of a combination: start it if needed, start the next ones while resources are idle, and wait for it'''
+        index = self.combinations.index(combination)
+        #the combinations before this one are skipped by the sequential sweep
+        self.cancel(lambda c: self.combinations.index(c) < index)
+        self.next_index = max(self.next_index, index)
+        while self.next_index <= index:
+            self.runs[self.combinations[self.next_index]] = self.start(self.combinations[self.next_index], True)
+            self.next_index += 1
+        while self.next_index < min(index + self.window, len(self.combinations)):
+            run = self.start(self.combinations[self.next_index], False)
+            if run is None:
+                break
+            self.runs[self.combinations[self.next_index]] = run
+            self.next_index += 1
+        return self.runs.pop(combination).wait()
+
+    #Method "cancel"
+    def cancel(self, predicate=None):
+        '''Method to kill the started runs (all of them, or the ones whose combination matches 'predicate') and remove their outputs'''
+        for combination in list(self.runs):
+            if predicate is None or predicate(combination):
+                self.runs.pop(combination).cancel()
+                self.nb_cancelled += 1
+
+
+#----------------------------------------------------
+# GapTimeBudget class
+#----------------------------------------------------
+class GapTimeBudget:
+    '''
+    Class defining the time budgets of the MindTheGap runs of a gap:
+    - the wall-clock and CPU time limits (s) of each MindTheGap run (None if no limit)
+    - the wall-clock and CPU time limits (s) of all the MindTheGap runs of the gap (None if no limit); the wall-clock time is counted from the start of the first run
+    - the CPU time used so far by the MindTheGap runs of the gap
+    '''
+
+    #Constructor
+    def __init__(self, mtg_timeout=None, mtg_cpu_limit=None, gap_timeout=None, gap_cpu_limit=None):
+        self.mtg_timeout = mtg_timeout
+        self.mtg_cpu_limit = mtg_cpu_limit
+        self.gap_timeout = gap_timeout
+        self.gap_cpu_limit = gap_cpu_limit
+        self.start = None
+        self.cpu_used = 0.0
+
+    #Method "limits"
+    def limits(self):
+        '''Method to get the wall-clock and CPU time limits of the next MindTheGap run (the per-run limits, reduced to what is left of the per-gap budgets)'''
+        if self.start is None:
+            self.start = time.time()
+        timeout = self.mtg_timeout
+        if self.gap_timeout is not None:
+            left = self.gap_timeout - (time.time() - self.start)
+            timeout = left if timeout is None else min(timeout, left)
+        cpu_limit = self.mtg_cpu_limit
+        if self.gap_cpu_limit is not None:
+            left = self.gap_cpu_limit - self.cpu_used
+            cpu_limit = left if cpu_limit is None else min(cpu_limit, left)
+        return timeout, cpu_limit
+
+    #Method "exhausted"
+    def exhausted(self):
+        '''Method to know if the per-gap budgets are used up (returns the name of the budget used up, or None)'''
+        timeout, cpu_limit = self.limits()
+        if self.gap_timeout is not None and timeout <= 0:
+            return "gap_wall"
+        if self.gap_cpu_limit is not None and cpu_limit <= 0:
+            return "gap_cpu"
+        return None
+
+    #Method "add"
+    def add(self, result, charge=True):
+        '''Method to record the 'ProcessResult' of a MindTheGap run, its CPU time being charged to the gap only if 'charge' (a run shared by a group of gaps is charged once); returns the name of the limit reached by the run, or None'''
+        if charge:
+            self.cpu_used += result.cpu_time
+        if not result.timed_out:
+            return None
+        if self.gap_cpu_limit is not None and self.cpu_used >= self.gap_cpu_limit:
+            return "gap_cpu"
+        if self.mtg_cpu_limit is not None and result.cpu_time >= self.mtg_cpu_limit:
+            return "cpu"
+        if self.gap_timeout is not None and (time.time() - self.start) >= self.gap_timeout:
+            return "gap_wall"
+        return "wall"
@@ -20,17 +20,17 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #*****************************************************************************
 
+
 from __future__ import print_function
 import os
 import sys
 import re
-import csv
+import shutil
 import argparse
+import tempfile
 import subprocess
-import gfapy
-from gfapy.sequence import rc
+from collections import namedtuple
 from Bio import SeqIO, Align
-from Bio.Seq import Seq
 
 
 #PairwiseAligner object
@@ -45,582 +45,685 @@ aligner.target_end_extend_gap_score = -0.5
 
 
 #----------------------------------------------------
-# Arg parser
+# Coords of the alignments
 #----------------------------------------------------
-parser = argparse.ArgumentParser(prog="stats_alignment.py", usage="%(prog)s -qry <query_sequences_file> -ref <reference_sequence> -ext <extension_size> -p <output_file_prefix> [options]", \
-                                formatter_class=argparse.RawTextHelpFormatter, \
-                                description=(''' \
-                                Statistics about the inserted sequence obtained from MindTheGap (-qry)
-                                Note: there are kmer flanking regions on the edges of the inserted sequence (which are included in '-ext' bp flanking regions)
-                                '''))
+#Typed rows of the coords of the alignments, with the fields of the rows of the coords file obtained with 'show-coords -rcdlT'
+#(the identity and coverages are kept as text, as they are only copied to the stats files)
+Coords = namedtuple("Coords", ["s1", "e1", "s2", "e2", "len_1", "len_2", "identity", "len_r", "len_q", "cov_r", "cov_q", "frm_r", "frm_q", "tag_1", "tag_2"])
+coords_text_fields = set(["identity", "cov_r", "cov_q", "tag_1", "tag_2"])
+
+#Function to parse a line of the coords file obtained with 'show-coords -rcdlT' (None for the header lines)
+def parse_coords(line):
+    values = line.rstrip("\n").split('\t')
+    if len(values) != len(Coords._fields) or not values[0].isdigit():
+        return None
+    return Coords(*[value if field in coords_text_fields else int(value) for field, value in zip(Coords._fields, values)])
+
+#Function to sort coords numerically on their start position on the reference, ties broken by the whole row (as 'sort -n' on the coords file)
+def sort_coords(coords):
+    return sorted(coords, key=lambda row: (row.s1, '\t'.join(str(value) for value in row)))
 
-parser.add_argument("-qry", "--query", action="store", help="file containing the inserted sequences obtained from MindTheGap (format: 'xxx.insertions.fasta')", required=True)
-parser.add_argument("-ref", "--reference", action="store", help="file containing the reference sequence of the gap (format: 'xxx.fasta')", required=True)
-parser.add_argument("-ext", "--ext", action="store", type=int, help="size of the gap, on both sides; determine start/end of gapfilling", required=True)
-parser.add_argument("-p", "--prefix", action="store", help="prefix of output file to save the statistical results", required=True)
-parser.add_argument("-out", "--outDir", action="store", default="./mtglink_results/alignments_stats", help="output directory for saving results")
 
-args = parser.parse_args()
+#----------------------------------------------------
+# In-process alignment of the flanking contigs' regions
+#----------------------------------------------------
+#Maximal lengths of a reference sequence (flanking contig's region) and of a query sequence (inserted sequence) to align them in-process with the PairwiseAligner
+#(the cost of an alignment being proportional to the product of both lengths), NUCmer being used for longer sequences
+NATIVE_MAX_REF_LENGTH = 2000
+NATIVE_MAX_QRY_LENGTH = 10000
+#Minimal length of an exact match and of an alignment to report it, as NUCmer reports only the alignments extended from clusters of exact matches (default values of its '-l' and '-c' options)
+NATIVE_MIN_MATCH = 20
+NATIVE_MIN_CLUSTER = 65
+
+#Function to reverse complement a DNA sequence
+def reverse_complement(sequence):
+    return sequence[::-1].translate(str.maketrans("ACGTNacgtn", "TGCANtgcan"))
+
+'''
+To align the flanking contigs' regions against the query sequences in-process, with the PairwiseAligner (the whole region of the contig is aligned, the ends of the query sequence being free):
+    - it takes as input the query records (inserted sequences) and the reference records (flanking contigs' regions)
+    - for each pair of reference and query, the region is aligned once on each strand of the query (the best-scoring strand first), and the alignment of a strand is kept
+      if it contains an exact match of at least 'NATIVE_MIN_MATCH' bp and aligns at least 'NATIVE_MIN_CLUSTER' bp of the region
+    - it outputs the list of coords of the alignments, as obtained with NUCmer and 'show-coords -rcdlT' (region on its forward strand, coords on the reverse strand of the query as '-1' frame)
+'''
+def native_flank_coords(qry_records, ref_records):
+    coords = []
+    for ref_record in ref_records:
+        region = str(ref_record.seq).upper()
+        len_r = len(region)
+        if len_r == 0:
+            continue
+        for qry_record in qry_records:
+            qry_seq = str(qry_record.seq).upper()
+            len_q = len(qry_seq)
+            if len_q == 0:
+                continue
+
+            #Alignment of the region on both strands of the query (the forward strand of the region being aligned against the query, or against its reverse complement)
+            alignments = []
+            for frame_q, target in [(1, qry_seq), (-1, reverse_complement(qry_seq))]:
+                alignment = aligner.align(target, region)[0]
+                alignments.append((alignment.score, frame_q, target, list(zip(*alignment.aligned))))
+            alignments.sort(key=lambda alignment: -alignment[0])
+
+            for _, frame_q, target, blocks in alignments:
+                if len(blocks) == 0:
+                    continue
+
+                #Identity of the alignment: matches over the columns of the alignment (aligned bases and internal gaps), and longest exact match
+                matches = 0
+                aligned_bases = 0
+                longest_match = 0
+                for (start_t, end_t), (start_r, end_r) in blocks:
+                    aligned_bases += end_t - start_t
+                    match_length = 0
+                    for base_t, base_r in zip(target[start_t:end_t], region[start_r:end_r]):
+                        match_length = match_length + 1 if base_t == base_r else 0
+                        matches += (base_t == base_r)
+                        longest_match = max(longest_match, match_length)
+                target_start, target_end = int(blocks[0][0][0]), int(blocks[-1][0][1])
+                region_start, region_end = int(blocks[0][1][0]), int(blocks[-1][1][1])
+                if longest_match < NATIVE_MIN_MATCH or (region_end - region_start) < NATIVE_MIN_CLUSTER:
+                    continue
+                columns = (target_end - target_start) + (region_end - region_start) - aligned_bases
+                identity = 100.0 * matches / columns if columns > 0 else 0.0
+
+                #Coordinates (1-based) on the reference, and on the forward strand of the query (end before start for the '-1' frame)
+                s1, e1 = region_start + 1, region_end
+                if frame_q == 1:
+                    s2, e2 = target_start + 1, target_end
+                else:
+                    s2, e2 = len_q - target_start, len_q - target_end + 1
+                len_align_r = e1 - s1 + 1
+                len_align_q = abs(e2 - s2) + 1
 
-if re.match('^.*.insertions.fasta$', args.query) is None:
-    parser.error("Warning: Qualitative evaluation _ The suffix of the inserted sequences (query sequences) file should be: '.insertions.fasta'")
+                coords.append(Coords(s1, e1, s2, e2, len_align_r, len_align_q, "{:.2f}".format(identity), len_r, len_q, \
+                                     "{:.2f}".format(100.0 * len_align_r / len_r), "{:.2f}".format(100.0 * len_align_q / len_q), 1, frame_q, ref_record.id, qry_record.id))
+    return coords
 
-if re.match('^.*.fasta$', args.reference) is None:
-    parser.error("Warning: Qualitative evaluation _ The suffix of the reference sequence file should be: '.fasta'")
 
 #----------------------------------------------------
-# Input files
+# NUCmer alignments
 #----------------------------------------------------
-qry_file = os.path.abspath(args.query)
-if not os.path.exists(args.query):
-    parser.error("Warning: Qualitative evaluation _ The path of the query file (inserted sequences file) doesn't exist")
+'''
+To align query records against a reference file with NUCmer:
+    - it takes as input the reference file (None to align the query records against themselves), the query records, the path prefix of the NUCmer files and the NUCmer options
+    - it outputs the list of coords of the alignments obtained with 'show-coords -rcdlT' (parsed once, header lines removed)
+'''
+def nucmer_coords(ref_file, qry_records, prefix, options):
+    qry_file = prefix + ".insertions.fasta"
+    SeqIO.write(qry_records, qry_file, "fasta")
+    with open(prefix + "_nucmer.log", "a") as log:
+        subprocess.run(["nucmer"] + options + ["-p", prefix, (ref_file if ref_file is not None else qry_file), qry_file], stderr=log)
+        coords_output = subprocess.run(["show-coords", "-rcdlT", prefix + ".delta"], stdout=subprocess.PIPE, stderr=log, universal_newlines=True).stdout
+    coords = [parse_coords(line) for line in coords_output.splitlines()]
+    return [row for row in coords if row is not None]
 
-ref_file = os.path.abspath(args.reference)
-if not os.path.exists(ref_file):
-    parser.error("Warning: Qualitative evaluation _ The path of the reference file doesn't exist")
 
 #----------------------------------------------------
-# Directory for saving results
+# AlignmentCache class
 #----------------------------------------------------
-cwd = os.getcwd()
-if not os.path.exists(args.outDir):
-    os.mkdir(args.outDir)
-try:
-    os.chdir(args.outDir)
-except:
-    print("Something wrong with specified directory. Exception-", sys.exc_info())
-    print("Restoring the path")
-    os.chdir(cwd)
-outDir = os.getcwd()
-
-try:
-    #-----------------------------------------------------------------------------
-    # Statistics about the Alignment Ref vs Qry
-    #-----------------------------------------------------------------------------
-
-    if not re.match('^.*.contigs.fasta$', args.reference):
-        #----------------------------------------------------
-        # Ref = reference sequence of simulated gap
-        #----------------------------------------------------
-        #Run NUCmer to obtain alignment of the reference sequence against the query's sequences
-        qry_id = qry_file.split('.')[-9]
-        qry_k = qry_file.split('.')[-6]
-        qry_a = qry_file.split('.')[-5]
-        id_ = str(qry_id) + "." + str(qry_k) + "." + str(qry_a)
-        prefix = id_ + ".ref_qry"
-
-        log_file = str(prefix) + ".log"
-        with open(log_file, "a") as log:
-            log.write("Query file: " + str(qry_file) + "\n")
-            log.write("Reference file" + str(ref_file) + "\n")
-            log.write("The results are saved in " + outDir)
-
-        nucmerLog = "{}_nucmer_ref_qry.log".format(id_)
-        delta_file = prefix + ".delta"
-        coords_file = prefix + ".coords.unsorted" 
-
-        nucmer_command = ["nucmer", "--maxmatch", "-p", prefix, ref_file, qry_file]
-        coords_command = ["show-coords", "-rcdlT", delta_file]
-
-        with open(coords_file, "w") as coords, open(nucmerLog, "a") as log:
-            subprocess.run(nucmer_command, stderr=log)
-            subprocess.run(coords_command, stdout=coords, stderr=log)
-
-        #Sort the 'xxx.coords.unsorted' file for further analysis
-        coords_sorted_file = prefix + ".coords"
-        sort_command = ["sort", "-n", coords_file]
-        with open(coords_sorted_file, "w") as coords_sorted:
-            subprocess.run(sort_command, stdout=coords_sorted)
-
-        #Output stats file of alignment query vs ref
-        ref_qry_output = outDir + "/" + args.prefix + ".ref_qry.alignment.stats.unsorted"
-        stats_legend = ["Gap", "Len_gap", "Chunk", "k", "a", "Strand", "Solution", "Len_Q", "Ref", "Len_R", \
-                        "Start_ref", "End_ref", "Start_qry", "End_qry", "Len_alignR", "Len_alignQ", "%_Id", "%_CovR", "%_CovQ", "Frame_R", "Frame_Q", "Quality"]
-        
-        #Get the gap size, chunk size, kmer size and abundance min values
-        gap_size = qry_file.split('.')[-8]
-        g = int("".join(list(gap_size)[1:]))
-        chunk_size = qry_file.split('.')[-7]
-        c = int("".join(list(chunk_size)[1:]))
-        k = int("".join(list(qry_k)[1:]))
-        a = int("".join(list(qry_a)[1:]))
-
-        #Get output values from NUCmer:
-        reader = csv.DictReader(open(coords_sorted_file), \
-                                    fieldnames=("S1", 'E1', "S2", "E2", "LEN_1", "LEN_2", "%_IDY", "LEN_R", "LEN_Q", "COV_R", "COV_Q", "FRM_R", "FRM_Q", "TAG_1", "TAG_2"), \
-                                    delimiter='\t')
-
-        rows = list(reader)
-        for row in rows[3:]:
-
-            len_q = row["LEN_Q"]
-            ref = row["TAG_1"]
-            len_r = row["LEN_R"]
-            start_r = row["S1"]
-            end_r = row["E1"]
-            start_q = row["S2"]
-            end_q = row["E2"]
-            len_align_r = row["LEN_1"]
-            len_align_q = row["LEN_2"]
-            identity = row["%_IDY"]
-            cov_r = row["COV_R"]
-            cov_q = row["COV_Q"]
-            frame_r = row["FRM_R"]
-            frame_q = row["FRM_Q"]
-            solution = str(row["TAG_2"]).split('_sol_')[1]
-
-            if "bkpt1" in str(row["TAG_2"]):
-                strand = "fwd"
-            else:
-                strand = "rev"
-
-            # Estimate quality of gapfilled sequence
-            ref_len = int(len_r)
-            error_10_perc = int(0.1 * ref_len)
-            qry_len = int(len_q) - 2*args.ext
-
-            #length of query sequence is equal +-10% of ref length
-            if qry_len in range((ref_len - error_10_perc), (ref_len + error_10_perc)):
-                #the gapfilled seq matches to the whole ref seq
-                if int(len_align_q) == ref_len:
-                    quality_rq = 'A'
-                #the gapfilled seq matches to the ref seq +-10% of ref length
-                elif int(len_align_q) in range((ref_len - error_10_perc), (ref_len + error_10_perc)):
-                    quality_rq = 'B'
-                #the gapfilled seq matches to the ref seq, but not along all their length (>= 50% of their length align)
-                elif int(len_align_q) >= int(0.5*ref_len) and int(len_align_r) >= int(0.5*qry_len):
-                    quality_rq = 'C'
-                else:
-                    quality_rq = 'D'
+class AlignmentCache:
+    '''
+    Class keeping the alignments of the inserted sequences of a gap, so that each distinct sequence is aligned only once for all the (k, a) combinations of the gap:
+    - the coords of the alignments ref vs qry of each sequence (for each reference and aligner)
+    - the coords of the alignments qry vs qry of each pair of sequences, and the records of the sequences already aligned qry vs qry
+    - the number of sequences aligned, and of sequences whose alignments were reused
+    '''
+
+    #Constructor
+    def __init__(self):
+        self.ref_qry = {}
+        self.qry_qry = {}
+        self.qry_sequences = {}
+        self.nb_aligned = 0
+        self.nb_reused = 0
+
+    #Method "aligned_records"
+    def aligned_records(self, records, origin):
+        '''Method to get the distinct sequences of records (dictionary with the sequence as key, in order), each with a record whose ID encodes its origin ('<origin>.<record ID>') to align it'''
+        distinct = {}
+        for record in records:
+            sequence = str(record.seq).upper()
+            if sequence not in distinct:
+                aligned_record = record[:]
+                aligned_record.id = "{}.{}".format(origin, record.id)
+                aligned_record.description = ""
+                distinct[sequence] = aligned_record
+        return distinct
+
+    #Method "ref_qry_coords"
+    def ref_qry_coords(self, ref_key, qry_records, origin, align):
+        '''Method to get the coords of the alignments ref vs qry of the query records, the sequences not aligned yet against this reference being aligned together with 'align(records)' '''
+        distinct = self.aligned_records(qry_records, origin)
+        new_records = [record for sequence, record in distinct.items() if (ref_key, sequence) not in self.ref_qry]
+        if len(new_records) > 0:
+            sequence_of = dict((record.id, sequence) for sequence, record in distinct.items())
+            for record in new_records:
+                self.ref_qry[(ref_key, sequence_of[record.id])] = []
+            for row in align(new_records):
+                self.ref_qry[(ref_key, sequence_of[row.tag_2])].append(row)
+        self.nb_aligned += len(new_records)
+        self.nb_reused += len(distinct) - len(new_records)
+
+        coords = []
+        for record in qry_records:
+            for row in self.ref_qry[(ref_key, str(record.seq).upper())]:
+                coords.append(row._replace(tag_2=record.id))
+        return coords
+
+    #Method "qry_qry_coords"
+    def qry_qry_coords(self, qry_records, origin, align):
+        '''Method to get the coords of the alignments qry vs qry of the query records (all pairs), the distinct sequences not aligned yet being aligned with 'align(ref_records, qry_records)'
+        against the sequences already aligned and themselves (and the sequences already aligned against them), the pairs of sequences already aligned being reused'''
+        distinct = self.aligned_records(qry_records, origin)
+        new_records = [record for sequence, record in distinct.items() if sequence not in self.qry_sequences]
+        if len(new_records) > 0:
+            known_records = list(self.qry_sequences.values())
+            for sequence, record in distinct.items():
+                if sequence not in self.qry_sequences:
+                    self.qry_sequences[sequence] = record
+            sequence_of = dict((record.id, sequence) for sequence, record in self.qry_sequences.items())
+            for record in new_records:
+                for sequence in self.qry_sequences:
+                    self.qry_qry[(sequence, sequence_of[record.id])] = []
+                    self.qry_qry[(sequence_of[record.id], sequence)] = []
+            rows = align(known_records + new_records, new_records)
+            if len(known_records) > 0:
+                rows += align(new_records, known_records)
+            for row in rows:
+                self.qry_qry[(sequence_of[row.tag_1], sequence_of[row.tag_2])].append(row)
+
+        coords = []
+        for record1 in qry_records:
+            for record2 in qry_records:
+                for row in self.qry_qry[(str(record1.seq).upper(), str(record2.seq).upper())]:
+                    coords.append(row._replace(tag_1=record1.id, tag_2=record2.id))
+        return coords
 
-            else:
-                quality_rq = 'D'
 
-            #Write stats results in output file
-            stats = [qry_id, g, c, k, a, strand, solution, len_q, ref, len_r, \
-                    start_r, end_r, start_q, end_q, len_align_r, len_align_q, identity, cov_r, cov_q, frame_r, frame_q, quality_rq]
+#----------------------------------------------------
+# Stats rows
+#----------------------------------------------------
+#Legends of the stats files
+stats_legend = ["Gap", "Len_gap", "Chunk", "k", "a", "Strand", "Solution", "Len_Q", "Ref", "Len_R", \
+                "Start_ref", "End_ref", "Start_qry", "End_qry", "Len_alignR", "Len_alignQ", "%_Id", "%_CovR", "%_CovQ", "Frame_R", "Frame_Q", "Quality"]
+stats_legend_qry = ["Gap", "Len_gap", "Chunk", "k", "a", "Solution1", "Len_Q1", "Solution2", "Len_Q2", \
+                    "Start_Q1", "End_Q1", "Start_Q2", "End_Q2", "Len_align_Q1", "Len_align_Q2", "%_Id", "%_Cov_Q1", "%_Cov_Q2", "Frame_Q1", "Frame_Q2", "Quality"]
+
+#Typed rows of the stats files (one field per column of the legend)
+RefQryStats = namedtuple("RefQryStats", ["gap", "len_gap", "chunk", "k", "a", "strand", "solution", "len_q", "ref", "len_r", \
+                                         "start_ref", "end_ref", "start_qry", "end_qry", "len_align_r", "len_align_q", "identity", "cov_r", "cov_q", "frame_r", "frame_q", "quality"])
+QryQryStats = namedtuple("QryQryStats", ["gap", "len_gap", "chunk", "k", "a", "solution1", "len_q1", "solution2", "len_q2", \
+                                         "start_q1", "end_q1", "start_q2", "end_q2", "len_align_q1", "len_align_q2", "identity", "cov_q1", "cov_q2", "frame_q1", "frame_q2", "quality"])
+
+#Text columns of the stats files, the other ones are numbers (or '/' and 'NA' when not available)
+text_fields = set(["gap", "strand", "solution", "ref", "solution1", "solution2", "quality"])
+
+#Function to convert a value of a numeric column to an int or a float (the value is kept as is if it is not a number)
+def typed_value(value):
+    for number_type in (int, float):
+        try:
+            return number_type(value)
+        except ValueError:
+            pass
+    return value
+
+#Function to get a typed row of a stats file from the text of its values
+def typed_row(row_type, values):
+    return row_type(*[value if field in text_fields else typed_value(value) for field, value in zip(row_type._fields, values)])
+
+#Function to get the text of a row of a stats file
+def row_line(row):
+    return '\t'.join(str(value) for value in row)
+
+#Function to get the number at the beginning of a text, as 'sort -n' does (leading blanks ignored, 0 if no number)
+def leading_number(text):
+    match = re.match(r'^\s*(-?(\d+\.?\d*|\.\d+))', text)
+    if match is None:
+        return 0.0
+    return float(match.group(1))
+
+#Function to sort the rows of the alignments ref vs qry in reverse order by strand and solution, then by start position on the reference
+#(as 'sort -k6,7 -k11,12n -r' with a case-insensitive collation)
+def sort_ref_qry_rows(rows):
+    return sorted(rows, key=lambda row: ((row.strand + " " + row.solution).lower(), float(row.start_ref), row_line(row).lower()), reverse=True)
+
+#Function to sort the rows of the alignments qry vs qry numerically on their beginning, ties broken by the whole row (as 'sort -n')
+def sort_qry_qry_rows(rows):
+    return sorted(rows, key=lambda row: (leading_number(row_line(row)), row_line(row)))
+
+'''
+To write a stats file in a single buffered pass:
+    - it takes as input the stats file, its legend and its rows
+    - it outputs the typed rows of the stats file, as read back from the file (see 'read_stats_rows')
+'''
+def write_stats_file(stats_file, legend, rows):
+    lines = [row_line(row) for row in rows]
+    with open(stats_file, "w") as f:
+        f.write('\t'.join(legend) + '\n' + "".join(line + '\n' for line in lines))
+    return [typed_row(type(row), line.split('\t')) for row, line in zip(rows, lines)]
+
+'''
+To read the rows of a stats file:
+    - it takes as input the stats file and the type of its rows (RefQryStats or QryQryStats)
+    - it outputs the list of typed rows of the stats file, in the order of the file (the legend and the empty lines are skipped)
+'''
+def read_stats_rows(stats_file, row_type):
+    rows = []
+    if not os.path.exists(stats_file):
+        return rows
+    with open(stats_file, "r") as f:
+        for line in f.read().splitlines():
+            values = line.split('\t')
+            if len(values) != len(row_type._fields) or values[-1] == "Quality":
+                continue
+            rows.append(typed_row(row_type, values))
+    return rows
+
+'''
+To index the quality scores of the rows of the stats files, to score each inserted sequence with lookups:
+    - it takes as input the typed rows of the alignments ref vs qry (RefQryStats) and qry vs qry (QryQryStats)
+    - it outputs a dictionary with (strand, solution, ref) as key and the list of the quality scores of the alignments ref vs qry of this solution as value,
+      and a dictionary with (strand, solution) as key and the list of the quality scores of the alignments qry vs qry involving this solution as value
+'''
+def index_stats_rows(ref_qry_rows, qry_qry_rows):
+    ref_qry_index = {}
+    for row in ref_qry_rows:
+        ref_qry_index.setdefault((row.strand, row.solution, row.ref), []).append(row.quality)
+
+    qry_qry_index = {}
+    for row in qry_qry_rows:
+        for solution in set([row.solution1, row.solution2]):
+            qry_qry_index.setdefault((solution[:3], solution[3:]), []).append(row.quality)
+
+    return ref_qry_index, qry_qry_index
+
+
+#----------------------------------------------------
+# Quality scores
+#----------------------------------------------------
+'''
+To get the quality score of an alignment of a gap-filled sequence against the reference sequence of the gap:
+    - it takes as input the lengths of the alignment on the reference and on the gap-filled sequence, and the lengths of the reference and of the gap-filled sequence (without the flanking regions)
+    - it outputs 'A' if the gap-filled seq matches to the whole ref seq, 'B' if it matches to the ref seq +-10% of ref length,
+      'C' if they match but not along all their length (>= 50% of their length align), 'D' otherwise
+'''
+def ref_alignment_quality(len_align_r, len_align_q, ref_len, qry_len):
+    error_10_perc = int(0.1 * ref_len)
+    if len_align_q == ref_len:
+        return 'A'
+    elif (ref_len - error_10_perc) <= len_align_q < (ref_len + error_10_perc):
+        return 'B'
+    elif len_align_q >= int(0.5*ref_len) and len_align_r >= int(0.5*qry_len):
+        return 'C'
+    return 'D'
+
+'''
+To get the quality score of an alignment of a flanking contig's region (-ext) against a gap-filled sequence:
+    - it takes as input the name of the contig, the strand of the gap-filled sequence, the start and end positions of the alignment on the gap-filled sequence, its length, the size of the extension and the gap label
+    - it outputs 'A' if the extension of the gap-filled seq matches perfectly as expected to the contig, 'B' if it almost matches as expected (+-10% of the extension size),
+      'C' if it almost matches (+-ext) as expected, 'D' otherwise
+'''
+def flank_alignment_quality(ref, strand, start_q, end_q, len_q, ext, qry_id):
+    left = str(qry_id).split('_')[0]
+    left_scaffold = left[:-1]
+    right = str(qry_id).split('_')[1]
+    right_scaffold = right[:-1]
+    error_10_perc = int(0.1 * ext)
+
+    #ref = Left scaffold
+    if ref == left_scaffold:
+        #extension of qry match perfectly as expected to ref
+        if ('+' in left and ((strand == "fwd" and start_q == 1 and end_q == ext) or (strand == "rev" and start_q == len_q and end_q == (len_q - ext + 1)))) \
+            or ('-' in left and ((strand == "fwd" and start_q == ext and end_q == 1) or (strand == "rev" and start_q == (len_q - ext + 1) and end_q == len_q))):
+            return 'A'
+        #extension of qry almost match as expected to ref (+-10% of extension size)
+        elif ('+' in left and ((strand == "fwd" and start_q in range(1, (1 + error_10_perc+1)) and end_q in range((ext - error_10_perc), (ext + error_10_perc+1))) or (strand == "rev" and start_q in range((len_q - error_10_perc), (len_q+1)) and end_q in range((len_q-ext+1 - error_10_perc), (len_q-ext+1 + error_10_perc+1))))) \
+            or ('-' in left and ((strand == "fwd" and start_q in range((ext - error_10_perc), (ext + error_10_perc+1)) and end_q in range(1, (1 + error_10_perc+1))) or (strand == "rev" and start_q in range((len_q-ext+1 - error_10_perc), (len_q-ext+1 + error_10_perc+1)) and end_q in range((len_q - error_10_perc), (len_q+1))))):
+            return 'B'
+        #extension of qry almost match (+-ext) as expected to ref
+        elif ('+' in left and ((strand == "fwd" and end_q <= 2*ext) or (strand == "rev" and end_q >= (len_q - 2*ext)))) \
+            or ('-' in left and ((strand == "fwd" and start_q <= 2*ext) or (strand == "rev" and start_q >= (len_q - 2*ext)))):
+            return 'C'
+        return 'D'
+
+    #ref = Right scaffold
+    elif ref == right_scaffold:
+        #extension of qry match perfectly as expected to ref
+        if ('+' in right and ((strand == "fwd" and start_q == (len_q - ext + 1) and end_q == len_q) or (strand == "rev" and start_q == ext and end_q == 1))) \
+            or ('-' in right and ((strand == "fwd" and start_q == len_q and end_q == (len_q - ext +1)) or (strand == "rev" and start_q == 1 and end_q == ext))):
+            return 'A'
+        #extension of qry almost match as expected to ref (+-10% of extension size)
+        elif ('+' in right and ((strand == "fwd" and start_q in range((len_q-ext+1 - error_10_perc), (len_q-ext+1 + error_10_perc+1)) and end_q in range((len_q - error_10_perc), (len_q+1))) or (strand == "rev" and start_q in range((ext - error_10_perc), (ext + error_10_perc+1)) and end_q in range(1, (1 + error_10_perc+1))))) \
+            or ('-' in right and ((strand == "fwd" and start_q in range((len_q - error_10_perc), (len_q+1)) and end_q in range((len_q-ext+1 - error_10_perc), (len_q-ext+1 + error_10_perc+1))) or (strand == "rev" and start_q in range(1, (1 + error_10_perc+1)) and end_q in range((ext - error_10_perc), (ext + error_10_perc+1))))):
+            return 'B'
+        #extension of qry almost match (+-ext) as expected to ref
+        elif ('+' in right and ((strand == "fwd" and start_q >= (len_q - 2*ext)) or (strand == "rev" and start_q <= 2*ext))) \
+            or ('-' in right and ((strand == "fwd" and end_q >= (len_q - 2*ext)) or (strand == "rev" and end_q <= 2*ext))):
+            return 'C'
+        return 'D'
+
+    return 'D'
+
+'''
+To get the quality score of an alignment between two gap-filled sequences (fwd vs rev):
+    - it takes as input the lengths of both sequences and the lengths of the alignment on both sequences
+    - it outputs 'A' if both sequences match to each other along all their length, 'B' if one sequence matches to the other along all its length or both sequences match to each other along their length +-10%,
+      'C' if they match but not along all their length (>= 50% of their length align), 'D' otherwise
+'''
+def qry_alignment_quality(len_q1, len_q2, len_align_q1, len_align_q2):
+    if len_align_q1 == len_q1 and len_align_q2 == len_q2:
+        return 'A'
+    elif (len_align_q1 == len_q1 or len_align_q2 == len_q2) or ((len_q1 - int(0.1*len_q1)) <= len_align_q1 < (len_q1 + int(0.1*len_q1))) or ((len_q2 - int(0.1*len_q2)) <= len_align_q2 < (len_q2 + int(0.1*len_q2))):
+        return 'B'
+    elif len_align_q1 >= int(0.5*len_q1) and len_align_q2 >= int(0.5*len_q2):
+        return 'C'
+    return 'D'
+
+
+#----------------------------------------------------
+# Alignments in multiple chunks
+#----------------------------------------------------
+'''
+To calculate the appropriate quality score of the alignments ref vs qry in multiple chunks:
+    - it takes as input the rows of the alignments ref vs qry sorted with 'sort_ref_qry_rows' and the size of the extension
+    - it outputs one row per strand and solution, for the alignment made of all its chunks (lengths of the alignment computed from the regions not aligned)
+'''
+def merge_ref_qry_chunks(rows, ext):
+    merged = []
+    for i, row in enumerate(rows):
+        ref_len = row.len_r
+        qry_len = row.len_q - 2*ext
+        previous = rows[i-1] if i > 0 else None
+        following = rows[i+1] if i+1 < len(rows) else None
+
+        if previous is None or (row.strand, row.solution) != (previous.strand, previous.solution):
+            lack_ref = row.start_ref - 1
+            lack_qry = 0
+            start_r = row.start_ref
+            if row.frame_q == 1:
+                start_q = row.start_qry
+                lack_qry += start_q - (ext+1)
+            elif row.frame_q == -1:
+                end_q = row.start_qry
+                lack_qry += qry_len - (end_q - ext)
+
+        else:
+            if row.start_ref > previous.end_ref:
+                lack_ref += row.start_ref - previous.end_ref
+            if row.frame_q == 1:
+                if row.start_qry > previous.end_qry:
+                    lack_qry += row.start_qry - previous.end_qry
+            elif row.frame_q == -1:
+                if row.start_qry < previous.end_qry:
+                    lack_qry += previous.end_qry - row.start_qry
+
+        if following is None or (row.strand, row.solution) != (following.strand, following.solution):
+            end_r = row.end_ref
+            lack_ref += ref_len - end_r
+            if row.frame_q == 1:
+                end_q = row.end_qry
+                lack_qry += qry_len - (end_q - ext)
+            elif row.frame_q == -1:
+                start_q = row.end_qry
+                lack_qry += start_q - (ext+1)
+
+            len_align_r = ref_len - lack_ref
+            len_align_q = qry_len - lack_qry
+            merged.append(RefQryStats(row.gap, row.len_gap, row.chunk, row.k, row.a, row.strand, row.solution, row.len_q, row.ref, row.len_r, \
+                                      start_r, end_r, start_q, end_q, len_align_r, len_align_q, "/", "/", "/", row.frame_r, row.frame_q, \
+                                      ref_alignment_quality(len_align_r, len_align_q, ref_len, qry_len)))
+    return merged
+
+'''
+To calculate the appropriate quality score of the alignments qry vs qry (fwd vs rev) in multiple chunks:
+    - it takes as input the rows of the alignments qry vs qry sorted with 'sort_qry_qry_rows'
+    - the regions not aligned are summed over the first run of rows of fwd vs rev solutions
+    - it outputs the row of the alignment made of all these chunks, or None if the fwd and rev solutions don't align (the rev-comp quality score of the solutions being then 'D')
+'''
+def merge_qry_qry_chunks(rows):
+    lack_Q1 = 0
+    lack_Q2 = 0
+    last = None
+    for i, row in enumerate(rows):
+        previous = rows[i-1] if i > 0 else None
+        following = rows[i+1] if i+1 < len(rows) else None
+
+        if ("fwd" in row.solution1) and ("rev" in row.solution2):
+            last = row
+            if previous is None or (row.solution1, row.solution2) != (previous.solution1, previous.solution2):
+                start_Q1 = row.start_q1
+                end_Q2 = row.start_q2
+                lack_Q1 += (start_Q1 - 1)
+                lack_Q2 += (row.len_q2 - end_Q2)
 
-            if os.path.exists(ref_qry_output):
-                with open(ref_qry_output, "a") as output:
-                    output.write('\n' + '\t'.join(str(i) for i in stats))
             else:
-                with open(ref_qry_output, "a") as output:
-                    output.write('\t'.join(j for j in stats_legend))
-                    output.write('\n'+'\n' + '\t'.join(str(i) for i in stats))
+                if row.start_q1 > previous.end_q1:
+                    lack_Q1 += (row.start_q1 - previous.end_q1)
+                if row.start_q2 < previous.end_q2:
+                    lack_Q2 += (previous.end_q2 - row.start_q2)
 
-        #Sort the 'xxx.alignment.stats.unsorted' file for further analysis
-        ref_qry_sorted = outDir + "/" + args.prefix + ".ref_qry.alignment.stats"
-        order_command = ["sort", "-k6,7", "-k11,12n", "-r", ref_qry_output]
-        with open(ref_qry_sorted, "w") as r_sorted:
-            subprocess.run(order_command, stdout=r_sorted)
+            if following is None or (row.solution1, row.solution2) != (following.solution1, following.solution2):
+                end_Q1 = row.end_q1
+                start_Q2 = row.end_q2
+                lack_Q1 += (row.len_q1 - end_Q1)
+                lack_Q2 += (start_Q2 - 1)
 
-        #If alignment in multiple chunks, calculate the appropriate quality score
-        with open(ref_qry_sorted, "r") as r:
-            r.seek(0)
-            reader = csv.DictReader(r, fieldnames=("Gap", "Len_gap", "Chunk", "k", "a", "Strand", "Solution", "Len_Q", "Ref", "Len_R", \
-                                    "Start_ref", "End_ref", "Start_qry", "End_qry", "Len_alignR", "Len_alignQ", "%_Id", "%_CovR", "%_CovQ", "Frame_R", "Frame_Q", "Quality"), \
-                                    delimiter='\t')
-
-            rows = list(reader)
-            for i in range(1, len(rows)):
-                if ("fwd" in rows[i]["Strand"]) or ("rev" in rows[i]["Strand"]):
-
-                    qry_id = rows[i]["Gap"]
-                    g = rows[i]["Len_gap"]
-                    c = rows[i]["Chunk"]
-                    k = rows[i]["k"]
-                    a = rows[i]["a"]
-                    strand = rows[i]["Strand"]
-                    solution = rows[i]["Solution"]
-                    len_q = rows[i]["Len_Q"]
-                    ref = rows[i]["Ref"]
-                    len_r = rows[i]["Len_R"]
-                    frame_r = rows[i]["Frame_R"]
-                    frame_q = rows[i]["Frame_Q"]
-                    ref_len = int(len_r)
-                    qry_len = int(len_q) - 2*args.ext
-
-                    if (strand != rows[i-1]["Strand"]) or (solution != rows[i-1]["Solution"]):
-                        lack_ref = 0
-                        lack_qry = 0
-                        start_r = int(rows[i]["Start_ref"])
-                        lack_ref += start_r - 1
-                        if frame_q == "1":
-                            start_q = int(rows[i]["Start_qry"])
-                            lack_qry += start_q - (args.ext+1)
-                        elif frame_q == "-1":
-                            end_q = int(rows[i]["Start_qry"])
-                            lack_qry += qry_len - (end_q - args.ext)
-
-                    if (strand == rows[i-1]["Strand"]) and (solution == rows[i-1]["Solution"]):
-                        if int(rows[i]["Start_ref"]) > int(rows[i-1]["End_ref"]):
-                            lack_ref += int(rows[i]["Start_ref"]) - int(rows[i-1]["End_ref"])
-                        if frame_q == "1":
-                            if int(rows[i]["Start_qry"]) > int(rows[i-1]["End_qry"]):
-                                lack_qry += int(rows[i]["Start_qry"]) - int(rows[i-1]["End_qry"])
-                        elif frame_q == "-1":
-                            if int(rows[i]["Start_qry"]) < int(rows[i-1]["End_qry"]):
-                                lack_qry += int(rows[i-1]["End_qry"]) - int(rows[i]["Start_qry"])
-
-                    if (i == len(rows)-1) or ((strand != rows[i+1]["Strand"]) or (solution != rows[i+1]["Solution"])):
-                        end_r = int(rows[i]["End_ref"])
-                        lack_ref += ref_len - end_r
-                        if frame_q == "1":
-                            end_q = int(rows[i]["End_qry"])
-                            lack_qry += qry_len - (end_q - args.ext)
-                        elif frame_q == "-1":
-                            start_q = int(rows[i]["End_qry"])
-                            lack_qry += start_q - (args.ext+1)
-
-                        len_align_r = ref_len - lack_ref
-                        len_align_q = qry_len - lack_qry
-
-                        identity = "/"
-                        cov_r = "/"
-                        cov_q = "/"
-
-                        #Assign a quality score
-                        #the gapfilled seq matches to the whole ref seq
-                        if int(len_align_q) == ref_len:
-                            quality_rq = 'A'
-                        #the gapfilled seq matches to the ref seq +-10% of ref length
-                        elif int(len_align_q) in range((ref_len - error_10_perc), (ref_len + error_10_perc)):
-                            quality_rq = 'B'
-                        #the gapfilled seq matches to the ref seq, but not along all their length (>= 50% of their length align)
-                        elif int(len_align_q) >= int(0.5*ref_len) and int(len_align_r) >= int(0.5*qry_len):
-                            quality_rq = 'C'
-                        else:
-                            quality_rq = 'D'
-
-                        #Write stats results in output file
-                        stats = [qry_id, g, c, k, a, strand, solution, len_q, ref, len_r, \
-                                start_r, end_r, start_q, end_q, len_align_r, len_align_q, identity, cov_r, cov_q, frame_r, frame_q, quality_rq]
-
-                        with open(ref_qry_sorted, "a") as output_ref:
-                            output_ref.write('\n' + '\t'.join(str(i) for i in stats))
-
-
-    elif re.match('^.*.contigs.fasta$', args.reference):
-        #----------------------------------------------------
-        # Ref = contigs' sequences
-        #----------------------------------------------------
-        #Run NUCmer to obtain alignment of extension portions (-ext) (of the flanking contigs) against the query's sequences
-        qry_id = qry_file.split('.')[-9]
-        qry_k = qry_file.split('.')[-6]
-        qry_a = qry_file.split('.')[-5]
-        id_ = str(qry_id) + "." + str(qry_k) + "." + str(qry_a)
-        prefix = id_ + ".ref_qry"
-
-        log_file = str(prefix) + ".log"
-        with open(log_file, "a") as log:
-            log.write("Query file: " + str(qry_file) + "\n")
-            log.write("Reference file" + str(ref_file) + "\n")
-            log.write("The results are saved in " + outDir)
-
-        nucmerLog = "{}_nucmer_ref_qry.log".format(id_)
-        delta_file = prefix + ".delta"
-        coords_file = prefix + ".coords"
-
-        nucmer_command = ["nucmer", "-p", prefix, ref_file, qry_file]
-        coords_command = ["show-coords", "-rcdlT", delta_file]
-
-        with open(coords_file, "w") as coords, open(nucmerLog, "a") as log:
-            subprocess.run(nucmer_command, stderr=log)
-            subprocess.run(coords_command, stdout=coords, stderr=log)
-
-        #Output stats file of alignment query vs ref
-        ref_qry_output = outDir + "/" + args.prefix + ".ref_qry.alignment.stats"
-        stats_legend = ["Gap", "Len_gap", "Chunk", "k", "a", "Strand", "Solution", "Len_Q", "Ref", "Len_R", \
-                        "Start_ref", "End_ref", "Start_qry", "End_qry", "Len_alignR", "Len_alignQ", "%_Id", "%_CovR", "%_CovQ", "Frame_R", "Frame_Q", "Quality"]
-        
-        #Get the gap size, chunk size, kmer size and abundance min values
-        gap_size = qry_file.split('.')[-8]
-        g = int("".join(list(gap_size)[1:]))
-        if g == 0:
-            g = "NA"
-        chunk_size = qry_file.split('.')[-7]
-        c = int("".join(list(chunk_size)[1:]))
-        k = int("".join(list(qry_k)[1:]))
-        a = int("".join(list(qry_a)[1:]))
-
-        #Get output values from NUCmer:
-        reader = csv.DictReader(open(coords_file), \
-                                    fieldnames=("S1", 'E1', "S2", "E2", "LEN_1", "LEN_2", "%_IDY", "LEN_R", "LEN_Q", "COV_R", "COV_Q", "FRM_R", "FRM_Q", "TAG_1", "TAG_2"), \
-                                    delimiter='\t')
-
-        rows = list(reader)
-        for row in rows[3:]:
-            if row["TAG_1"].split("_")[0] in str(qry_id):
-
-                len_q = row["LEN_Q"]
-                ref = row["TAG_1"].split("_")[0]
-                len_r = row["LEN_R"]
-                start_r = row["S1"]
-                end_r = row["E1"]
-                start_q = row["S2"]
-                end_q = row["E2"]
-                len_align_r = row["LEN_1"]
-                len_align_q = row["LEN_2"]
-                identity = row["%_IDY"]
-                cov_r = row["COV_R"]
-                cov_q = row["COV_Q"]
-                frame_r = row["FRM_R"]
-                frame_q = row["FRM_Q"]
-                solution = str(row["TAG_2"]).split('_sol_')[1]
-
-                if "bkpt1" in str(row["TAG_2"]):
-                    strand = "fwd"
-                else:
-                    strand = "rev"
-
-                # Estimate quality of gapfilled sequence
-                left = str(qry_id).split('_')[0]
-                left_scaffold = left[:-1]
-                right = str(qry_id).split('_')[1]
-                right_scaffold = right[:-1]
-                error_10_perc = int(0.1 * args.ext)
-
-                #ref = Left scaffold
-                if ref == left_scaffold:
-                    #extension of qry match perfectly as expected to ref
-                    if ('+' in left and ((strand == "fwd" and int(start_q) == 1 and int(end_q) == args.ext) or (strand == "rev" and int(start_q) == int(len_q) and int(end_q) == (int(len_q) - args.ext + 1)))) \
-                        or ('-' in left and ((strand == "fwd" and int(start_q) == args.ext and int(end_q) == 1) or (strand == "rev" and int(start_q) == (int(len_q) - args.ext + 1) and int(end_q) == int(len_q)))):
-                        quality_rq = 'A'
-                    #extension of qry almost match as expected to ref (+-10% of extension size) 
-                    elif ('+' in left and ((strand == "fwd" and int(start_q) in range(1, (1 + error_10_perc+1)) and int(end_q) in range((args.ext - error_10_perc), (args.ext + error_10_perc+1))) or (strand == "rev" and int(start_q) in range((int(len_q) - error_10_perc), (int(len_q)+1)) and int(end_q) in range((int(len_q)-args.ext+1 - error_10_perc), (int(len_q)-args.ext+1 + error_10_perc+1))))) \
-                        or ('-' in left and ((strand == "fwd" and int(start_q) in range((args.ext - error_10_perc), (args.ext + error_10_perc+1)) and int(end_q) in range(1, (1 + error_10_perc+1))) or (strand == "rev" and int(start_q) in range((int(len_q)-args.ext+1 - error_10_perc), (int(len_q)-args.ext+1 + error_10_perc+1)) and int(end_q) in range((int(len_q) - error_10_perc), (int(len_q)+1))))):
-                        quality_rq = 'B'
-                    #extension of qry almost match (+-ext) as expected to ref
-                    elif ('+' in left and ((strand == "fwd" and int(end_q) <= 2*args.ext) or (strand == "rev" and int(end_q) >= (int(len_q) - 2*args.ext)))) \
-                        or ('-' in left and ((strand == "fwd" and int(start_q) <= 2*args.ext) or (strand == "rev" and int(start_q) >= (int(len_q) - 2*args.ext)))):
-                        quality_rq = 'C'
-                    else:
-                        quality_rq = 'D'
-
-                #ref = Right scaffold
-                elif ref == right_scaffold:
-                    #extension of qry match perfectly as expected to ref
-                    if ('+' in right and ((strand == "fwd" and int(start_q) == (int(len_q) - args.ext + 1) and int(end_q) == int(len_q)) or (strand == "rev" and int(start_q) == args.ext and int(end_q) == 1))) \
-                        or ('-' in right and ((strand == "fwd" and int(start_q) == int(len_q) and int(end_q) == (int(len_q) - args.ext +1)) or (strand == "rev" and int(start_q) == 1 and int(end_q) == args.ext))):
-                        quality_rq = 'A'
-                    #extension of qry almost match as expected to ref (+-10% of extension size) 
-                    elif ('+' in right and ((strand == "fwd" and int(start_q) in range((int(len_q)-args.ext+1 - error_10_perc), (int(len_q)-args.ext+1 + error_10_perc+1)) and int(end_q) in range((int(len_q) - error_10_perc), (int(len_q)+1))) or (strand == "rev" and int(start_q) in range((args.ext - error_10_perc), (args.ext + error_10_perc+1)) and int(end_q) in range(1, (1 + error_10_perc+1))))) \
-                        or ('-' in right and ((strand == "fwd" and int(start_q) in range((int(len_q) - error_10_perc), (int(len_q)+1)) and int(end_q) in range((int(len_q)-args.ext+1 - error_10_perc), (int(len_q)-args.ext+1 + error_10_perc+1))) or (strand == "rev" and int(start_q) in range(1, (1 + error_10_perc+1)) and int(end_q) in range((args.ext - error_10_perc), (args.ext + error_10_perc+1))))):
-                        quality_rq = 'B'
-                    #extension of qry almost match (+-ext) as expected to ref
-                    elif ('+' in right and ((strand == "fwd" and int(start_q) >= (int(len_q) - 2*args.ext)) or (strand == "rev" and int(start_q) <= 2*args.ext))) \
-                        or ('-' in right and ((strand == "fwd" and int(end_q) >= (int(len_q) - 2*args.ext)) or (strand == "rev" and int(end_q) <= 2*args.ext))):
-                        quality_rq = 'C'
-                    else:
-                        quality_rq = 'D'
-                
-                #Write stats results in output file
-                stats = [qry_id, g, c, k, a, strand, solution, len_q, ref, len_r, \
-                        start_r, end_r, start_q, end_q, len_align_r, len_align_q, identity, cov_r, cov_q, frame_r, frame_q, quality_rq]
-
-                if os.path.exists(ref_qry_output):
-                    with open(ref_qry_output, "a") as output:
-                        output.write('\n' + '\t'.join(str(i) for i in stats))
+        elif previous is not None and ("fwd" in previous.solution1) and ("rev" in previous.solution2):
+            break
+
+    if last is None:
+        return None
+
+    len_align_Q1 = last.len_q1 - lack_Q1
+    len_align_Q2 = last.len_q2 - lack_Q2
+    return QryQryStats(last.gap, last.len_gap, last.chunk, last.k, last.a, last.solution1, last.len_q1, last.solution2, last.len_q2, \
+                       start_Q1, end_Q1, start_Q2, end_Q2, len_align_Q1, len_align_Q2, "/", "/", "/", last.frame_q1, last.frame_q2, \
+                       qry_alignment_quality(last.len_q1, last.len_q2, len_align_Q1, len_align_Q2))
+
+
+#----------------------------------------------------
+# stats_alignment function
+#----------------------------------------------------
+'''
+To compute the statistics about the inserted sequences obtained from MindTheGap for one gap and one set of parameters:
+    - it takes as input the query records (inserted sequences), the reference records (reference sequence of the gap or flanking contigs' sequences), the size of the extension,
+      the prefix and directory of the stats files, the gap label, the gap size, the chunk size, the kmer size and abundance min values used to get the query sequences,
+      whether the reference records are the flanking contigs' sequences, a directory in which to run NUCmer (default: the stats directory),
+      the maximal length of the flanking contigs' regions to align them in-process with the PairwiseAligner instead of NUCmer (0: always NUCmer),
+      and the alignments of the previous (k, a) combinations of the gap ('AlignmentCache', only the sequences not aligned yet are aligned)
+    - the coords of the alignments are parsed once into typed rows, and the rows of the stats files are sorted and graded in memory
+    - it outputs the lists of typed rows of the stats files of the alignments ref vs qry (RefQryStats) and qry vs qry (QryQryStats), also saved in 'prefix.ref_qry.alignment.stats' and 'prefix.qry_qry.alignment.stats'
+'''
+def stats_alignment(qry_records, ref_records, ext, prefix, out_dir, qry_id, gap_size, chunk_size, k, a, flanking_contigs, work_dir=None, native=False, cache=None):
+    out_dir = os.path.abspath(out_dir)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    ref_qry_file = os.path.join(out_dir, prefix + ".ref_qry.alignment.stats")
+    qry_qry_file = os.path.join(out_dir, prefix + ".qry_qry.alignment.stats")
+    id_ = "{}.k{}.a{}".format(qry_id, k, a)
+    c = chunk_size
+
+    #Temporary directory for the NUCmer inputs and outputs ('.fasta', '.log', '.delta', ...), removed at the end
+    tmp_dir = tempfile.mkdtemp(prefix=id_ + ".", dir=(work_dir if work_dir is not None else out_dir))
+    ref_file = os.path.join(tmp_dir, id_ + ".reference.fasta")
+    SeqIO.write(ref_records, ref_file, "fasta")
+    if cache is None:
+        cache = AlignmentCache()
+    origin = "k{}.a{}".format(k, a)
+    ref_key = tuple((ref_record.id, str(ref_record.seq).upper()) for ref_record in ref_records)
+
+    try:
+        #-----------------------------------------------------------------------------
+        # Statistics about the Alignment Ref vs Qry
+        #-----------------------------------------------------------------------------
+        prefix_ref = os.path.join(tmp_dir, id_ + ".ref_qry")
+
+        if not flanking_contigs:
+            #----------------------------------------------------
+            # Ref = reference sequence of simulated gap
+            #----------------------------------------------------
+            #Run NUCmer to obtain alignment of the reference sequence against the query's sequences (only the sequences not aligned yet for the gap, in a single NUCmer run)
+            log_file = os.path.join(out_dir, id_ + ".ref_qry.log")
+            with open(log_file, "a") as log:
+                log.write("Query file: " + prefix_ref + ".insertions.fasta" + "\n")
+                log.write("Reference file" + str(ref_file) + "\n")
+                log.write("The results are saved in " + out_dir)
+
+            coords = sort_coords(cache.ref_qry_coords(("nucmer --maxmatch",) + ref_key, qry_records, origin, lambda records: nucmer_coords(ref_file, records, prefix_ref, ["--maxmatch"])))
+            g = gap_size
+
+            #Estimate quality of gapfilled sequence (length of query sequence equal +-10% of ref length, and quality of the alignment)
+            ref_qry_rows = []
+            for row in coords:
+                strand = "fwd" if "bkpt1" in row.tag_2 else "rev"
+                solution = row.tag_2.split('_sol_')[1]
+                qry_len = row.len_q - 2*ext
+                error_10_perc = int(0.1 * row.len_r)
+                if (row.len_r - error_10_perc) <= qry_len < (row.len_r + error_10_perc):
+                    quality_rq = ref_alignment_quality(row.len_1, row.len_2, row.len_r, qry_len)
                 else:
-                    with open(ref_qry_output, "a") as output:
-                        output.write('\t'.join(j for j in stats_legend))
-                        output.write('\n'+'\n' + '\t'.join(str(i) for i in stats))
-
-
-    #-----------------------------------------------------------------------------
-    # Statistics about the Alignment Qry vs Qry (fwd vs rev)
-    #-----------------------------------------------------------------------------
-    #Run NUCmer to obtain alignment of fwd strand solution against rev strand solution
-    prefix_qry = id_ + ".qry_qry"
-    nucmerLog_qry = "{}_nucmer_qry_qry.log".format(id_)
-    delta_file_qry = prefix_qry + ".delta"
-    coords_file_qry = prefix_qry + ".coords.unsorted"
-
-    nucmer_command_qry = ["nucmer", "--maxmatch", "-r", "-p", prefix_qry, qry_file, qry_file]
-    coords_command_qry = ["show-coords", "-rcdlT", delta_file_qry]
-
-    with open(coords_file_qry, "w") as coords_qry, open(nucmerLog_qry, "a") as log:
-        subprocess.run(nucmer_command_qry, stderr=log)
-        subprocess.run(coords_command_qry, stdout=coords_qry, stderr=log)
-    
-    #Sort the 'xxx.coords.unsorted' file for further analysis
-    coords_qry_sorted_file = prefix_qry + ".coords"
-    sort_command_qry = ["sort", "-n", coords_file_qry]
-    with open(coords_qry_sorted_file, "w") as coords_qry_sorted:
-        subprocess.run(sort_command_qry, stdout=coords_qry_sorted)
-
-    #Output stats file of alignment query vs ref
-    qry_qry_output = outDir + "/" + args.prefix + ".qry_qry.alignment.stats.unsorted"
-    stats_legend_qry = ["Gap", "Len_gap", "Chunk", "k", "a", "Solution1", "Len_Q1", "Solution2", "Len_Q2", \
-                        "Start_Q1", "End_Q1", "Start_Q2", "End_Q2", "Len_align_Q1", "Len_align_Q2", "%_Id", "%_Cov_Q1", "%_Cov_Q2", "Frame_Q1", "Frame_Q2", "Quality"]
-
-    #Get output values from NUCmer:
-    reader_qry = csv.DictReader(open(coords_qry_sorted_file), \
-                                fieldnames=("S1", 'E1', "S2", "E2", "LEN_1", "LEN_2", "%_IDY", "LEN_R", "LEN_Q", "COV_R", "COV_Q", "FRM_R", "FRM_Q", "TAG_1", "TAG_2"), \
-                                delimiter='\t')
-
-    rows_qry = list(reader_qry)
-    for row in rows_qry[3:]:
-
-        len_q1 = row["LEN_R"]
-        len_q2 = row["LEN_Q"]
-        start_q1 = row["S1"]
-        end_q1 = row["E1"]
-        start_q2 = row["S2"]
-        end_q2 = row["E2"]
-        len_align_q1 = row["LEN_1"]
-        len_align_q2 = row["LEN_2"]
-        identity = row["%_IDY"]
-        cov_q1 = row["COV_R"]
-        cov_q2 = row["COV_Q"]
-        frame_q1 = row["FRM_R"]
-        frame_q2 = row["FRM_Q"]
-
-        if "bkpt1" in str(row["TAG_1"]):
-            strand_q1 = "fwd"
-        else:
-            strand_q1 = "rev"
+                    quality_rq = 'D'
+                ref_qry_rows.append(RefQryStats(qry_id, g, c, k, a, strand, solution, row.len_q, row.tag_1, row.len_r, \
+                                                row.s1, row.e1, row.s2, row.e2, row.len_1, row.len_2, row.identity, row.cov_r, row.cov_q, row.frm_r, row.frm_q, quality_rq))
+
+            #If alignment in multiple chunks, calculate the appropriate quality score
+            ref_qry_rows = sort_ref_qry_rows(ref_qry_rows)
+            ref_qry_rows += merge_ref_qry_chunks(ref_qry_rows, ext)
 
-        if "bkpt1" in str(row["TAG_2"]):
-            strand_q2 = "fwd"
         else:
-            strand_q2 = "rev"
-        
-        solution_1 = strand_q1 + str(row["TAG_1"]).split('_sol_')[1]
-        solution_2 = strand_q2 + str(row["TAG_2"]).split('_sol_')[1]
-
-        # Estimate quality of gapfilled sequence (only for fwd vs rc_rev)
-        if solution_1 != solution_2:
-            
-            #lengths of both sequences are equal +-10%
-            if int(len_q1) in range((int(len_q2) - int(0.1*int(len_q2))), (int(len_q2) + int(0.1*int(len_q2)))):
-                #both sequences match to each other along all their length
-                if int(len_align_q1) == int(len_q1) and int(len_align_q2) == int(len_q2):
-                    quality_qq = 'A'
-                #one sequence match to the other along all its length or both sequences match to each other along their length +-10%
-                elif (int(len_align_q1) == int(len_q1) or int(len_align_q2) == int(len_q2)) or (int(len_align_q1) in range((int(len_q1) - int(0.1*int(len_q1))), (int(len_q1) + int(0.1*int(len_q1)))) or (int(len_align_q2) in range((int(len_q2) - int(0.1*int(len_q2))), (int(len_q2) + int(0.1*int(len_q2)))))):
-                    quality_qq = 'B'
-                #both sequences match to each other, but not along all their length (>= 50% of their length align)
-                elif int(len_align_q1) >= int(0.5*int(len_q1)) and int(len_align_q2) >= int(0.5*int(len_q2)):
-                    quality_qq = 'C'
-                else:
-                    quality_qq = 'D'
-            #lengths of both sequences are not equal +-10%
+            #----------------------------------------------------
+            # Ref = contigs' sequences
+            #----------------------------------------------------
+            #Align the extension portions (-ext) (of the flanking contigs) against the query's sequences: in-process with the PairwiseAligner if 'native' and if the sequences are short enough
+            #(only the sequences not aligned yet for the gap)
+            if native and all(len(ref_record.seq) <= NATIVE_MAX_REF_LENGTH for ref_record in ref_records) and all(len(qry_record.seq) <= NATIVE_MAX_QRY_LENGTH for qry_record in qry_records):
+                coords = cache.ref_qry_coords(("native",) + ref_key, qry_records, origin, lambda records: native_flank_coords(records, ref_records))
+
+            #Run NUCmer otherwise (in a single NUCmer run)
+            else:
+                log_file = os.path.join(out_dir, id_ + ".ref_qry.log")
+                with open(log_file, "a") as log:
+                    log.write("Query file: " + prefix_ref + ".insertions.fasta" + "\n")
+                    log.write("Reference file" + str(ref_file) + "\n")
+                    log.write("The results are saved in " + out_dir)
+
+                coords = cache.ref_qry_coords(("nucmer",) + ref_key, qry_records, origin, lambda records: nucmer_coords(ref_file, records, prefix_ref, []))
+
+            g = gap_size
+            if g == 0:
+                g = "NA"
+
+            #Estimate quality of the extensions of the gapfilled sequence
+            ref_qry_rows = []
+            for row in coords:
+                ref = row.tag_1.split("_")[0]
+                if ref in str(qry_id):
+                    strand = "fwd" if "bkpt1" in row.tag_2 else "rev"
+                    solution = row.tag_2.split('_sol_')[1]
+                    quality_rq = flank_alignment_quality(ref, strand, row.s2, row.e2, row.len_q, ext, qry_id)
+                    ref_qry_rows.append(RefQryStats(qry_id, g, c, k, a, strand, solution, row.len_q, ref, row.len_r, \
+                                                    row.s1, row.e1, row.s2, row.e2, row.len_1, row.len_2, row.identity, row.cov_r, row.cov_q, row.frm_r, row.frm_q, quality_rq))
+
+        #-----------------------------------------------------------------------------
+        # Statistics about the Alignment Qry vs Qry (fwd vs rev)
+        #-----------------------------------------------------------------------------
+        #Run NUCmer to obtain alignment of fwd strand solution against rev strand solution (only the sequences not aligned yet for the gap, against all the sequences of the gap,
+        #and the sequences already aligned against them)
+        prefix_qry = os.path.join(tmp_dir, id_ + ".qry_qry")
+        def align_qry_qry(ref_records, records):
+            ref_qry_file = prefix_qry + ".reference.fasta"
+            SeqIO.write(ref_records, ref_qry_file, "fasta")
+            return nucmer_coords(ref_qry_file, records, prefix_qry, ["--maxmatch", "-r"])
+        coords_qry = sort_coords(cache.qry_qry_coords(qry_records, origin, align_qry_qry))
+
+        #Estimate quality of gapfilled sequence (only for fwd vs rc_rev, lengths of both sequences equal +-10%)
+        qry_qry_rows = []
+        for row in coords_qry:
+            solution_1 = ("fwd" if "bkpt1" in row.tag_1 else "rev") + row.tag_1.split('_sol_')[1]
+            solution_2 = ("fwd" if "bkpt1" in row.tag_2 else "rev") + row.tag_2.split('_sol_')[1]
+            if solution_1 != solution_2 and (row.len_q - int(0.1*row.len_q)) <= row.len_r < (row.len_q + int(0.1*row.len_q)):
+                quality_qq = qry_alignment_quality(row.len_r, row.len_q, row.len_1, row.len_2)
             else:
                 quality_qq = 'D'
+            qry_qry_rows.append(QryQryStats(qry_id, g, c, k, a, solution_1, row.len_r, solution_2, row.len_q, \
+                                            row.s1, row.e1, row.s2, row.e2, row.len_1, row.len_2, row.identity, row.cov_r, row.cov_q, row.frm_r, row.frm_q, quality_qq))
 
-        else:
-            quality_qq = 'D'
+        #If alignment in multiple chunks, calculate the appropriate quality score
+        qry_qry_rows = sort_qry_qry_rows(qry_qry_rows)
+        merged_row = merge_qry_qry_chunks(qry_qry_rows)
+        if merged_row is not None:
+            qry_qry_rows.append(merged_row)
 
-        #Write stats results in output file
-        stats_qry = [qry_id, g, c, k, a, solution_1, len_q1, solution_2, len_q2, \
-                    start_q1, end_q1, start_q2, end_q2, len_align_q1, len_align_q2, identity, cov_q1, cov_q2, frame_q1, frame_q2, quality_qq]
+        #Write the stats files, each in a single pass
+        ref_qry_stats = write_stats_file(ref_qry_file, stats_legend, ref_qry_rows)
+        qry_qry_stats = write_stats_file(qry_qry_file, stats_legend_qry, qry_qry_rows)
 
-        if os.path.exists(qry_qry_output):
-            with open(qry_qry_output, "a") as output_qry:
-                output_qry.write('\n' + '\t'.join(str(i) for i in stats_qry))
-        else:
-            with open(qry_qry_output, "a") as output_qry:
-                output_qry.write('\t'.join(j for j in stats_legend_qry))
-                output_qry.write('\n'+'\n' + '\t'.join(str(i) for i in stats_qry))
-
-    #sort the 'xxx.align;ent.stats.unsorted' file for further analysis
-    qry_qry_sorted = outDir + "/" + args.prefix + ".qry_qry.alignment.stats"
-    order_command_qry = ["sort", "-n", qry_qry_output]
-    with open(qry_qry_sorted, "w") as f_sorted:
-        subprocess.run(order_command_qry, stdout=f_sorted)
-
-    #If alignment in multiple chunks, calculate the appropriate quality score
-    with open(qry_qry_sorted, "r") as f:
-        f.seek(0)
-        reader = csv.DictReader(f, fieldnames=("Gap", "Len_gap", "Chunk", "k", "a", "Solution1", "Len_Q1", "Solution2", "Len_Q2", \
-                                "Start_Q1", "End_Q1", "Start_Q2", "End_Q2", "Len_align_Q1", "Len_align_Q2", "%_Id", "%_Cov_Q1", "%_Cov_Q2", "Frame_Q1", "Frame_Q2", "Quality"), \
-                                delimiter='\t')
-
-        rows = list(reader)
-        lack_Q1 = 0
-        lack_Q2 = 0
-        for i in range(1, len(rows_qry)):
-            if ("fwd" in rows[i]["Solution1"]) and ("rev" in rows[i]["Solution2"]):
-
-                qry_id = rows[i]["Gap"]
-                g = rows[i]["Len_gap"]
-                c = rows[i]["Chunk"]
-                k = rows[i]["k"]
-                a = rows[i]["a"]
-                solution1 = rows[i]["Solution1"]
-                solution2 = rows[i]["Solution2"]
-                len_Q1 = int(rows[i]["Len_Q1"])
-                len_Q2 = int(rows[i]["Len_Q2"])
-                frame_Q1 = rows[i]["Frame_Q1"]
-                frame_Q2 = rows[i]["Frame_Q2"]
-
-                if (solution1 != rows[i-1]["Solution1"]) or (solution2 != rows[i-1]["Solution2"]):
-                    start_Q1 = int(rows[i]["Start_Q1"])
-                    end_Q2 = int(rows[i]["Start_Q2"])
-                    lack_Q1 += (start_Q1 - 1)
-                    lack_Q2 += (len_Q2 - end_Q2)
-
-                if (solution1 == rows[i-1]["Solution1"]) and (solution2 == rows[i-1]["Solution2"]):
-                    if int(rows[i]["Start_Q1"]) > int(rows[i-1]["End_Q1"]):
-                        lack_Q1 += (int(rows[i]["Start_Q1"]) - int(rows[i-1]["End_Q1"]))
-
-                    if int(rows[i]["Start_Q2"]) < int(rows[i-1]["End_Q2"]):
-                        lack_Q2 += (int(rows[i-1]["End_Q2"]) - int(rows[i]["Start_Q2"]))
-
-                if (solution1 != rows[i+1]["Solution1"]) or (solution2 != rows[i+1]["Solution2"]):
-                    end_Q1 = int(rows[i]["End_Q1"])
-                    start_Q2 = int(rows[i]["End_Q2"])
-                    lack_Q1 += (len_Q1 - end_Q1)
-                    lack_Q2 += (start_Q2 - 1)
-
-            elif ("fwd" in rows[i-1]["Solution1"]) and ("rev" in rows[i-1]["Solution2"]):
-                break
-
-        len_align_Q1 = len_Q1 - lack_Q1
-        len_align_Q2 = len_Q2 - lack_Q2
-
-        identity = "/"
-        cov_Q1 = "/"
-        cov_Q2 = "/"
-
-        #Assign a quality score
-        #both sequences match to each other along all their length
-        if len_align_Q1 == len_Q1 and len_align_Q2 == len_Q2:
-            quality_qq = 'A'
-        #one sequence match to the other along all its length or both sequences match to each other along their length +-10%
-        elif (len_align_Q1 == len_Q1 or len_align_Q2 == len_Q2) or (len_align_Q1 in range((len_Q1 - int(0.1*len_Q1)), (len_Q1 + int(0.1*len_Q1))) or len_align_Q2 in range((len_Q2 - int(0.1*len_Q2)), (len_Q2 + int(0.1*len_Q2)))):
-            quality_qq = 'B'
-        #both sequences match to each other, but not along all their length (>= 50% of their length align)
-        elif len_align_Q1 >= int(0.5*len_Q1) and len_align_Q2 >= int(0.5*len_Q2):
-            quality_qq = 'C'
-        else:
-            quality_qq = 'D'
-
-        #Write stats results in output file
-        stats_qry = [qry_id, g, c, k, a, solution1, len_Q1, solution2, len_Q2, \
-                    start_Q1, end_Q1, start_Q2, end_Q2, len_align_Q1, len_align_Q2, identity, cov_Q1, cov_Q2, frame_Q1, frame_Q2, quality_qq]
-
-        with open(qry_qry_sorted, "a") as output_qry:
-            output_qry.write('\n' + '\t'.join(str(i) for i in stats_qry))
-
-
-    #Remove the raw file obtained from statistics ('.log', '.delta', '.coords', '.unsorted' files)
-    subprocess.run(["rm", nucmerLog])
-    subprocess.run(["rm", nucmerLog_qry])
-    subprocess.run(["rm", delta_file])
-    subprocess.run(["rm", delta_file_qry])
-    subprocess.run(["rm", coords_file])
-    if not re.match('^.*.contigs.fasta$', args.reference):
-        subprocess.run(["rm", coords_sorted_file])  #only when refDir
-    subprocess.run(["rm", coords_file_qry])
-    subprocess.run(["rm", coords_qry_sorted_file])
-
-
-except Exception as e:
-    print("\nException-")
-    print(e)
-    exc_type, exc_obj, exc_tb = sys.exc_info()
-    fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-    print(exc_type, fname, exc_tb.tb_lineno)
-    sys.exit(1)
\ No newline at end of file
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return ref_qry_stats, qry_qry_stats
+
+
+#----------------------------------------------------
+# Command line
+#----------------------------------------------------
+if __name__ == "__main__":
+
+    #----------------------------------------------------
+    # Arg parser
+    #----------------------------------------------------
+    parser = argparse.ArgumentParser(prog="stats_alignment.py", usage="%(prog)s -qry <query_sequences_file> -ref <reference_sequence> -ext <extension_size> -p <output_file_prefix> [options]", \
+                                    formatter_class=argparse.RawTextHelpFormatter, \
+                                    description=(''' \
+                                    Statistics about the inserted sequence obtained from MindTheGap (-qry)
+                                    Note: there are kmer flanking regions on the edges of the inserted sequence (which are included in '-ext' bp flanking regions)
+                                    '''))
+
+    parser.add_argument("-qry", "--query", action="store", help="file containing the inserted sequences obtained from MindTheGap (format: 'xxx.insertions.fasta')", required=True)
+    parser.add_argument("-ref", "--reference", action="store", help="file containing the reference sequence of the gap (format: 'xxx.fasta')", required=True)
+    parser.add_argument("-ext", "--ext", action="store", type=int, help="size of the gap, on both sides; determine start/end of gapfilling", required=True)
+    parser.add_argument("-p", "--prefix", action="store", help="prefix of output file to save the statistical results", required=True)
+    parser.add_argument("-out", "--outDir", action="store", default="./mtglink_results/alignments_stats", help="output directory for saving results")
+    parser.add_argument("--native", action="store_true", help="to align the flanking contigs' regions in-process with the pairwise aligner of Biopython instead of NUCmer (regions up to {} bp and inserted sequences up to {} bp)".format(NATIVE_MAX_REF_LENGTH, NATIVE_MAX_QRY_LENGTH))
+
+    args = parser.parse_args()
+
+    if re.match('^.*.insertions.fasta$', args.query) is None:
+        parser.error("Warning: Qualitative evaluation _ The suffix of the inserted sequences (query sequences) file should be: '.insertions.fasta'")
+
+    if re.match('^.*.fasta$', args.reference) is None:
+        parser.error("Warning: Qualitative evaluation _ The suffix of the reference sequence file should be: '.fasta'")
+
+    #----------------------------------------------------
+    # Input files
+    #----------------------------------------------------
+    qry_file = os.path.abspath(args.query)
+    if not os.path.exists(args.query):
+        parser.error("Warning: Qualitative evaluation _ The path of the query file (inserted sequences file) doesn't exist")
+
+    ref_file = os.path.abspath(args.reference)
+    if not os.path.exists(ref_file):
+        parser.error("Warning: Qualitative evaluation _ The path of the reference file doesn't exist")
+
+    try:
+        #Get the gap label, gap size, chunk size, kmer size and abundance min values from the name of the query file
+        qry_fields = qry_file.split('.')
+        qry_id = qry_fields[-9]
+        gap_size = int(qry_fields[-8][1:])
+        chunk_size = int(qry_fields[-7][1:])
+        k = int(qry_fields[-6][1:])
+        a = int(qry_fields[-5][1:])
+
+        stats_alignment(list(SeqIO.parse(qry_file, "fasta")), list(SeqIO.parse(ref_file, "fasta")), args.ext, args.prefix, args.outDir, \
+                        qry_id, gap_size, chunk_size, k, a, re.match('^.*.contigs.fasta$', args.reference) is not None, \
+                        native=args.native)
+
+    except Exception as e:
+        print("\nException-")
+        print(e)
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        print(exc_type, fname, exc_tb.tb_lineno)
+        sys.exit(1)
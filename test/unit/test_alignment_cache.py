@@ -0,0 +1,84 @@
+import pytest
+
+pytest.importorskip("Bio")
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from stats_alignment import AlignmentCache, Coords
+
+
+def records(sequences, strand="bkpt1"):
+    return [SeqRecord(Seq(sequence), id="A+_B+_GapID.x_{}_sol_{}/{}".format(strand, i, len(sequences))) for i, sequence in enumerate(sequences, 1)]
+
+def coords(tag_1, tag_2):
+    return Coords(1, 10, 1, 10, 10, 10, "100.00", 10, 10, "100.00", "100.00", 1, 1, tag_1, tag_2)
+
+
+class FakeAligner:
+    '''Aligner recording its calls, with one alignment per pair of sequences'''
+    def __init__(self):
+        self.calls = []
+
+    def ref_qry(self, qry_records):
+        self.calls.append([str(record.seq) for record in qry_records])
+        return [coords("ref", record.id) for record in qry_records]
+
+    def qry_qry(self, ref_records, qry_records):
+        self.calls.append(([str(record.seq) for record in ref_records], [str(record.seq) for record in qry_records]))
+        return [coords(ref_record.id, qry_record.id) for ref_record in ref_records for qry_record in qry_records]
+
+
+def test_ref_qry_aligns_each_distinct_sequence_once():
+    cache = AlignmentCache()
+    aligner = FakeAligner()
+
+    rows = cache.ref_qry_coords(("nucmer", "ref"), records(["AAAA", "CCCC", "AAAA"]), "k51.a3", aligner.ref_qry)
+    assert aligner.calls == [["AAAA", "CCCC"]]
+    assert [row.tag_2 for row in rows] == ["A+_B+_GapID.x_bkpt1_sol_1/3", "A+_B+_GapID.x_bkpt1_sol_2/3", "A+_B+_GapID.x_bkpt1_sol_3/3"]
+    assert (cache.nb_aligned, cache.nb_reused) == (2, 0)
+
+    #next (k, a): only the new sequence is aligned, the rows of the known ones are reused with the IDs of the new records
+    rows = cache.ref_qry_coords(("nucmer", "ref"), records(["CCCC", "GGGG"]), "k41.a3", aligner.ref_qry)
+    assert aligner.calls[1:] == [["GGGG"]]
+    assert [row.tag_2 for row in rows] == ["A+_B+_GapID.x_bkpt1_sol_1/2", "A+_B+_GapID.x_bkpt1_sol_2/2"]
+    assert (cache.nb_aligned, cache.nb_reused) == (3, 1)
+
+    #all known: no alignment
+    cache.ref_qry_coords(("nucmer", "ref"), records(["GGGG"]), "k31.a3", aligner.ref_qry)
+    assert len(aligner.calls) == 2
+
+def test_ref_qry_is_keyed_on_the_reference():
+    cache = AlignmentCache()
+    aligner = FakeAligner()
+    cache.ref_qry_coords(("nucmer", "ref1"), records(["AAAA"]), "k51.a3", aligner.ref_qry)
+    cache.ref_qry_coords(("native", "ref1"), records(["AAAA"]), "k51.a3", aligner.ref_qry)
+    assert len(aligner.calls) == 2
+
+def test_sequence_without_alignment_is_cached():
+    cache = AlignmentCache()
+    calls = []
+    def align(qry_records):
+        calls.append(qry_records)
+        return []
+    assert cache.ref_qry_coords(("nucmer", "ref"), records(["AAAA"]), "k51.a3", align) == []
+    assert cache.ref_qry_coords(("nucmer", "ref"), records(["AAAA"]), "k51.a2", align) == []
+    assert len(calls) == 1
+
+def test_qry_qry_aligns_only_the_new_sequences():
+    cache = AlignmentCache()
+    aligner = FakeAligner()
+
+    rows = cache.qry_qry_coords(records(["AAAA"]) + records(["CCCC"], "bkpt2"), "k51.a3", aligner.qry_qry)
+    assert aligner.calls == [(["AAAA", "CCCC"], ["AAAA", "CCCC"])]
+    assert len(rows) == 4
+
+    #one new sequence: aligned against the known ones and itself, and the known ones against it
+    rows = cache.qry_qry_coords(records(["AAAA", "GGGG"]) + records(["CCCC"], "bkpt2"), "k41.a3", aligner.qry_qry)
+    assert aligner.calls[1:] == [(["AAAA", "CCCC", "GGGG"], ["GGGG"]), (["GGGG"], ["AAAA", "CCCC"])]
+    assert len(rows) == 9
+    assert set((row.tag_1, row.tag_2) for row in rows) == set((record1.id, record2.id) for record1 in records(["AAAA", "GGGG"]) + records(["CCCC"], "bkpt2") \
+                                                              for record2 in records(["AAAA", "GGGG"]) + records(["CCCC"], "bkpt2"))
+
+    #all the pairs known: no alignment
+    cache.qry_qry_coords(records(["GGGG"]) + records(["CCCC"], "bkpt2"), "k31.a3", aligner.qry_qry)
+    assert len(aligner.calls) == 3
@@ -0,0 +1,86 @@
+import os
+import pickle
+import pytest
+
+pytest.importorskip("gfapy")
+pytest.importorskip("Bio")
+
+import helpers
+from helpers import load_gfa_tables, GFA_CACHE_HEADER, GFA_CACHE_MAGIC, GFA_CACHE_VERSION
+
+
+GFA = "H\tVN:Z:2.0\nS\t8-L\t5000\tACGT\nS\t8-R\t5000\tACGT\nG\tgap8\t8-L+\t8-R+\t1000\t*\n"
+
+@pytest.fixture
+def gfa_file(tmp_path):
+    path = tmp_path / "test.gfa"
+    path.write_text(GFA)
+    return str(path)
+
+@pytest.fixture
+def digests(monkeypatch):
+    calls = []
+    file_digest = helpers.file_digest
+    def counting_digest(path, *args):
+        calls.append(path)
+        return file_digest(path, *args)
+    monkeypatch.setattr(helpers, "file_digest", counting_digest)
+    return calls
+
+def gap_lines(tables):
+    return [str(gap) for gap in tables.gaps]
+
+
+def test_cache_hit_does_not_hash_the_gfa(gfa_file, digests):
+    tables = load_gfa_tables(gfa_file)
+    assert os.path.exists(gfa_file + ".mtglink.cache")
+    assert len(digests) == 1
+
+    cached = load_gfa_tables(gfa_file)
+    assert len(digests) == 1
+    assert gap_lines(cached) == gap_lines(tables)
+    assert [segment.name for segment in cached.segments] == ["8-L", "8-R"]
+
+def test_touched_gfa_is_hashed_once(gfa_file, digests):
+    load_gfa_tables(gfa_file)
+    os.utime(gfa_file, ns=(1, 1))
+
+    #same content: the sidecar is reused and its header updated
+    load_gfa_tables(gfa_file)
+    assert len(digests) == 2
+    load_gfa_tables(gfa_file)
+    assert len(digests) == 2
+
+def test_modified_gfa_is_parsed_again(gfa_file):
+    load_gfa_tables(gfa_file)
+    with open(gfa_file, "w") as f:
+        f.write(GFA.replace("1000", "2000"))
+    assert [gap.disp for gap in load_gfa_tables(gfa_file).gaps] == [2000]
+
+def test_same_size_modification_is_detected(gfa_file):
+    load_gfa_tables(gfa_file)
+    with open(gfa_file, "w") as f:
+        f.write(GFA.replace("1000", "3000"))
+    os.utime(gfa_file, ns=(1, 1))
+    assert [gap.disp for gap in load_gfa_tables(gfa_file).gaps] == [3000]
+
+@pytest.mark.parametrize("payload", [b"garbage", pickle.dumps(pickle.PicklingError("x"))[:-3], b"cmissing_module_of_another_version\nTables\n."])
+def test_invalid_cache_is_rebuilt(gfa_file, payload):
+    stat = os.stat(gfa_file)
+    with open(gfa_file + ".mtglink.cache", "wb") as f:
+        f.write(GFA_CACHE_HEADER.pack(GFA_CACHE_MAGIC, GFA_CACHE_VERSION, stat.st_size, stat.st_mtime_ns, stat.st_ino, b"\0" * 32, len(payload)))
+        f.write(payload)
+    assert gap_lines(load_gfa_tables(gfa_file)) == ["G\tgap8\t8-L+\t8-R+\t1000\t*"]
+    #the sidecar is rewritten
+    assert gap_lines(load_gfa_tables(gfa_file)) == ["G\tgap8\t8-L+\t8-R+\t1000\t*"]
+
+def test_truncated_and_empty_cache_are_rebuilt(gfa_file):
+    load_gfa_tables(gfa_file)
+    cache_file = gfa_file + ".mtglink.cache"
+    size = os.path.getsize(cache_file)
+    with open(cache_file, "r+b") as f:
+        f.truncate(size - 10)
+    assert len(load_gfa_tables(gfa_file).gaps) == 1
+    open(cache_file, "w").close()
+    assert len(load_gfa_tables(gfa_file).gaps) == 1
+    assert os.path.getsize(cache_file) == size
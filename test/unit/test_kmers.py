@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip("gfapy")
+pytest.importorskip("Bio")
+
+from helpers import count_kmers, kmer_spectrum, select_kmer_abundance, SPECTRUM_SOLID_RATIO
+
+
+def write_reads(path, sequences):
+    with open(path, "w") as reads:
+        for i, sequence in enumerate(sequences):
+            reads.write("@read{}\n{}\n+\n{}\n".format(i, sequence, "I" * len(sequence)))
+
+
+def test_count_kmers_on_both_strands(tmp_path):
+    reads_file = str(tmp_path / "union.fastq")
+    write_reads(reads_file, ["ACGTTGCAAC", "gttgcaacgt", "AAAAA", "TTGCATTGCA"])
+    counts = count_kmers(reads_file, ["TTGCA", "GTTGC", "AAAA", "CCCCC", ""])
+
+    #'TTGCA' in the reads 1, 2 and twice in the read 4, and its reverse complement 'TGCAA' in the reads 1 and 2
+    assert counts["TTGCA"] == 4 + 2
+    assert counts["GTTGC"] == 2 + 2
+    #overlapping occurrences, on both strands ('TTTT' not in the reads)
+    assert counts["AAAA"] == 2
+    assert counts["CCCCC"] == 0
+    assert counts[""] == 0
+
+def test_count_kmers_palindrome_counted_once(tmp_path):
+    reads_file = str(tmp_path / "union.fastq")
+    write_reads(reads_file, ["AAACGTAAA"])
+    assert count_kmers(reads_file, ["ACGT"]) == {"ACGT": 1}
+
+def test_kmer_spectrum_coverage(tmp_path):
+    reads_file = str(tmp_path / "union.fastq")
+    write_reads(reads_file, ["GGACATTGCAGG"] * 6 + ["GGACAGGTCCGG"])
+    spectrum = kmer_spectrum(reads_file, [5])
+    assert spectrum[5]["Coverage"] == 6
+    assert spectrum[5]["Nb_kmers"] > 0
+
+
+def test_select_kmer_abundance():
+    spectrum = {51: {"Coverage": 4}, 41: {"Coverage": 7}, 31: {"Coverage": 12}}
+    selected = select_kmer_abundance(spectrum, [51, 41, 31], [3, 2])
+    assert selected == [(k, a) for k in [51, 41, 31] for a in [3, 2] if spectrum[k]["Coverage"] >= SPECTRUM_SOLID_RATIO * a]
+    assert (51, 3) not in selected and (51, 2) in selected and (31, 3) in selected
+
+def test_select_kmer_abundance_keeps_all_if_none_promising():
+    spectrum = {51: {"Coverage": 0}, 41: {"Coverage": 1}}
+    assert select_kmer_abundance(spectrum, [51, 41], [3, 2]) == [(51, 3), (51, 2), (41, 3), (41, 2)]
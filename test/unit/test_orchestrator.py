@@ -0,0 +1,48 @@
+import queue
+import asyncio
+import threading
+
+from orchestrator import UnionPrefetcher
+
+
+def test_prefetcher_bounds_the_look_ahead_and_keeps_the_order():
+    lock = threading.Lock()
+    state = {"in_flight": 0, "peak": 0, "started": []}
+
+    async def extract(job, tool_semaphores):
+        with lock:
+            state["started"].append(job)
+            state["in_flight"] += 1
+            state["peak"] = max(state["peak"], state["in_flight"])
+        await asyncio.sleep(0.001)
+        return {"union_reads_file": job, "nb_barcodes": 1}
+
+    prefetcher = UnionPrefetcher(extract, 2, {}, nb_workers=3)
+    items = prefetcher.run([(i, "gap{}".format(i)) for i in range(20)])
+
+    #the pool takes all the items as soon as they are yielded
+    taken = queue.Queue()
+    threading.Thread(target=lambda: [taken.put(item) for item in items], daemon=True).start()
+    keys = []
+    for _ in range(20):
+        key, union = taken.get()
+        keys.append(key)
+        with lock:
+            state["in_flight"] -= 1
+        prefetcher.done()
+
+    assert sorted(keys) == list(range(20))
+    #the extractions are started in the order of the list (longest-expected-first order of the gaps)
+    assert state["started"] == ["gap{}".format(i) for i in range(20)]
+    assert state["peak"] <= 3 + 2
+
+def test_prefetcher_passes_the_failures_to_the_workers():
+    async def extract(job, tool_semaphores):
+        raise OSError("BamExtractor not found")
+
+    prefetcher = UnionPrefetcher(extract, 1, {}, nb_workers=1)
+    results = []
+    for key, union in prefetcher.run([("gap0", {"gap_label": "gap0"})]):
+        results.append((key, union))
+        prefetcher.done()
+    assert results == [("gap0", {"error": "BamExtractor not found"})]
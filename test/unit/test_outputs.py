@@ -0,0 +1,80 @@
+import os
+import pytest
+
+pytest.importorskip("gfapy")
+pytest.importorskip("Bio")
+
+from helpers import GapJournal, GapOutputWriter
+
+
+def gap_result(i):
+    return ["gap{}".format(i), "s{}L+".format(i), "s{}R+".format(i), 100*i, 5000, i, 10*i], [["G\tgap{}\ts{}L+\ts{}R+\t{}\t*".format(i, i, i, 100*i)]]
+
+
+def test_journal_resume(tmp_path):
+    journal = GapJournal(str(tmp_path / "run.journal.jsonl"))
+    assert journal.load() == {}
+    journal.reset()
+    for i in range(3):
+        journal.record("gap{}".format(i), *gap_result(i))
+
+    finished = GapJournal(journal.journal_file).load()
+    assert list(finished) == ["gap0", "gap1", "gap2"]
+    assert finished["gap1"] == gap_result(1)
+
+def test_journal_drops_a_truncated_last_line(tmp_path):
+    journal = GapJournal(str(tmp_path / "run.journal.jsonl"))
+    journal.reset()
+    journal.record("gap0", *gap_result(0))
+    journal.record("gap1", *gap_result(1))
+    size = os.path.getsize(journal.journal_file)
+    #crash in the middle of the record of the third gap
+    with open(journal.journal_file, "a") as f:
+        f.write('{"Gap": "gap2", "union_summary": [')
+
+    finished = journal.load()
+    assert list(finished) == ["gap0", "gap1"]
+    assert os.path.getsize(journal.journal_file) == size
+
+    #the resumed run appends its gaps after the last complete line
+    journal.record("gap2", *gap_result(2))
+    assert list(journal.load()) == ["gap0", "gap1", "gap2"]
+
+def test_journal_drops_an_unparsable_last_line(tmp_path):
+    journal = GapJournal(str(tmp_path / "run.journal.jsonl"))
+    journal.reset()
+    journal.record("gap0", *gap_result(0))
+    with open(journal.journal_file, "a") as f:
+        f.write("not json\n")
+    assert list(journal.load()) == ["gap0"]
+
+
+def write_outputs(out_dir, order, stable_order=None):
+    paths = [os.path.join(out_dir, name) for name in ["out.union.sum", "out.gfa", "out.gapfill_seq.fasta"]]
+    with open(paths[0], "w") as union_sum:
+        union_sum.write("Gap_ID\tLeft_scaffold")
+    with open(paths[1], "w") as gfa:
+        gfa.write("H\tVN:Z:2.0\n")
+    open(paths[2], "w").close()
+
+    writer = GapOutputWriter(out_dir, *paths)
+    for i in order:
+        writer.write_gap("gap{}".format(i), *gap_result(i))
+    writer.close()
+    if stable_order is not None:
+        writer.reorder(["gap{}".format(i) for i in stable_order])
+    return [open(path).read() for path in paths]
+
+def test_output_writer_reorders_the_blocks(tmp_path):
+    (tmp_path / "completion").mkdir()
+    (tmp_path / "gfa_order").mkdir()
+    #gaps done in a different order than the GFA file, reordered with '--stable-order'
+    reordered = write_outputs(str(tmp_path / "completion"), [3, 0, 2, 1], stable_order=[0, 1, 2, 3])
+    expected = write_outputs(str(tmp_path / "gfa_order"), [0, 1, 2, 3])
+    assert reordered == expected
+    assert reordered[1].splitlines()[0] == "H\tVN:Z:2.0"
+    assert [line.split("\t")[1] for line in reordered[1].splitlines()[1:]] == ["gap0", "gap1", "gap2", "gap3"]
+
+def test_output_writer_keeps_the_completion_order_by_default(tmp_path):
+    outputs = write_outputs(str(tmp_path), [3, 0, 2, 1])
+    assert [line.split("\t")[0] for line in outputs[0].splitlines()[1:]] == ["gap3", "gap0", "gap2", "gap1"]
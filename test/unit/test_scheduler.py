@@ -0,0 +1,94 @@
+from scheduler import SpeculativeSweep, GapTimeBudget, RunTelemetry, BarcodeReuse
+from runner import ProcessResult
+
+
+class FakeRun:
+    def __init__(self, combination, log):
+        self.combination = combination
+        self.log = log
+
+    def wait(self):
+        self.log.append(("wait", self.combination))
+        return self.combination
+
+    def cancel(self):
+        self.log.append(("cancel", self.combination))
+
+
+def make_sweep(combinations, window, available=None):
+    log = []
+    def start(combination, blocking):
+        if not blocking and available is not None and len([entry for entry in log if entry[0] == "start"]) >= available:
+            return None
+        log.append(("start", combination))
+        return FakeRun(combination, log)
+    return SpeculativeSweep(combinations, start, window), log
+
+
+def test_sequential_sweep():
+    combinations = [(51, 3), (51, 2), (41, 3)]
+    sweep, log = make_sweep(combinations, 1)
+    assert [sweep.run(combination) for combination in combinations] == combinations
+    assert log == [("start", (51, 3)), ("wait", (51, 3)), ("start", (51, 2)), ("wait", (51, 2)), ("start", (41, 3)), ("wait", (41, 3))]
+
+def test_speculative_sweep_starts_the_next_combinations_in_order():
+    combinations = [(51, 3), (51, 2), (41, 3), (41, 2)]
+    sweep, log = make_sweep(combinations, 3)
+    assert sweep.run((51, 3)) == (51, 3)
+    assert [entry for entry in log if entry[0] == "start"] == [("start", (51, 3)), ("start", (51, 2)), ("start", (41, 3))]
+    assert sweep.run((51, 2)) == (51, 2)
+    assert log[-2:] == [("start", (41, 2)), ("wait", (51, 2))]
+
+def test_speculative_sweep_cancels_the_skipped_and_remaining_runs():
+    combinations = [(51, 3), (51, 2), (41, 3), (41, 2)]
+    sweep, log = make_sweep(combinations, 3)
+    sweep.run((51, 3))
+    #(51, 2) skipped by the sequential sweep
+    assert sweep.run((41, 3)) == (41, 3)
+    assert ("cancel", (51, 2)) in log
+    #solution found: the runs not consumed are cancelled
+    sweep.cancel()
+    assert ("cancel", (41, 2)) in log
+    assert sweep.nb_cancelled == 2
+    assert sweep.runs == {}
+
+def test_speculative_sweep_waits_for_resources():
+    combinations = [(51, 3), (51, 2), (41, 3)]
+    sweep, log = make_sweep(combinations, 3, available=1)
+    sweep.run((51, 3))
+    assert [entry for entry in log if entry[0] == "start"] == [("start", (51, 3))]
+    #a blocking start for the next combination to consume
+    assert sweep.run((51, 2)) == (51, 2)
+
+
+def test_gap_time_budget_charges_shared_runs_once():
+    budget = GapTimeBudget(gap_cpu_limit=10.0)
+    budget.limits()
+    assert budget.add(ProcessResult(0, 100.0, 4.0, 5.0, False)) is None
+    assert budget.add(ProcessResult(0, 100.0, 4.0, 5.0, False), charge=False) is None
+    assert budget.cpu_used == 4.0
+    assert budget.exhausted() is None
+    budget.add(ProcessResult(0, 100.0, 7.0, 5.0, True))
+    assert budget.exhausted() == "gap_cpu"
+
+
+def test_run_reports_are_written_to_the_stats_file(tmp_path, capsys):
+    telemetry = RunTelemetry(3)
+    telemetry.end = telemetry.start = 0.0
+    telemetry.add(0, 0.0, 4.0)
+    telemetry.add(1, 1.0, 3.0)
+    telemetry.end = 4.0
+    reuse = BarcodeReuse()
+    reuse.add(0, {"A", "B"})
+    reuse.add(1, {"A", "C"})
+    stats_file = tmp_path / "run.stats"
+    with open(str(stats_file), "w") as run_stats:
+        telemetry.report(run_stats)
+        reuse.report(run_stats)
+
+    assert capsys.readouterr().out == ""
+    lines = stats_file.read_text().splitlines()
+    assert lines[0] == "Makespan of the run: 4.0 s (3 workers)"
+    assert lines[1:4] == ["\tWorker 0: 1 gap(s), busy 4.0 s (100.0%)", "\tWorker 1: 1 gap(s), busy 2.0 s (50.0%)", "\t1 worker(s) never received a gap"]
+    assert lines[4] == "\tMean utilisation: 50.0%"
+    assert lines[5] == "Estimated cache hit rate (barcodes of the union already in the union of the previous gap): 0.0% per worker, 25.0% on the node"
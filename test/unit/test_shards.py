@@ -0,0 +1,112 @@
+import os
+import pytest
+
+pytest.importorskip("gfapy")
+pytest.importorskip("Bio")
+
+from helpers import GapRecord, GapJournal, GapOutputWriter, shard_name, write_shard_manifest, load_shard_manifests, load_shard_results
+from scheduler import shard_gaps
+
+
+def make_gaps(lengths):
+    return [GapRecord("gap{}".format(i), "s{}L+".format(i), "s{}R+".format(i), length, "G\tgap{}\ts{}L+\ts{}R+\t{}\t*".format(i, i, i, length)) for i, length in enumerate(lengths)]
+
+def gap_key(gap):
+    return str(gap.sid1) +"_"+ str(gap.sid2)
+
+def no_solution(gap):
+    return ([str(gap.gid), str(gap.sid1), str(gap.sid2), gap.disp, 5000, 10, 100], [[str(gap)]])
+
+
+def test_shard_gaps_is_a_balanced_partition():
+    gaps = make_gaps([1000, 200, 5000, 300, 800, 2500, 100, 0, -10])
+    shards = shard_gaps(gaps, 3)
+
+    assert len(shards) == 3
+    assert sorted(gap.gid for shard in shards for gap in shard) == sorted(gap.gid for gap in gaps)
+    #the gaps keep the order of the GFA file in each shard
+    for shard in shards:
+        assert [gaps.index(gap) for gap in shard] == sorted(gaps.index(gap) for gap in shard)
+    #greedy longest-first: the loads differ by at most the longest gap
+    loads = [sum(max(gap.disp, 0) for gap in shard) for shard in shards]
+    assert max(loads) - min(loads) <= 5000
+    #deterministic
+    assert shard_gaps(gaps, 3) == shards
+
+def test_shard_gaps_with_more_shards_than_gaps():
+    gaps = make_gaps([100, 200])
+    shards = shard_gaps(gaps, 4)
+    assert [len(shard) for shard in shards] == [1, 1, 0, 0]
+
+
+def run_shard(tmp_path, gfa_file, gaps, shard, nb_shards):
+    name = shard_name("test.gfa", shard, nb_shards)
+    journal = GapJournal(str(tmp_path / (name + ".journal.jsonl")))
+    journal.reset()
+    for gap in gaps:
+        union_summary, output_for_gfa = no_solution(gap)
+        journal.record(gap_key(gap), union_summary, output_for_gfa)
+    write_shard_manifest(str(tmp_path / (name + ".manifest.json")), gfa_file, shard, nb_shards, [gap_key(gap) for gap in gaps], {"Journal": journal.journal_file})
+
+def write_outputs(out_dir, prefix, results):
+    paths = [os.path.join(out_dir, prefix + suffix) for suffix in [".union.sum", ".gfa", ".gapfill_seq.fasta"]]
+    for path in paths:
+        open(path, "w").close()
+    writer = GapOutputWriter(out_dir, *paths)
+    for key, (union_summary, output_for_gfa) in results:
+        writer.write_gap(key, union_summary, output_for_gfa)
+    writer.close()
+    return [open(path).read() for path in paths]
+
+def test_shard_manifest_merge_round_trip(tmp_path):
+    gaps = make_gaps([1000, 200, 5000, 300, 800, 2500, 100])
+    gfa_file = str(tmp_path / "test.gfa")
+    with open(gfa_file, "w") as gfa:
+        gfa.write("H\tVN:Z:2.0\n" + "".join(str(gap) + "\n" for gap in gaps))
+
+    #the shards are run locally, in reverse order
+    nb_shards = 3
+    for shard, shard_gap_records in reversed(list(enumerate(shard_gaps(gaps, nb_shards), 1))):
+        run_shard(tmp_path, gfa_file, shard_gap_records, shard, nb_shards)
+
+    manifests = load_shard_manifests(gfa_file, "test.gfa", str(tmp_path))
+    assert [manifest["Shard"] for manifest in manifests] == [1, 2, 3]
+    gap_keys = [gap_key(gap) for gap in gaps]
+    merged = load_shard_results(manifests, gap_keys)
+    assert merged == [tuple(no_solution(gap)) for gap in gaps]
+
+    #same output files as a single-node run
+    merged_dir = tmp_path / "merged"
+    single_dir = tmp_path / "single"
+    merged_dir.mkdir()
+    single_dir.mkdir()
+    assert write_outputs(str(merged_dir), "test.gfa", zip(gap_keys, merged)) == write_outputs(str(single_dir), "test.gfa", [(gap_key(gap), no_solution(gap)) for gap in gaps])
+
+def test_merge_detects_missing_and_incomplete_shards(tmp_path):
+    gaps = make_gaps([1000, 200, 5000, 300])
+    gfa_file = str(tmp_path / "test.gfa")
+    with open(gfa_file, "w") as gfa:
+        gfa.write("".join(str(gap) + "\n" for gap in gaps))
+    shards = shard_gaps(gaps, 2)
+
+    run_shard(tmp_path, gfa_file, shards[0], 1, 2)
+    with pytest.raises(ValueError, match="Missing shard"):
+        load_shard_manifests(gfa_file, "test.gfa", str(tmp_path))
+
+    #shard 2 interrupted after its first gap
+    run_shard(tmp_path, gfa_file, shards[1][:1], 2, 2)
+    name = shard_name("test.gfa", 2, 2)
+    write_shard_manifest(str(tmp_path / (name + ".manifest.json")), gfa_file, 2, 2, [gap_key(gap) for gap in shards[1]], {"Journal": str(tmp_path / (name + ".journal.jsonl"))})
+    with pytest.raises(ValueError, match="incomplete"):
+        load_shard_results(load_shard_manifests(gfa_file, "test.gfa", str(tmp_path)), [gap_key(gap) for gap in gaps])
+
+def test_merge_rejects_another_gfa_file(tmp_path):
+    gaps = make_gaps([1000])
+    gfa_file = str(tmp_path / "test.gfa")
+    with open(gfa_file, "w") as gfa:
+        gfa.write(str(gaps[0]) + "\n")
+    run_shard(tmp_path, gfa_file, gaps, 1, 1)
+    with open(gfa_file, "a") as gfa:
+        gfa.write("S\textra\t10\t*\n")
+    with pytest.raises(ValueError, match="different GFA file"):
+        load_shard_manifests(gfa_file, "test.gfa", str(tmp_path))